@@ -36,6 +36,7 @@ exe = EXE(
     upx=True,
     upx_exclude=[],
     runtime_tmpdir=None,
+    # GUI 専用のビルド。コマンドラインモードは python flag_auto_generator.py で実行する（README 参照）
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -0,0 +1 @@
+"""生成処理の性能を計測するベンチマーク群。"""
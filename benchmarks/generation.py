@@ -0,0 +1,214 @@
+"""合成テンプレートで `build_request_formulas` / `write_measurement_not_required` の所要時間を計測するベンチマーク。
+
+基準ケース（測定 37・工具 2・自動測定 3・測定不要 2）から 1 項目ずつ規模を変えたケースを計測し、
+全体と工程ごとの所要時間（中央値）を基準値（benchmarks/baselines/generation.json）と比べる。
+基準値はリポジトリに含め、計測した PC・Python・openpyxl の情報を一緒に記録する。速さに関わる変更では
+同じ PC で --save-baseline を付けて基準値を更新し、変更と一緒にコミットすると差分がレビューに出る。
+記録と違う環境で比較した場合は、その旨を表示したうえで同じ許容幅で比べる。
+
+実行例:
+    py -3.12 -m benchmarks.generation                  # 計測して基準値と比較（遅くなったケースがあれば終了コード 1）
+    py -3.12 -m benchmarks.generation --grid           # 全組み合わせを計測
+    py -3.12 -m benchmarks.generation --save-baseline  # 計測結果で基準値を更新
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import openpyxl
+
+from flag_auto_generator_app.app_cache import DISABLE_CACHE_ENV
+from flag_auto_generator_app.excel_ops import build_request_formulas, write_measurement_not_required
+from flag_auto_generator_app.phase_timing import collect_phase_timings, phase_label
+
+from .synthetic_template import (
+    DEFAULT_SPEC,
+    TemplateSpec,
+    build_synthetic_template,
+    synthetic_cfg,
+    synthetic_not_required_nos,
+)
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "generation.json")
+SWEEP = {
+    "measure_count": (10, 37, 80),
+    "tool_count": (1, 2, 5),
+    "auto_data_count": (0, 3, 10),
+    "not_required_count": (0, 2, 10),
+}
+TARGETS = ("build_request_formulas", "write_measurement_not_required")
+# 基準値より何割遅くなったら劣化とみなすか。短いケースの揺れを拾わないよう、差が MIN_DELTA 秒未満なら無視する
+DEFAULT_TOLERANCE = 0.3
+MIN_DELTA = 0.05
+
+
+def sweep_cases(grid: bool) -> list[TemplateSpec]:
+    if grid:
+        return [TemplateSpec(*values) for values in itertools.product(*SWEEP.values())]
+    cases = [DEFAULT_SPEC]
+    for field, values in SWEEP.items():
+        for value in values:
+            spec = DEFAULT_SPEC._replace(**{field: value})
+            if spec not in cases:
+                cases.append(spec)
+    return cases
+
+
+def _run_target(target: str, template_path: str, out_path: str, spec: TemplateSpec) -> tuple[float, dict]:
+    cfg = synthetic_cfg(spec)
+    # 生成処理の [info] 表示で結果の表が読みにくくならないよう、計測中の標準出力は捨てる
+    with collect_phase_timings() as timings, contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        if target == "build_request_formulas":
+            build_request_formulas(template_path, out_path, cfg)
+        else:
+            write_measurement_not_required(template_path, out_path, cfg, synthetic_not_required_nos(spec))
+        elapsed = time.perf_counter() - started
+    phases = {}
+    for timing in timings:
+        phases[timing.name] = phases.get(timing.name, 0.0) + timing.seconds
+    return elapsed, phases
+
+
+def measure_case(spec: TemplateSpec, repeats: int, work_dir: str) -> dict:
+    """ケース 1 件を repeats 回ずつ実行し、対象ごとの全体と工程別の中央値を返す。"""
+    template_path = os.path.join(work_dir, f"{spec.key}.xlsx")
+    out_path = os.path.join(work_dir, f"{spec.key}-out.xlsx")
+    build_synthetic_template(template_path, spec)
+    result = {}
+    for target in TARGETS:
+        totals = []
+        phase_samples = {}
+        for _ in range(repeats):
+            elapsed, phases = _run_target(target, template_path, out_path, spec)
+            totals.append(elapsed)
+            for name, seconds in phases.items():
+                phase_samples.setdefault(name, []).append(seconds)
+        result[target] = {
+            "total": round(statistics.median(totals), 4),
+            "phases": {name: round(statistics.median(samples), 4) for name, samples in phase_samples.items()},
+        }
+    return result
+
+
+def _environment() -> dict:
+    return {
+        "machine": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+    }
+
+
+def _load_baseline(path: str) -> tuple[dict, dict]:
+    """基準値ファイルから (計測環境, ケースごとの基準値) を返す。無ければどちらも空。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}, {}
+    return data.get("environment", {}), data.get("cases", {})
+
+
+def _environment_differences(recorded: dict, current: dict) -> list[str]:
+    return [
+        f"{key} {recorded.get(key)} → {current.get(key)}"
+        for key in current
+        if recorded.get(key) != current.get(key)
+    ]
+
+
+def _compare(key: str, target: str, measured: dict, baseline: dict, tolerance: float) -> str | None:
+    expected = baseline.get(key, {}).get(target)
+    if expected is None:
+        return None
+    delta = measured["total"] - expected["total"]
+    if delta < MIN_DELTA or measured["total"] <= expected["total"] * (1 + tolerance):
+        return None
+    phase_deltas = sorted(
+        (
+            (seconds - expected.get("phases", {}).get(name, 0.0), name)
+            for name, seconds in measured["phases"].items()
+        ),
+        reverse=True,
+    )
+    worst = ", ".join(f"{phase_label(name)} +{seconds:.2f}秒" for seconds, name in phase_deltas[:2] if seconds > 0)
+    return f"{key} {target}: {expected['total']:.2f}秒 → {measured['total']:.2f}秒（{worst}）"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--grid", action="store_true", help="1 項目ずつではなく全組み合わせを計測する")
+    parser.add_argument("--repeats", type=int, default=3, help="ケースごとの実行回数（中央値を使う）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="比較・保存する基準値ファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="計測結果で基準値ファイルを書き換える")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"劣化とみなす基準値からの伸び（既定: {DEFAULT_TOLERANCE}＝3 割）",
+    )
+    parser.add_argument("--with-cache", action="store_true", help="テンプレート索引などのキャッシュを有効にして計測する")
+    args = parser.parse_args(argv)
+
+    if not args.with_cache:
+        # 2 回目以降が索引の読み込みだけになると規模による差が見えないため、既定ではキャッシュを使わない
+        os.environ[DISABLE_CACHE_ENV] = "1"
+
+    environment = _environment()
+    baseline_environment, baseline = _load_baseline(args.baseline)
+    if not baseline and not args.save_baseline:
+        print(f"[info] 基準値がないため比較しません。--save-baseline で記録できます: {args.baseline}")
+    differences = _environment_differences(baseline_environment, environment) if baseline else []
+    if differences:
+        print(f"[warn] 基準値を記録した環境と違うため、差は参考値です: {', '.join(differences)}")
+    measured = {}
+    regressions = []
+    with tempfile.TemporaryDirectory(prefix="flag_bench_") as work_dir:
+        for spec in sweep_cases(args.grid):
+            measured[spec.key] = measure_case(spec, args.repeats, work_dir)
+            for target in TARGETS:
+                result = measured[spec.key][target]
+                expected = baseline.get(spec.key, {}).get(target, {}).get("total")
+                versus = f"（基準 {expected:.2f}秒）" if expected is not None else ""
+                print(f"[info] {spec.key:<18} {target:<31} {result['total']:6.2f}秒{versus}", flush=True)
+                regression = _compare(spec.key, target, result, baseline, args.tolerance)
+                if regression:
+                    regressions.append(regression)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "environment": environment,
+                    "repeats": args.repeats,
+                    # 別の環境の基準値に今回の計測を混ぜない
+                    "cases": {**(baseline if not differences else {}), **measured},
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"[info] 基準値を保存しました: {args.baseline}")
+        return 0
+
+    for regression in regressions:
+        print(f"[error] 基準値より遅くなりました: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""`_merge_sheet_cells` が変更セル数に対して線形に伸びることを確認するベンチマーク。
+
+実行例: py -3.12 -m benchmarks.merge_sheet_cells
+"""
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from flag_auto_generator_app.sheet_editor import TargetSheet, _merge_sheet_cells
+from flag_auto_generator_app.xlsx_package import MAIN_NS, SheetCells, _parse_sheet_root
+
+
+MEASURE_ROW_MIN = 11
+MEASURE_ROW_STEP = 3
+OUTPUT_COL_START = column_index_from_string("L")
+OUTPUT_COL_END = column_index_from_string("SR")
+DEFAULT_MEASURE_COUNTS = (10, 20, 40, 80)
+# 線形とみなす上限: 変更セル 1 件あたりの時間が最小規模の何倍まで許容するか
+LINEAR_TOLERANCE = 2.0
+
+
+def _build_sheet_xml(measure_count: int) -> bytes:
+    row_max = MEASURE_ROW_MIN + measure_count * MEASURE_ROW_STEP
+    parts = [f'<worksheet xmlns="{MAIN_NS}"><sheetData>']
+    for row in range(1, row_max + 1):
+        parts.append(f'<row r="{row}">')
+        # 実テンプレートと同じく A〜K の見出し列と、L〜SR の空セル（書式のみ）を並べる
+        for col in range(1, OUTPUT_COL_END + 1):
+            parts.append(f'<c r="{get_column_letter(col)}{row}" s="{col % 7}"/>')
+        parts.append("</row>")
+    parts.append("</sheetData></worksheet>")
+    return "".join(parts).encode("utf-8")
+
+
+def _load_sheet(sheet_xml: bytes) -> TargetSheet:
+    root = ET.fromstring(sheet_xml)
+    cells, max_row, merged_ranges = _parse_sheet_root(root, [])
+    return TargetSheet(sheet_xml, root, SheetCells("xl/worksheets/sheet1.xml", cells, max_row, merged_ranges))
+
+
+def _measure(measure_count: int) -> tuple[int, float]:
+    sheet = _load_sheet(_build_sheet_xml(measure_count))
+    for index in range(measure_count):
+        row = MEASURE_ROW_MIN + index * MEASURE_ROW_STEP
+        for col in range(OUTPUT_COL_START, OUTPUT_COL_END + 1):
+            letter = get_column_letter(col)
+            sheet.set_value(row, col, f'=IF(OR({letter}$200<>""),"依頼","")')
+
+    started = time.perf_counter()
+    _merge_sheet_cells(sheet)
+    return len(sheet.changes), time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--measure-counts",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_MEASURE_COUNTS),
+        help="計測する測定行数（昇順）",
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    for measure_count in args.measure_counts:
+        changed_cells, elapsed = _measure(measure_count)
+        per_cell_us = elapsed / changed_cells * 1_000_000
+        results.append(per_cell_us)
+        print(
+            f"[info] 測定行 {measure_count:>4} 行 / 変更セル {changed_cells:>6} 件: "
+            f"{elapsed * 1000:8.1f} ms（1 セルあたり {per_cell_us:6.2f} µs）"
+        )
+
+    growth = results[-1] / results[0]
+    print(f"[info] 1 セルあたりの時間の伸び: {growth:.2f} 倍（許容 {LINEAR_TOLERANCE:.1f} 倍）")
+    if growth > LINEAR_TOLERANCE:
+        print("[error] 変更セル数に対して線形を超える伸びを検出しました。")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""実テンプレートと同じ形の検査シートを合成するベンチマーク用の部品。
+
+測定行は 11 行目から 3 行おき、測定不要行は最後の測定行の次のブロック、工具行は測定不要行 + 3 から、
+L〜SR の出力列は書式だけの空セル。A・B・C:D・E:F・G・K 列はブロックごとに 3 行を結合し、
+L〜SR には実テンプレートと同じ条件付き書式、1〜3 行目には先頭集計式を置く。
+
+実行例: py -3.12 -m benchmarks.synthetic_template out.xlsx --measures 37 --tools 2
+"""
+import argparse
+import sys
+import zipfile
+from typing import NamedTuple
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from flag_auto_generator_app.excel_ops import (
+    LOCKED_BASIC_SETTINGS,
+    REQUEST_OUTPUT_COL_END,
+    SUMMARY_FORMULA_COL_END,
+    SUMMARY_FORMULA_COL_START,
+    _build_summary_formula,
+    _derive_auto_data_start_row,
+    _derive_layout_rows,
+)
+from flag_auto_generator_app.xlsx_package import MAIN_NS, PKG_REL_NS, REL_NS
+
+
+SHEET_NAME = "工程内検査シート"
+MEASURE_ROW_MIN = LOCKED_BASIC_SETTINGS["measure_row_min"]
+BLOCK_ROWS = LOCKED_BASIC_SETTINGS["measure_row_step"]
+OUTPUT_COL_END = column_index_from_string(REQUEST_OUTPUT_COL_END)
+# 実テンプレートと同じく、ブロックごとに 3 行を結合する列範囲（A・B・C:D・E:F・G・K）
+_MERGED_BLOCK_COLUMNS = ((1, 1), (2, 2), (3, 4), (5, 6), (7, 7), (11, 11))
+_HEADER_LABELS = {1: "№", 2: "測定項目(箇所・備考)", 5: "測定器", 7: "寸法", 9: "公差", 11: "中央値/外観"}
+_SUMMARY_LABELS = {1: ("客先名", "製造検査数"), 2: ("品番", "品証検査数"), 3: ("品名", "確認数")}
+_CONTENT_TYPE_MAIN = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+_OFFICE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+class TemplateSpec(NamedTuple):
+    """合成するテンプレートと、それに合わせた cfg の規模。"""
+
+    measure_count: int = 37
+    tool_count: int = 2
+    auto_data_count: int = 3
+    not_required_count: int = 2
+
+    @property
+    def key(self) -> str:
+        return f"m{self.measure_count}-t{self.tool_count}-a{self.auto_data_count}-n{self.not_required_count}"
+
+    @property
+    def not_required_row(self) -> int:
+        return MEASURE_ROW_MIN + self.measure_count * BLOCK_ROWS
+
+    @property
+    def auto_data_start_row(self) -> int:
+        return _derive_auto_data_start_row(self.not_required_row, self.tool_count)
+
+    @property
+    def max_row(self) -> int:
+        # 自動測定データの貼り付け欄まで、ブロックの区切りに合わせてシートを伸ばす
+        last_row = self.auto_data_start_row + max(self.auto_data_count, 1) * BLOCK_ROWS
+        return last_row + (BLOCK_ROWS - (last_row - MEASURE_ROW_MIN) % BLOCK_ROWS) % BLOCK_ROWS
+
+
+DEFAULT_SPEC = TemplateSpec()
+
+
+def synthetic_cfg(spec: TemplateSpec) -> dict:
+    """GUI の `_gather_cfg` と同じ形の cfg。工具ごとに測定 No を振り分け、先頭の数件は複数工具で重ねる。"""
+    measure_row_max, tool_start_row = _derive_layout_rows(spec.not_required_row, MEASURE_ROW_MIN)
+    tools = [f"工具{index + 1}" for index in range(spec.tool_count)]
+    measure_nos = range(1, spec.measure_count + 1)
+    tool_to_measure_nos = {
+        tool: [no for no in measure_nos if no % spec.tool_count == index or no <= 3]
+        for index, tool in enumerate(tools)
+    }
+    return {
+        "sheet_name": SHEET_NAME,
+        "measure_no_col": LOCKED_BASIC_SETTINGS["measure_no_col"],
+        "measure_row_min": MEASURE_ROW_MIN,
+        "measure_row_max": measure_row_max,
+        "measure_row_step": BLOCK_ROWS,
+        "summary_row_min": LOCKED_BASIC_SETTINGS["summary_row_min"],
+        "summary_row_max": measure_row_max,
+        "summary_row_step": LOCKED_BASIC_SETTINGS["summary_row_step"],
+        "formula_arg_sep": LOCKED_BASIC_SETTINGS["formula_arg_sep"],
+        "tool_start_row": tool_start_row,
+        "not_required_row": spec.not_required_row,
+        "tool_name_col": LOCKED_BASIC_SETTINGS["tool_name_col"],
+        "tool_row_step": LOCKED_BASIC_SETTINGS["tool_row_step"],
+        "auto_data_start_row": spec.auto_data_start_row,
+        "measure_no_to_data_index": {str(no): no for no in range(1, min(spec.auto_data_count, spec.measure_count) + 1)},
+        "tools": tools,
+        "tool_to_measure_nos": tool_to_measure_nos,
+    }
+
+
+def synthetic_not_required_nos(spec: TemplateSpec) -> list[int]:
+    # 末尾の測定 No から選ぶ（依頼式の入った行と入っていない行の両方に当たる）
+    return list(range(spec.measure_count, max(spec.measure_count - spec.not_required_count, 0), -1))
+
+
+class _SharedStrings:
+    def __init__(self):
+        self.items: list[str] = []
+        self.indexes: dict[str, int] = {}
+
+    def cell(self, ref: str, text: str, style: int) -> str:
+        index = self.indexes.setdefault(text, len(self.items))
+        if index == len(self.items):
+            self.items.append(text)
+        return f'<c r="{ref}" s="{style}" t="s"><v>{index}</v></c>'
+
+    def xml(self) -> str:
+        items = "".join(f"<si><t>{escape(text)}</t></si>" for text in self.items)
+        return f'<sst xmlns="{MAIN_NS}" count="{len(self.items)}" uniqueCount="{len(self.items)}">{items}</sst>'
+
+
+def _formula_cell(ref: str, formula: str, value, style: int) -> str:
+    cached = "" if value is None else f"<v>{value}</v>"
+    type_attr = ' t="str"' if isinstance(value, str) else ""
+    return f'<c r="{ref}" s="{style}"{type_attr}><f>{escape(formula)}</f>{cached}</c>'
+
+
+def _sheet_xml(spec: TemplateSpec, strings: _SharedStrings) -> tuple[str, list[str]]:
+    summary_col_start = column_index_from_string(SUMMARY_FORMULA_COL_START)
+    summary_col_end = column_index_from_string(SUMMARY_FORMULA_COL_END)
+    formula_refs = []
+    rows = []
+    for row in range(1, spec.max_row + 1):
+        cells = []
+        block_offset = (row - MEASURE_ROW_MIN) % BLOCK_ROWS if row >= MEASURE_ROW_MIN else None
+        block_no = (row - MEASURE_ROW_MIN) // BLOCK_ROWS + 1 if block_offset == 0 else None
+        for col in range(1, OUTPUT_COL_END + 1):
+            ref = f"{get_column_letter(col)}{row}"
+            style = 1 + col % 5
+            if row in _SUMMARY_LABELS and col in (1, 11):
+                cells.append(strings.cell(ref, _SUMMARY_LABELS[row][col != 1], style))
+            elif row in _SUMMARY_LABELS and summary_col_start <= col <= summary_col_end:
+                cells.append(_formula_cell(ref, _build_summary_formula(get_column_letter(col), row - 1)[1:], 0, style))
+                formula_refs.append(ref)
+            elif row == 10 and col in _HEADER_LABELS:
+                cells.append(strings.cell(ref, _HEADER_LABELS[col], style))
+            elif block_no is not None and block_no <= spec.measure_count and col == 1:
+                # 実テンプレートと同じく、測定 No は B 列を参照する数式のキャッシュ値として持つ
+                cells.append(_formula_cell(ref, f'IFERROR(IF(B{row}="","",ROW()-8)/3,"")', block_no, style))
+                formula_refs.append(ref)
+            elif block_no is not None and block_no <= spec.measure_count and col == 2:
+                cells.append(strings.cell(ref, f"測定項目{block_no}", style))
+            else:
+                cells.append(f'<c r="{ref}" s="{style}"/>')
+        rows.append(f'<row r="{row}">{"".join(cells)}</row>')
+
+    merges = []
+    for block_row in range(MEASURE_ROW_MIN, spec.max_row + 1, BLOCK_ROWS):
+        for min_col, max_col in _MERGED_BLOCK_COLUMNS:
+            start = f"{get_column_letter(min_col)}{block_row}"
+            end = f"{get_column_letter(max_col)}{block_row + BLOCK_ROWS - 1}"
+            merges.append(f'<mergeCell ref="{start}:{end}"/>')
+
+    output_end = get_column_letter(OUTPUT_COL_END)
+    sheet_xml = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+        f'<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+        f'<dimension ref="A1:{output_end}{spec.max_row}"/>'
+        f'<sheetData>{"".join(rows)}</sheetData>'
+        f'<mergeCells count="{len(merges)}">{"".join(merges)}</mergeCells>'
+        f'<conditionalFormatting sqref="L10:{output_end}10">'
+        '<cfRule type="cellIs" dxfId="0" priority="2" operator="equal"><formula>"依頼"</formula></cfRule>'
+        "</conditionalFormatting>"
+        f'<conditionalFormatting sqref="L{MEASURE_ROW_MIN}:{output_end}{spec.max_row}">'
+        '<cfRule type="cellIs" dxfId="1" priority="1" operator="equal"><formula>"-"</formula></cfRule>'
+        "</conditionalFormatting>"
+        '<pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>'
+        "</worksheet>"
+    )
+    return sheet_xml, formula_refs
+
+
+def _styles_xml() -> str:
+    cell_xfs = "".join(
+        f'<xf numFmtId="0" fontId="0" fillId="0" borderId="{min(index, 1)}" xfId="0"/>' for index in range(6)
+    )
+    return (
+        f'<styleSheet xmlns="{MAIN_NS}">'
+        '<fonts count="1"><font><sz val="11"/><name val="游ゴシック"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+        '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        f'<cellXfs count="6">{cell_xfs}</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="標準" xfId="0" builtinId="0"/></cellStyles>'
+        '<dxfs count="2"><dxf><font><b/></font></dxf><dxf><font><color rgb="FF808080"/></font></dxf></dxfs>'
+        "</styleSheet>"
+    )
+
+
+def build_synthetic_template(path: str, spec: TemplateSpec) -> str:
+    """spec の規模の検査シート 1 枚を持つ xlsx を path に書き出す。"""
+    strings = _SharedStrings()
+    sheet_xml, formula_refs = _sheet_xml(spec, strings)
+    calc_chain = "".join(f'<c r="{ref}" i="1"/>' for ref in formula_refs)
+    parts = {
+        "[Content_Types].xml": (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{_CONTENT_TYPE_MAIN}.sheet.main+xml"/>'
+            f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{_CONTENT_TYPE_MAIN}.worksheet+xml"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{_CONTENT_TYPE_MAIN}.styles+xml"/>'
+            f'<Override PartName="/xl/sharedStrings.xml" ContentType="{_CONTENT_TYPE_MAIN}.sharedStrings+xml"/>'
+            f'<Override PartName="/xl/calcChain.xml" ContentType="{_CONTENT_TYPE_MAIN}.calcChain+xml"/>'
+            "</Types>"
+        ),
+        "_rels/.rels": (
+            f'<Relationships xmlns="{PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{_OFFICE_REL_TYPE}/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/workbook.xml": (
+            f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+            f'<sheets><sheet name="{SHEET_NAME}" sheetId="1" r:id="rId1"/></sheets>'
+            '<calcPr calcId="191029"/>'
+            "</workbook>"
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            f'<Relationships xmlns="{PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{_OFFICE_REL_TYPE}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{_OFFICE_REL_TYPE}/styles" Target="styles.xml"/>'
+            f'<Relationship Id="rId3" Type="{_OFFICE_REL_TYPE}/sharedStrings" Target="sharedStrings.xml"/>'
+            f'<Relationship Id="rId4" Type="{_OFFICE_REL_TYPE}/calcChain" Target="calcChain.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/worksheets/sheet1.xml": sheet_xml,
+        "xl/styles.xml": _styles_xml(),
+        "xl/sharedStrings.xml": strings.xml(),
+        "xl/calcChain.xml": f'<calcChain xmlns="{MAIN_NS}">{calc_chain}</calcChain>',
+    }
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as workbook_zip:
+        for name, text in parts.items():
+            workbook_zip.writestr(name, text.encode("utf-8"))
+    return path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out", help="書き出す xlsx のパス")
+    parser.add_argument("--measures", type=int, default=DEFAULT_SPEC.measure_count, help="測定行の数")
+    parser.add_argument("--tools", type=int, default=DEFAULT_SPEC.tool_count, help="工具の数")
+    parser.add_argument("--auto-data", type=int, default=DEFAULT_SPEC.auto_data_count, help="自動測定データの対応数")
+    args = parser.parse_args(argv)
+    spec = TemplateSpec(args.measures, args.tools, args.auto_data)
+    build_synthetic_template(args.out, spec)
+    print(f"[info] 合成テンプレートを作成しました: {args.out}（{spec.key}・{spec.max_row}行）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,16 @@
-from flag_auto_generator_app.gui import main
+import multiprocessing
+import sys
 
 
 if __name__ == "__main__":
+    # EXE 化した場合も並列実行のワーカープロセスが GUI や CLI を起動し直さないようにする
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        # 引数があればジョブファイルを実行するコマンドラインモード（tkinter の画面は作らない）
+        from flag_auto_generator_app.cli import main as cli_main
+
+        sys.exit(cli_main())
+
+    from flag_auto_generator_app.gui import main
+
     main()
@@ -1 +1,4 @@
 """flag_auto_generator のアプリ本体パッケージ。"""
+
+# 生成結果が変わる修正をしたら上げる（生成結果キャッシュのキーに含まれる）
+__version__ = "2026.10.17"
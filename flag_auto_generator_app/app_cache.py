@@ -0,0 +1,161 @@
+"""テンプレート索引などの永続キャッシュの置き場所と読み書き。
+
+既定の置き場所は Windows では %LOCALAPPDATA%\\flag_auto_generator\\cache、それ以外では ~/.cache/flag_auto_generator。
+環境変数で場所の変更や無効化ができる。
+
+pickle は読み込むだけで任意のコードを実行できるため、キャッシュの置き場所が共有フォルダでも
+他人が置いたファイルを読まないよう、利用者ごとの鍵で HMAC を付けて保存し、読み込み時に検証する。
+鍵はキャッシュの置き場所を変えても共有されないよう、利用者のローカルフォルダに置く。
+"""
+import hashlib
+import hmac
+import os
+import pickle
+import secrets
+import tempfile
+
+
+CACHE_DIR_ENV = "FLAG_AUTO_GENERATOR_CACHE_DIR"
+DISABLE_CACHE_ENV = "FLAG_AUTO_GENERATOR_DISABLE_CACHE"
+_DIGEST_CHUNK_SIZE = 1024 * 1024
+_SIGNATURE_SIZE = hashlib.sha256().digest_size
+_SIGNING_KEY_SIZE = 32
+_signing_key: bytes | None = None
+
+
+def cache_dir(kind: str) -> str | None:
+    """種類ごとのキャッシュフォルダを返す。キャッシュが無効な場合は None。"""
+    if os.environ.get(DISABLE_CACHE_ENV, "").strip() == "1":
+        return None
+    root = os.environ.get(CACHE_DIR_ENV, "").strip()
+    if not root:
+        local_app_data = os.environ.get("LOCALAPPDATA")
+        if local_app_data:
+            root = os.path.join(local_app_data, "flag_auto_generator", "cache")
+        else:
+            root = os.path.join(os.path.expanduser("~"), ".cache", "flag_auto_generator")
+    return os.path.join(root, kind)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_DIGEST_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_signing_key() -> bytes | None:
+    """pickle の署名に使う利用者ごとの鍵を返す。初回は作成する。用意できない場合は None。"""
+    global _signing_key
+    if _signing_key is not None:
+        return _signing_key
+    local_app_data = os.environ.get("LOCALAPPDATA")
+    if local_app_data:
+        key_path = os.path.join(local_app_data, "flag_auto_generator", "cache.key")
+    else:
+        key_path = os.path.join(os.path.expanduser("~"), ".config", "flag_auto_generator", "cache.key")
+    try:
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb") as f:
+                f.write(secrets.token_bytes(_SIGNING_KEY_SIZE))
+        with open(key_path, "rb") as f:
+            key = f.read()
+    except OSError as e:
+        print(f"[warn] キャッシュの鍵を用意できないため、キャッシュを使いません: {key_path}: {e}")
+        return None
+    if len(key) != _SIGNING_KEY_SIZE:
+        # 別プロセスが作成中の場合など。今回はキャッシュを使わない
+        print(f"[warn] キャッシュの鍵が不正なため、キャッシュを使いません: {key_path}")
+        return None
+    _signing_key = key
+    return key
+
+
+def _signature(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.sha256).digest()
+
+
+def load_pickle(path: str, version: int):
+    """キャッシュファイルを読む。無い・壊れている・署名が合わない・形式の版が違う場合は None。"""
+    key = _load_signing_key()
+    if key is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        print(f"[warn] キャッシュを読み込めないため作り直します: {path}: {e}")
+        return None
+    signature, body = data[:_SIGNATURE_SIZE], data[_SIGNATURE_SIZE:]
+    if not hmac.compare_digest(signature, _signature(key, body)):
+        # 以前の形式のファイルや他の利用者が置いたファイル。中身は読まずに作り直す
+        print(f"[warn] キャッシュの署名が一致しないため作り直します: {path}")
+        return None
+    try:
+        stored_version, payload = pickle.loads(body)
+    except Exception as e:
+        print(f"[warn] キャッシュを読み込めないため作り直します: {path}: {e}")
+        return None
+    if stored_version != version:
+        return None
+    try:
+        # 最近使ったものほど残すよう、読み込んだファイルの更新日時を進めておく
+        os.utime(path)
+    except OSError:
+        pass
+    return payload
+
+
+def prune_cache(directory: str, max_bytes: int):
+    """フォルダ内の合計サイズが max_bytes を超えたら、更新日時の古いファイルから削除する。"""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(".tmp_"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def save_pickle(path: str, version: int, payload):
+    """一時ファイルに書いてから置き換える。並列実行で同じファイルを同時に書いても壊れない。
+
+    キャッシュは無くても動くため、書き込みの失敗は警告だけにする。
+    """
+    key = _load_signing_key()
+    if key is None:
+        return
+    body = pickle.dumps((version, payload), protocol=pickle.HIGHEST_PROTOCOL)
+    temp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(_signature(key, body))
+            f.write(body)
+        os.replace(temp_path, path)
+        temp_path = None
+    except OSError as e:
+        print(f"[warn] キャッシュを保存できませんでした: {path}: {e}")
+    finally:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,154 @@
+"""複数のジョブをプロセスプールで並列に実行し、結果をまとめる処理。
+
+生成処理は openpyxl / ElementTree の CPU 処理が中心で、スレッドでは GIL により速くならないため、
+ジョブ単位で別プロセスへ振り分ける。
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, NamedTuple
+
+from .jobs import BatchJob, JobResult, run_job
+from .phase_timing import _timing_record
+from .template_index import compile_template, load_template_index
+
+
+class BatchReport(NamedTuple):
+    """バッチ全体の結果。results はジョブの指定順に並ぶ。"""
+
+    results: list[JobResult]
+    elapsed: float
+    workers: int
+
+    @property
+    def succeeded(self) -> list[JobResult]:
+        return [result for result in self.results if result.saved_path is not None]
+
+    @property
+    def failed(self) -> list[JobResult]:
+        return [result for result in self.results if result.saved_path is None]
+
+    @property
+    def cached(self) -> list[JobResult]:
+        return [result for result in self.results if result.cached]
+
+    @property
+    def warned(self) -> list[JobResult]:
+        return [result for result in self.results if result.warning]
+
+    def summary(self) -> str:
+        return (
+            f"完了 {len(self.succeeded)}件（うちキャッシュ {len(self.cached)}件・警告付き {len(self.warned)}件）"
+            f" / 失敗 {len(self.failed)}件"
+            f"（{self.workers}プロセス・{self.elapsed:.1f}秒）"
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "elapsed": round(self.elapsed, 3),
+            "workers": self.workers,
+            "succeeded": len(self.succeeded),
+            "failed": len(self.failed),
+            "cached": len(self.cached),
+            "jobs": [
+                {
+                    "name": result.job.name,
+                    "source": result.job.source,
+                    "out": result.job.out,
+                    "mode": result.job.mode,
+                    "saved_path": result.saved_path,
+                    "error": result.error,
+                    "warning": result.warning,
+                    "elapsed": round(result.elapsed, 3),
+                    "cached": result.cached,
+                    "patched_cells": result.patched_cells,
+                    "phases": [_timing_record(timing) for timing in result.phases],
+                    "peak_memory_bytes": result.peak_memory,
+                }
+                for result in self.results
+            ],
+        }
+
+
+def default_worker_count(job_count: int) -> int:
+    return max(1, min(job_count, os.cpu_count() or 1))
+
+
+def _duplicate_output_errors(jobs: list[BatchJob]) -> dict[int, str]:
+    # 同じ出力先へ別プロセスが同時に書くと一時ファイルの置き換えが競合するため、2 件目以降は実行しない
+    first_index_by_out = {}
+    errors = {}
+    for index, job in enumerate(jobs):
+        key = os.path.normcase(os.path.abspath(job.out))
+        if key in first_index_by_out:
+            first_job = jobs[first_index_by_out[key]]
+            errors[index] = f"出力先が {first_job.name} と重複しています: {job.out}"
+        else:
+            first_index_by_out[key] = index
+    return errors
+
+
+def _prepare_template_indexes(jobs: list[BatchJob], pending: list[int]):
+    # 複数のジョブが使うテンプレートは、ワーカーがそれぞれ解析しないよう先に索引を作っておく
+    job_counts = {}
+    for index in pending:
+        key = (jobs[index].source, jobs[index].cfg["sheet_name"])
+        job_counts[key] = job_counts.get(key, 0) + 1
+    for (source, sheet_name), count in job_counts.items():
+        if count < 2:
+            continue
+        try:
+            if load_template_index(source, sheet_name) is None:
+                compile_template(source, sheet_name)
+        except Exception:
+            # 読めないテンプレートは各ジョブの実行時に失敗として記録される
+            continue
+
+
+def run_batch(
+    jobs: list[BatchJob],
+    *,
+    max_workers: int | None = None,
+    on_result: Callable[[int, JobResult], None] | None = None,
+    use_cache: bool = True,
+    incremental: bool = True,
+) -> BatchReport:
+    """ジョブを並列に実行する。1 件の失敗（ワーカープロセスの異常終了を含む）は他のジョブに影響しない。
+
+    on_result は完了したジョブごとに (ジョブの添字, 結果) で呼ばれる（完了順）。
+    max_workers が 1 の場合はプロセスを作らずに順番に実行する。
+    use_cache が False なら生成結果キャッシュを使わずにすべて生成し直す。
+    incremental が False なら前回の出力からの差分再生成を行わない。
+    """
+    started = time.perf_counter()
+    workers = max_workers or default_worker_count(len(jobs))
+    results: list[JobResult | None] = [None] * len(jobs)
+
+    def finish(index: int, result: JobResult):
+        results[index] = result
+        if on_result is not None:
+            on_result(index, result)
+
+    for index, error in _duplicate_output_errors(jobs).items():
+        finish(index, JobResult(jobs[index], None, error=error))
+    pending = [index for index in range(len(jobs)) if results[index] is None]
+
+    if workers <= 1 or len(pending) <= 1:
+        workers = 1
+        for index in pending:
+            finish(index, run_job(jobs[index], use_cache, incremental))
+    else:
+        workers = min(workers, len(pending))
+        _prepare_template_indexes(jobs, pending)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_job, jobs[index], use_cache, incremental): index for index in pending}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # run_job は例外を結果に変換するため、ここへ来るのはプロセスの異常終了や結果の受け渡し失敗
+                    result = JobResult(jobs[index], None, error=f"ワーカープロセスでエラーが発生しました: {e!r}")
+                finish(index, result)
+
+    return BatchReport(results, time.perf_counter() - started, workers)
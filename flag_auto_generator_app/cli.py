@@ -0,0 +1,184 @@
+"""ジョブファイルを指定して、画面を出さずに検査シートを生成するコマンドライン入口。
+
+実行例: py -3.12 .\\flag_auto_generator.py jobs\\50136.json jobs\\50137.json
+"""
+import argparse
+import json
+import os
+import sys
+import zipfile
+
+from .app_cache import DISABLE_CACHE_ENV, cache_dir
+from .batch import default_worker_count, run_batch
+from .jobs import JobResult, load_job_file
+from .phase_timing import (
+    PROFILE_MEMORY_ENV,
+    TIMING_LOG_ENV,
+    append_timing_log,
+    format_memory,
+    phase_label,
+    timing_log_path,
+)
+from .template_index import compile_template
+
+
+DEFAULT_SHEET_NAME = "工程内検査シート"
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="flag_auto_generator",
+        description="ジョブファイル（JSON）の内容で検査シートを生成します。引数なしで起動すると GUI が開きます。",
+    )
+    parser.add_argument("job_files", nargs="*", help="ジョブファイル（JSON）のパス")
+    parser.add_argument("--check", action="store_true", help="ジョブファイルの読み込みと検証だけを行い、生成はしない")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="並列に実行するプロセス数（既定: CPU コア数。1 なら順番に実行）",
+    )
+    parser.add_argument("--report", help="実行結果を JSON で書き出すファイルのパス")
+    parser.add_argument("--no-cache", action="store_true", help="生成結果のキャッシュを使わずにすべて生成し直す")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="出力先にある前回の出力からの差分再生成を行わず、常に全体を生成する",
+    )
+    parser.add_argument(
+        "--timing-log",
+        default=timing_log_path(),
+        metavar="PATH",
+        help=f"ジョブごとの工程別の所要時間を JSON Lines で追記するファイル（- なら標準出力。既定: 環境変数 {TIMING_LOG_ENV}）",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help=f"tracemalloc で工程ごとのメモリ使用量とピークを計測する（処理は数倍遅くなる。環境変数 {PROFILE_MEMORY_ENV}=1 と同じ）",
+    )
+    parser.add_argument(
+        "--compile-template",
+        action="append",
+        default=[],
+        metavar="XLSX",
+        help="テンプレートを解析して索引だけを作る（複数指定可）",
+    )
+    parser.add_argument(
+        "--sheet",
+        default=DEFAULT_SHEET_NAME,
+        help=f"--compile-template で解析するシート名（既定: {DEFAULT_SHEET_NAME}）",
+    )
+    return parser
+
+
+def _compile_templates(xlsx_paths: list[str], sheet_name: str) -> bool:
+    if cache_dir("template_index") is None:
+        print(f"[error] キャッシュが無効なため索引を作れません（{DISABLE_CACHE_ENV}）。", file=sys.stderr)
+        return False
+    ok = True
+    for xlsx_path in xlsx_paths:
+        try:
+            index = compile_template(xlsx_path, sheet_name)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"[error] テンプレートを解析できませんでした: {xlsx_path}: {e}", file=sys.stderr)
+            ok = False
+            continue
+        print(f"索引を作成しました: {xlsx_path}（{index.content_hash[:12]}）")
+    return ok
+
+
+def _print_result(done: int, total: int, result: JobResult):
+    job = result.job
+    if result.error:
+        print(f"[{done}/{total}] 失敗 {job.name}: {result.error}", flush=True)
+        return
+    if result.cached:
+        source = "キャッシュ"
+    elif result.patched_cells is not None:
+        source = f"差分 {result.patched_cells}セル・{result.elapsed:.1f}秒"
+    else:
+        source = f"{result.elapsed:.1f}秒"
+    print(f"[{done}/{total}] 完了 {job.name} -> {result.saved_path}（{source}）", flush=True)
+    if result.warning:
+        print(f"    [warn] {result.warning}", flush=True)
+    if result.peak_memory is not None:
+        phases = [timing for timing in result.phases if timing.peak is not None]
+        peak_phase = max(phases, key=lambda timing: timing.peak, default=None)
+        at = f"（{phase_label(peak_phase.name)}）" if peak_phase is not None else ""
+        # 後の工程のピークには前の工程で残ったデータも含まれるため、どこで増えたかは増加量で示す
+        growing = sorted((timing for timing in phases if timing.allocated > 0), key=lambda t: -t.allocated)
+        grown = "・".join(f"{phase_label(timing.name)} +{format_memory(timing.allocated)}" for timing in growing[:3])
+        print(f"    [memory] ピーク {format_memory(result.peak_memory)}{at} 増加: {grown or 'なし'}", flush=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    if not args.job_files and not args.compile_template:
+        parser.error("ジョブファイルか --compile-template を指定してください。")
+    if args.compile_template and not _compile_templates(args.compile_template, args.sheet):
+        return 2
+    if not args.job_files:
+        return 0
+    if args.workers is not None and args.workers < 1:
+        print("[error] --workers は 1 以上で指定してください。", file=sys.stderr)
+        return 2
+
+    jobs = []
+    load_failed = False
+    for job_file in args.job_files:
+        try:
+            jobs.extend(load_job_file(job_file))
+        except (OSError, ValueError) as e:
+            print(f"[error] ジョブファイルを読み込めませんでした: {job_file}: {e}", file=sys.stderr)
+            load_failed = True
+    if load_failed:
+        return 2
+    if args.check:
+        print(f"ジョブファイルを確認しました: {len(jobs)}件")
+        return 0
+
+    if args.profile_memory:
+        # ワーカープロセスにも引き継ぐため、環境変数で run_job へ伝える
+        os.environ[PROFILE_MEMORY_ENV] = "1"
+    workers = args.workers or default_worker_count(len(jobs))
+    print(f"{len(jobs)}件のジョブを {workers}プロセスで実行します", flush=True)
+    done = 0
+
+    def on_result(index: int, result: JobResult):
+        nonlocal done
+        done += 1
+        _print_result(done, len(jobs), result)
+        if args.timing_log and result.phases:
+            append_timing_log(
+                args.timing_log,
+                result.phases,
+                result.elapsed,
+                peak_memory=result.peak_memory,
+                job=result.job.name,
+                source=result.job.source,
+                out=result.job.out,
+                cached=result.cached,
+                patched_cells=result.patched_cells,
+                error=result.error,
+            )
+
+    report = run_batch(
+        jobs,
+        max_workers=workers,
+        on_result=on_result,
+        use_cache=not args.no_cache,
+        incremental=not args.full,
+    )
+    for result in report.failed:
+        print(f"[失敗] {result.job.name}: {result.error}")
+    print(report.summary())
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, ensure_ascii=False, indent=2)
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,30 @@
-import copy
 import os
-import posixpath
 import re
-import tempfile
 import time
 import zipfile
 import xml.etree.ElementTree as ET
+from typing import Callable
 
-from openpyxl import load_workbook
-from openpyxl.cell.cell import MergedCell
 from openpyxl.utils import column_index_from_string, get_column_letter
 from openpyxl.worksheet.formula import ArrayFormula
-from tkinter import messagebox
+
+from .phase_timing import phase
+from .progress import CancelToken, GenerationCancelled, ProgressHandler, report_progress, track_progress
+from .sheet_editor import TargetSheet, _merge_sheet_cells
+from .sheet_recalc import evaluate_generated_cells, rebuild_calc_chain
+from .template_index import load_template_sheet
+from .xlsx_package import (
+    CALC_CHAIN_PATH,
+    CONTENT_TYPES_PATH,
+    MAIN_NS,
+    NS,
+    WORKBOOK_PATH,
+    WORKBOOK_RELS_PATH,
+    _parse_range_ref,
+    _restore_root_namespace_declarations,
+    _serialize_xml,
+    write_package_with_replacements,
+)
 
 
 # 測定不要行デフォルト 122。配下の自動データ開始行フォールバックは 1 工具想定: 122 + 3 + 6
@@ -38,39 +51,20 @@ LOCKED_BASIC_SETTINGS = {
     "tool_row_step": 3,
 }
 FORCE_EXCEL_RECALC_ENV = "FLAG_AUTO_GENERATOR_FORCE_EXCEL_RECALC"
-MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
-REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
-PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
-CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
-MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
-X14AC_NS = "http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac"
-XR_NS = "http://schemas.microsoft.com/office/spreadsheetml/2014/revision"
-XR2_NS = "http://schemas.microsoft.com/office/spreadsheetml/2015/revision2"
-XR3_NS = "http://schemas.microsoft.com/office/spreadsheetml/2016/revision3"
-X15_NS = "http://schemas.microsoft.com/office/spreadsheetml/2010/11/main"
-X15AC_NS = "http://schemas.microsoft.com/office/spreadsheetml/2010/11/ac"
-XR6_NS = "http://schemas.microsoft.com/office/spreadsheetml/2016/revision6"
-XR10_NS = "http://schemas.microsoft.com/office/spreadsheetml/2016/revision10"
-XCALCF_NS = "http://schemas.microsoft.com/office/spreadsheetml/2018/calcfeatures"
-NS = {
-    "main": MAIN_NS,
-    "rel": REL_NS,
-    "pkg": PKG_REL_NS,
-    "ct": CONTENT_TYPES_NS,
-}
+# 行ごとの数式の雛形で列名の位置を示す文字（セル参照や数式には現れない）
+_COLUMN_PLACEHOLDER = "\0"
+
+
+# 出力先ファイルが開かれていて置き換えられないときに呼ぶ処理。(出力先, 例外) を受け取り、再試行するなら True を返す
+FileLockedHandler = Callable[[str, PermissionError], bool]
+
 
-ET.register_namespace("", MAIN_NS)
-ET.register_namespace("r", REL_NS)
-ET.register_namespace("mc", MC_NS)
-ET.register_namespace("x14ac", X14AC_NS)
-ET.register_namespace("xr", XR_NS)
-ET.register_namespace("xr2", XR2_NS)
-ET.register_namespace("xr3", XR3_NS)
-ET.register_namespace("x15", X15_NS)
-ET.register_namespace("x15ac", X15AC_NS)
-ET.register_namespace("xr6", XR6_NS)
-ET.register_namespace("xr10", XR10_NS)
-ET.register_namespace("xcalcf", XCALCF_NS)
+class MeasurementNotRequiredError(ValueError):
+    """依頼式の生成は保存済みで、測定不要の書き込みだけが失敗したことを表す。"""
+
+    def __init__(self, message: str, saved_path: str):
+        super().__init__(message)
+        self.saved_path = saved_path
 
 
 def _derive_layout_rows(not_required_row: int, measure_row_min: int) -> tuple[int, int]:
@@ -83,28 +77,17 @@ def _derive_auto_data_start_row(not_required_row: int, tool_count: int) -> int:
     return not_required_row + (tool_count * LOCKED_BASIC_SETTINGS["tool_row_step"]) + 6
 
 
-def _get_writable_cell(ws, row: int, col: int):
-    cell = ws.cell(row, col)
-    if not isinstance(cell, MergedCell):
-        return cell
-
-    for merged_range in ws.merged_cells.ranges:
-        if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-            return ws.cell(merged_range.min_row, merged_range.min_col)
-
-    return cell
+def _get_writable_cell(sheet: TargetSheet, row: int, col: int) -> tuple[int, int]:
+    anchor = sheet.cells.merged_anchor(row, col)
+    return (row, col) if anchor is None else anchor
 
 
-def _save_workbook_to_temp_file(wb, out_path_hint: str) -> str:
-    _, ext = os.path.splitext(out_path_hint)
-    ext = ext or ".xlsx"
-    fd, tmp_path = tempfile.mkstemp(suffix=ext)
-    os.close(fd)
-    wb.save(tmp_path)
-    return tmp_path
-
+def _replace_file_atomic(temp_path: str, out_path: str, on_file_locked: FileLockedHandler | None = None) -> str:
+    """一時ファイルを出力先へ置き換える。
 
-def _replace_file_atomic(temp_path: str, out_path: str, parent=None) -> str:
+    出力先が開かれていて書き込めない場合は on_file_locked(出力先, 例外) を呼び、True が返れば再試行する。
+    on_file_locked が無い場合や False が返った場合は PermissionError をそのまま送出する。
+    """
     out_path = os.path.abspath(out_path)
     out_dir = os.path.dirname(out_path)
     if out_dir and not os.path.isdir(out_dir):
@@ -115,27 +98,8 @@ def _replace_file_atomic(temp_path: str, out_path: str, parent=None) -> str:
             os.replace(temp_path, out_path)
             return out_path
         except PermissionError as e:
-            if parent is None:
+            if on_file_locked is None or not on_file_locked(out_path, e):
                 raise
-            retry = messagebox.askretrycancel(
-                "保存に失敗",
-                "出力先ファイルに書き込めません。\n"
-                "Excelで出力先ファイルを開いている場合は閉じてから「再試行」を押してください。\n\n"
-                f"出力先:\n{out_path}\n\n"
-                f"詳細:\n{e}",
-                parent=parent,
-            )
-            if not retry:
-                raise
-
-
-def _mark_workbook_for_full_recalc(wb):
-    try:
-        wb.calculation.calcMode = "auto"
-        wb.calculation.fullCalcOnLoad = True
-        wb.calculation.forceFullCalc = True
-    except Exception:
-        pass
 
 
 def _safe_call(func, *args, default=None, **kwargs):
@@ -145,202 +109,55 @@ def _safe_call(func, *args, default=None, **kwargs):
         return default
 
 
-def _close_workbook_quietly(wb):
-    if wb is None:
-        return
-    _safe_call(wb.close)
-
-
-def _normalize_package_path(target: str) -> str:
-    normalized = (target or "").replace("\\", "/")
-    if normalized.startswith("/"):
-        normalized = normalized[1:]
-    return posixpath.normpath(normalized)
-
-
-def _worksheet_path_by_name(xlsx_path: str, sheet_name: str) -> str:
-    with zipfile.ZipFile(xlsx_path, "r") as workbook_zip:
-        workbook_root = ET.fromstring(workbook_zip.read("xl/workbook.xml"))
-        workbook_rels_root = ET.fromstring(workbook_zip.read("xl/_rels/workbook.xml.rels"))
+def _update_workbook_calc_properties(workbook_xml: bytes, *, full_calc_on_load: bool) -> bytes | None:
+    """calcPr を更新する。常時全再計算になる forceFullCalc は外し、必要なときだけ開いたときの全再計算を指定する。
 
-    rel_id_to_target = {}
-    for rel in workbook_rels_root.findall("pkg:Relationship", NS):
-        rel_id = rel.attrib.get("Id")
-        target = _normalize_package_path(rel.attrib.get("Target", ""))
-        if rel_id:
-            rel_id_to_target[rel_id] = target
-
-    for sheet in workbook_root.findall("main:sheets/main:sheet", NS):
-        if sheet.attrib.get("name") != sheet_name:
-            continue
-        rel_id = sheet.attrib.get(f"{{{REL_NS}}}id")
-        if not rel_id:
-            break
-        target = rel_id_to_target.get(rel_id, "")
-        if target.startswith("xl/"):
-            return target
-        if target.startswith("worksheets/"):
-            return f"xl/{target}"
-        return f"xl/{target}"
-
-    raise ValueError(f"シート '{sheet_name}' の XML パスを特定できませんでした。")
-
-
-def _cell_ref_sort_key(cell_ref: str) -> tuple[int, int]:
-    match = re.fullmatch(r"([A-Z]+)(\d+)", cell_ref.upper())
-    if not match:
-        return (10**9, 10**9)
-    col_letters, row_text = match.groups()
-    return (int(row_text), column_index_from_string(col_letters))
-
-
-def _find_or_create_row(sheet_data, row_index: int):
-    existing_rows = sheet_data.findall("main:row", NS)
-    for row in existing_rows:
-        if int(row.attrib.get("r", "0")) == row_index:
-            return row
-
-    new_row = ET.Element(f"{{{MAIN_NS}}}row", {"r": str(row_index)})
-    inserted = False
-    for pos, row in enumerate(existing_rows):
-        if int(row.attrib.get("r", "0")) > row_index:
-            sheet_data.insert(pos, new_row)
-            inserted = True
-            break
-    if not inserted:
-        sheet_data.append(new_row)
-    return new_row
-
-
-def _set_row_cell(row_elem, cell_ref: str, new_cell):
-    new_cell_copy = copy.deepcopy(new_cell)
-    existing_cells = row_elem.findall("main:c", NS)
-    for pos, cell in enumerate(existing_cells):
-        current_ref = cell.attrib.get("r", "")
-        if current_ref == cell_ref:
-            row_elem.remove(cell)
-            row_elem.insert(pos, new_cell_copy)
-            return
-        if _cell_ref_sort_key(current_ref) > _cell_ref_sort_key(cell_ref):
-            row_elem.insert(pos, new_cell_copy)
-            return
-    row_elem.append(new_cell_copy)
-
-
-def _merge_sheet_cells(source_xml: bytes, modified_xml: bytes, changed_refs: set[str]) -> bytes:
-    if not changed_refs:
-        return source_xml
-
-    source_root = ET.fromstring(source_xml)
-    modified_root = ET.fromstring(modified_xml)
-    source_sheet_data = source_root.find("main:sheetData", NS)
-    modified_sheet_data = modified_root.find("main:sheetData", NS)
-    if source_sheet_data is None or modified_sheet_data is None:
-        raise ValueError("sheetData の解析に失敗しました。")
-
-    modified_cell_map = {}
-    for row in modified_sheet_data.findall("main:row", NS):
-        for cell in row.findall("main:c", NS):
-            cell_ref = cell.attrib.get("r")
-            if cell_ref:
-                modified_cell_map[cell_ref] = cell
-
-    for cell_ref in sorted(changed_refs, key=_cell_ref_sort_key):
-        modified_cell = modified_cell_map.get(cell_ref)
-        if modified_cell is None:
-            continue
-        row_index = _cell_ref_sort_key(cell_ref)[0]
-        target_row = _find_or_create_row(source_sheet_data, row_index)
-        _set_row_cell(target_row, cell_ref, modified_cell)
-
-    merged_xml = ET.tostring(source_root, encoding="utf-8", xml_declaration=True)
-    return _restore_root_namespace_declarations(merged_xml, source_xml)
-
-
-def _mark_workbook_xml_for_full_recalc(workbook_xml: bytes) -> bytes:
+    変更が無ければ None を返す。
+    """
     root = ET.fromstring(workbook_xml)
     calc_pr = root.find("main:calcPr", NS)
     if calc_pr is None:
+        if not full_calc_on_load:
+            return None
         calc_pr = ET.SubElement(root, f"{{{MAIN_NS}}}calcPr")
-    calc_pr.set("calcMode", "auto")
-    calc_pr.set("fullCalcOnLoad", "1")
-    calc_pr.set("forceFullCalc", "1")
-    serialized_xml = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    elif not full_calc_on_load and "forceFullCalc" not in calc_pr.attrib:
+        return None
+    calc_pr.attrib.pop("forceFullCalc", None)
+    if full_calc_on_load:
+        calc_pr.set("calcMode", "auto")
+        calc_pr.set("fullCalcOnLoad", "1")
+    serialized_xml = _serialize_xml(root)
     return _restore_root_namespace_declarations(serialized_xml, workbook_xml)
 
 
-def _restore_root_namespace_declarations(serialized_xml: bytes, original_xml: bytes) -> bytes:
-    serialized_text = serialized_xml.decode("utf-8")
-    original_text = original_xml.decode("utf-8", errors="ignore")
-
-    serialized_match = re.search(r"<([A-Za-z0-9_:.-]+)([^>]*)>", serialized_text)
-    original_match = re.search(r"<([A-Za-z0-9_:.-]+)([^>]*)>", original_text)
-    if not serialized_match or not original_match:
-        return serialized_xml
-
-    serialized_root_tag = serialized_match.group(1)
-    serialized_root_attrs = serialized_match.group(2)
-    original_root_attrs = original_match.group(2)
+def _calc_chain_removal_parts(source_zip: zipfile.ZipFile) -> dict[str, bytes | None]:
+    source_names = set(source_zip.namelist())
+    replaced_parts = {CALC_CHAIN_PATH: None}
 
-    namespace_decls = re.findall(r'\s(xmlns(?::[A-Za-z0-9_.-]+)?)="([^"]+)"', original_root_attrs)
-    missing_decls = []
-    for attr_name, uri in namespace_decls:
-        decl_pattern = rf'\s{re.escape(attr_name)}="{re.escape(uri)}"'
-        if re.search(decl_pattern, serialized_root_attrs):
-            continue
-        missing_decls.append(f' {attr_name}="{uri}"')
-
-    if not missing_decls:
-        return serialized_xml
-
-    replacement = f"<{serialized_root_tag}{serialized_root_attrs}{''.join(missing_decls)}>"
-    updated_text = (
-        serialized_text[: serialized_match.start()]
-        + replacement
-        + serialized_text[serialized_match.end() :]
-    )
-    return updated_text.encode("utf-8")
-
-
-def _remove_calc_chain_parts(package_files: dict[str, bytes]):
-    package_files.pop("xl/calcChain.xml", None)
-
-    content_types_xml = package_files.get("[Content_Types].xml")
-    if content_types_xml is not None:
-        content_types_root = ET.fromstring(content_types_xml)
+    if CONTENT_TYPES_PATH in source_names:
+        content_types_root = ET.fromstring(source_zip.read(CONTENT_TYPES_PATH))
         for override in list(content_types_root.findall("ct:Override", NS)):
-            if override.attrib.get("PartName") == "/xl/calcChain.xml":
+            if override.attrib.get("PartName") == f"/{CALC_CHAIN_PATH}":
                 content_types_root.remove(override)
-        package_files["[Content_Types].xml"] = ET.tostring(
-            content_types_root,
-            encoding="utf-8",
-            xml_declaration=True,
-        )
+        replaced_parts[CONTENT_TYPES_PATH] = _serialize_xml(content_types_root)
 
-    workbook_rels_xml = package_files.get("xl/_rels/workbook.xml.rels")
-    if workbook_rels_xml is not None:
-        workbook_rels_root = ET.fromstring(workbook_rels_xml)
+    if WORKBOOK_RELS_PATH in source_names:
+        workbook_rels_root = ET.fromstring(source_zip.read(WORKBOOK_RELS_PATH))
         for rel in list(workbook_rels_root.findall("pkg:Relationship", NS)):
             if rel.attrib.get("Type", "").endswith("/calcChain"):
                 workbook_rels_root.remove(rel)
-        package_files["xl/_rels/workbook.xml.rels"] = ET.tostring(
-            workbook_rels_root,
-            encoding="utf-8",
-            xml_declaration=True,
-        )
+        replaced_parts[WORKBOOK_RELS_PATH] = _serialize_xml(workbook_rels_root)
+
+    return replaced_parts
 
 
 def _save_preserving_package_parts(
     source_xlsx_path: str,
-    modified_xlsx_path: str,
     out_path: str,
-    sheet_name: str,
-    changed_refs: set[str],
+    sheet: TargetSheet,
     *,
-    parent=None,
+    on_file_locked: FileLockedHandler | None = None,
 ) -> str:
-    source_sheet_path = _worksheet_path_by_name(source_xlsx_path, sheet_name)
-    modified_sheet_path = _worksheet_path_by_name(modified_xlsx_path, sheet_name)
     out_path = os.path.abspath(out_path)
     out_dir = os.path.dirname(out_path)
     if out_dir and not os.path.isdir(out_dir):
@@ -350,64 +167,36 @@ def _save_preserving_package_parts(
     ext = ext or ".xlsx"
     temp_out_path = f"{base}.tmp{ext}"
 
-    with zipfile.ZipFile(source_xlsx_path, "r") as source_zip:
-        package_files = {
-            name: source_zip.read(name)
-            for name in source_zip.namelist()
-        }
-
-    with zipfile.ZipFile(modified_xlsx_path, "r") as modified_zip:
-        merged_sheet_xml = _merge_sheet_cells(
-            package_files[source_sheet_path],
-            modified_zip.read(modified_sheet_path),
-            changed_refs,
-        )
-        package_files["xl/styles.xml"] = modified_zip.read("xl/styles.xml")
-
-    package_files[source_sheet_path] = merged_sheet_xml
-    package_files["xl/workbook.xml"] = _mark_workbook_xml_for_full_recalc(
-        package_files["xl/workbook.xml"]
-    )
-    _remove_calc_chain_parts(package_files)
-
     try:
-        with zipfile.ZipFile(temp_out_path, "w", compression=zipfile.ZIP_DEFLATED) as out_zip:
-            for name, data in package_files.items():
-                out_zip.writestr(name, data)
-        return _replace_file_atomic(temp_out_path, out_path, parent=parent)
+        # 変更パーツ以外は展開せずに複写するため、メモリ上には変更パーツだけを保持する
+        with zipfile.ZipFile(source_xlsx_path, "r") as source_zip:
+            workbook_xml = source_zip.read(WORKBOOK_PATH)
+            replaced_parts = {}
+            if CALC_CHAIN_PATH in source_zip.NameToInfo:
+                calc_chain_xml = rebuild_calc_chain(source_zip.read(CALC_CHAIN_PATH), workbook_xml, sheet)
+                if calc_chain_xml is None:
+                    replaced_parts.update(_calc_chain_removal_parts(source_zip))
+                else:
+                    replaced_parts[CALC_CHAIN_PATH] = calc_chain_xml
+
+            generated = evaluate_generated_cells(sheet, source_zip)
+            replaced_parts[sheet.sheet_path] = _merge_sheet_cells(sheet, generated.values)
+            if generated.needs_full_recalc:
+                print(f"[info] 開いたときに 1 回だけ全再計算を行うよう設定します: {generated.reason}")
+            updated_workbook_xml = _update_workbook_calc_properties(
+                workbook_xml,
+                full_calc_on_load=generated.needs_full_recalc,
+            )
+            if updated_workbook_xml is not None:
+                replaced_parts[WORKBOOK_PATH] = updated_workbook_xml
+            write_package_with_replacements(source_zip, temp_out_path, replaced_parts)
+        return _replace_file_atomic(temp_out_path, out_path, on_file_locked=on_file_locked)
     finally:
         if os.path.exists(temp_out_path):
             _safe_call(os.remove, temp_out_path)
 
 
-def _finalize_modified_workbook(
-    wb,
-    wb_values,
-    *,
-    source_xlsx_path: str,
-    out_path: str,
-    sheet_name: str,
-    changed_refs: set[str],
-    parent=None,
-) -> str:
-    _mark_workbook_for_full_recalc(wb)
-    temp_saved_path = _save_workbook_to_temp_file(wb, out_path)
-    _close_workbook_quietly(wb_values)
-    _close_workbook_quietly(wb)
-
-    try:
-        return _save_preserving_package_parts(
-            source_xlsx_path,
-            temp_saved_path,
-            out_path,
-            sheet_name,
-            changed_refs,
-            parent=parent,
-        )
-    finally:
-        _safe_call(os.remove, temp_saved_path)
-
-
+@phase("excel_recalc")
 def _force_excel_recalc_and_save(xlsx_path: str):
     if os.environ.get(FORCE_EXCEL_RECALC_ENV, "").strip() != "1":
         print(
@@ -539,6 +328,11 @@ def _normalize_measure_to_index_map(raw_map: dict):
     return normalized
 
 
+def _column_formula_template(formula: str) -> list[str]:
+    """列名を `_COLUMN_PLACEHOLDER` にして組み立てた数式を、列名の位置で分けた断片にする（`col_letter.join()` で戻す）。"""
+    return formula.split(_COLUMN_PLACEHOLDER)
+
+
 def _build_auto_data_formula(col_letter: str, data_start_row: int, data_index: int, sep: str):
     source_row = data_start_row + data_index - 1
     return (
@@ -587,37 +381,34 @@ def _can_overwrite_with_formula(value):
 
 
 def _normalize_single_cell_array_formulas_in_column(
-    ws,
+    sheet: TargetSheet,
     col_letter: str,
     *,
     row_start: int = 1,
     row_end: int | None = None,
 ):
     col_idx = column_index_from_string(col_letter)
-    max_row = ws.max_row or row_start
+    max_row = sheet.max_row or row_start
     end_row = max_row if row_end is None else min(row_end, max_row)
-    rewritten_refs = set()
+    rewritten_positions: set[tuple[int, int]] = set()
 
     start_row = max(row_start, 1)
     for row in range(start_row, end_row + 1):
-        cell = ws.cell(row, col_idx)
-        value = cell.value
+        value = sheet.value(row, col_idx)
         if not isinstance(value, ArrayFormula):
             continue
 
-        formula_ref = str(value.ref or "").replace("$", "")
-        cell_ref = cell.coordinate.replace("$", "")
-        if formula_ref != cell_ref:
+        if _parse_range_ref(str(value.ref or "").replace("$", "")) != (row, col_idx, row, col_idx):
             continue
 
         formula_text = str(value.text or "").strip()
         if not formula_text:
             continue
 
-        cell.value = f"={formula_text.lstrip('=')}"
-        rewritten_refs.add(cell.coordinate)
+        sheet.set_value(row, col_idx, f"={formula_text.lstrip('=')}")
+        rewritten_positions.add((row, col_idx))
 
-    return rewritten_refs
+    return rewritten_positions
 
 
 def _build_summary_formula(col_letter: str, row_offset: int) -> str:
@@ -691,32 +482,24 @@ def _normalize_formula_text(value) -> str:
     return re.sub(r"\s+", "", str(value)).replace("$", "").upper()
 
 
-def _ensure_summary_formulas(ws):
+@phase("summary_formulas")
+def _ensure_summary_formulas(sheet: TargetSheet):
     summary_col_start = column_index_from_string(SUMMARY_FORMULA_COL_START)
     summary_col_end = column_index_from_string(SUMMARY_FORMULA_COL_END)
-    changed_refs = set()
 
     for col_idx in range(summary_col_start, summary_col_end + 1):
         col_letter = get_column_letter(col_idx)
         expected_row1_formula = _build_summary_formula(col_letter, 0)
-        row1_cell = ws.cell(1, col_idx)
-        if _normalize_formula_text(row1_cell.value) == _normalize_formula_text(
+        if _normalize_formula_text(sheet.value(1, col_idx)) == _normalize_formula_text(
             expected_row1_formula
         ):
             continue
 
         for row_idx in range(1, 4):
-            ws.cell(row_idx, col_idx).value = _build_summary_formula(
-                col_letter,
-                row_idx - 1,
-            )
-            changed_refs.add(f"{col_letter}{row_idx}")
-
-    return changed_refs
+            sheet.set_value(row_idx, col_idx, _build_summary_formula(col_letter, row_idx - 1))
 
 
-def build_request_formulas(xlsx_path: str, out_path: str, cfg: dict, *, parent=None):
-    sheet_name = cfg["sheet_name"]
+def _apply_request_formulas(sheet: TargetSheet, cfg: dict):
     measure_no_col = cfg.get("measure_no_col", "A")
     measure_row_min = int(cfg.get("measure_row_min", 11))
     measure_row_step = int(cfg.get("measure_row_step", 3))
@@ -736,46 +519,43 @@ def build_request_formulas(xlsx_path: str, out_path: str, cfg: dict, *, parent=N
     tools = cfg["tools"]
     tool_to_measure_nos = cfg["tool_to_measure_nos"]
 
-    wb = load_workbook(xlsx_path)
-    wb_values = load_workbook(xlsx_path, data_only=True)
-    if sheet_name not in wb.sheetnames:
-        raise ValueError(
-            f"シート '{sheet_name}' が見つかりません。存在: {wb.sheetnames}"
-        )
-
-    ws = wb[sheet_name]
-    ws_values = wb_values[sheet_name]
-    changed_refs = set()
-
     no_col = column_index_from_string(measure_no_col)
-    measure_no_to_row = {}
-    measure_row_to_no = {}
-    max_r = min(measure_row_max, ws.max_row or measure_row_max)
-    for row_index in range(measure_row_min, max_r + 1):
-        value = ws_values.cell(row_index, no_col).value
-        if value is None:
-            value = ws.cell(row_index, no_col).value
-        if value is None:
-            continue
-        measure_no = _resolve_measure_no(value, row_index, measure_row_min, measure_row_step)
-        if measure_no is None:
-            continue
-        measure_no_to_row[measure_no] = row_index
-        measure_row_to_no[row_index] = measure_no
-
-    tool_row = {}
-    tool_name_col_index = column_index_from_string(tool_name_col)
-    current_tool_row = tool_start_row
-    for tool in tools:
-        tool_cell = _get_writable_cell(ws, current_tool_row, tool_name_col_index)
-        tool_cell.value = tool
-        tool_row[tool] = tool_cell.row
-        changed_refs.add(tool_cell.coordinate)
-        current_tool_row += tool_row_step
-
-    auto_data_label_cell = _get_writable_cell(ws, auto_data_start_row, tool_name_col_index)
-    auto_data_label_cell.value = f"測定結果貼付は{auto_data_start_row}行から"
-    changed_refs.add(auto_data_label_cell.coordinate)
+    with phase("measure_scan"):
+        measure_no_to_row = {}
+        measure_row_to_no = {}
+        max_r = min(measure_row_max, sheet.max_row or measure_row_max)
+        for row_index in range(measure_row_min, max_r + 1):
+            value = sheet.cached_value(row_index, no_col)
+            if value is None:
+                value = sheet.value(row_index, no_col)
+            if value is None:
+                continue
+            measure_no = _resolve_measure_no(value, row_index, measure_row_min, measure_row_step)
+            if measure_no is None:
+                continue
+            measure_no_to_row[measure_no] = row_index
+            measure_row_to_no[row_index] = measure_no
+
+    with phase("tool_rows"):
+        tool_row = {}
+        tool_name_col_index = column_index_from_string(tool_name_col)
+        current_tool_row = tool_start_row
+        for tool in tools:
+            tool_cell_row, tool_cell_col = _get_writable_cell(sheet, current_tool_row, tool_name_col_index)
+            sheet.set_value(tool_cell_row, tool_cell_col, tool)
+            tool_row[tool] = tool_cell_row
+            current_tool_row += tool_row_step
+
+        auto_data_label_row, auto_data_label_col = _get_writable_cell(
+            sheet,
+            auto_data_start_row,
+            tool_name_col_index,
+        )
+        sheet.set_value(
+            auto_data_label_row,
+            auto_data_label_col,
+            f"測定結果貼付は{auto_data_start_row}行から",
+        )
 
     measure_row_to_tool_rows = {}
     missing_nos = []
@@ -795,66 +575,62 @@ def build_request_formulas(xlsx_path: str, out_path: str, cfg: dict, *, parent=N
 
     all_tool_rows = sorted(tool_row.values())
 
-    changed_refs.update(_ensure_summary_formulas(ws))
+    _ensure_summary_formulas(sheet)
 
-    written = 0
-    target_found = 0
-    for col_idx in range(flag_col_start, flag_col_end + 1):
-        col_letter = get_column_letter(col_idx)
-        header_cell = ws.cell(REQUEST_HEADER_ROW, col_idx)
-        if _can_overwrite_with_formula(header_cell.value):
-            header_formula = _build_request_header_formula(
-                col_letter=col_letter,
+    with phase("formula_grid"):
+        # 列名だけが変わる数式は行ごとに 1 回だけ組み立て、列ごとには列名を差し込むだけにする
+        header_template = _column_formula_template(
+            _build_request_header_formula(
+                col_letter=_COLUMN_PLACEHOLDER,
                 sep=formula_arg_sep,
                 tool_row_min=all_tool_rows[0] if all_tool_rows else None,
                 tool_row_max=all_tool_rows[-1] if all_tool_rows else None,
                 tool_row_step=tool_row_step if all_tool_rows else None,
             )
-            header_cell.value = header_formula
-            changed_refs.add(header_cell.coordinate)
-
+        )
+        row_templates = []
         for measure_row, tool_rows in measure_row_to_tool_rows.items():
-            conditions = formula_arg_sep.join([f'{col_letter}${tool_row_index}<>""' for tool_row_index in tool_rows])
-            measure_no = measure_row_to_no.get(measure_row)
-            data_index = measure_no_to_data_index.get(measure_no)
-            target_found += 1
-            target_cell = ws.cell(measure_row, col_idx)
-            if not _can_overwrite_with_formula(target_cell.value):
-                continue
+            conditions = formula_arg_sep.join(
+                [f'{_COLUMN_PLACEHOLDER}${tool_row_index}<>""' for tool_row_index in tool_rows]
+            )
+            data_index = measure_no_to_data_index.get(measure_row_to_no.get(measure_row))
+            auto_formula = None
             if data_index is not None:
                 auto_formula = _build_auto_data_formula(
-                    col_letter=col_letter,
+                    col_letter=_COLUMN_PLACEHOLDER,
                     data_start_row=auto_data_start_row,
                     data_index=data_index,
                     sep=formula_arg_sep,
                 )
-                target_cell.value = _build_measure_row_formula(
-                    conditions,
-                    formula_arg_sep,
-                    auto_formula,
-                )
-            else:
-                target_cell.value = _build_measure_row_formula(conditions, formula_arg_sep)
-            written += 1
-            changed_refs.add(target_cell.coordinate)
-
+            measure_formula = _build_measure_row_formula(conditions, formula_arg_sep, auto_formula)
+            row_templates.append((measure_row, _column_formula_template(measure_formula)))
         for measure_no, data_index in measure_no_to_data_index.items():
             measure_row = measure_no_to_row.get(measure_no)
             if measure_row is None or measure_row in measure_row_to_tool_rows:
                 continue
-            target_found += 1
-            target_cell = ws.cell(measure_row, col_idx)
-            if not _can_overwrite_with_formula(target_cell.value):
-                continue
             auto_formula = _build_auto_data_formula(
-                col_letter=col_letter,
+                col_letter=_COLUMN_PLACEHOLDER,
                 data_start_row=auto_data_start_row,
                 data_index=data_index,
                 sep=formula_arg_sep,
             )
-            target_cell.value = f"={auto_formula}"
-            written += 1
-            changed_refs.add(target_cell.coordinate)
+            row_templates.append((measure_row, _column_formula_template(f"={auto_formula}")))
+
+        written = 0
+        target_found = 0
+        column_count = flag_col_end - flag_col_start + 1
+        for col_idx in range(flag_col_start, flag_col_end + 1):
+            report_progress(col_idx - flag_col_start, column_count)
+            col_letter = get_column_letter(col_idx)
+            if _can_overwrite_with_formula(sheet.value(REQUEST_HEADER_ROW, col_idx)):
+                sheet.set_value(REQUEST_HEADER_ROW, col_idx, col_letter.join(header_template))
+
+            for measure_row, template in row_templates:
+                target_found += 1
+                if not _can_overwrite_with_formula(sheet.value(measure_row, col_idx)):
+                    continue
+                sheet.set_value(measure_row, col_idx, col_letter.join(template))
+                written += 1
 
     if target_found == 0:
         raise ValueError(
@@ -870,28 +646,6 @@ def build_request_formulas(xlsx_path: str, out_path: str, cfg: dict, *, parent=N
             "3) tool_to_measure_nos のNoがシートに存在しない"
         )
 
-    normalized_refs = _normalize_single_cell_array_formulas_in_column(
-        ws,
-        "B",
-        row_start=measure_row_min,
-        row_end=measure_row_max,
-    )
-    if normalized_refs:
-        changed_refs.update(normalized_refs)
-        print(f"[info] B列の単一セル配列数式を通常数式へ変換: {len(normalized_refs)}件")
-
-    saved_path = _finalize_modified_workbook(
-        wb,
-        wb_values,
-        source_xlsx_path=xlsx_path,
-        out_path=out_path,
-        sheet_name=sheet_name,
-        changed_refs=changed_refs,
-        parent=parent,
-    )
-    _force_excel_recalc_and_save(saved_path)
-    return saved_path
-
 
 def _parse_int_list(text: str):
     if not text or not text.strip():
@@ -908,18 +662,8 @@ def _parse_int_list(text: str):
     return nums
 
 
-def write_measurement_not_required(
-    xlsx_path: str,
-    out_path: str,
-    cfg: dict,
-    target_nos: list | None = None,
-    *,
-    parent=None,
-):
-    if target_nos is None:
-        target_nos = []
-
-    sheet_name = cfg.get("sheet_name", "工程内検査シート")
+@phase("not_required")
+def _apply_measurement_not_required(sheet: TargetSheet, cfg: dict, target_nos: list):
     measure_no_col = cfg.get("measure_no_col", "A")
     tool_start_row = int(cfg.get("tool_start_row", 200))
     not_required_row = int(cfg.get("not_required_row", tool_start_row - 3))
@@ -928,30 +672,17 @@ def write_measurement_not_required(
     measure_row_max = int(cfg.get("measure_row_max", tool_start_row - 4))
     formula_arg_sep = str(cfg.get("formula_arg_sep", ",")).strip() or ","
 
-    wb = load_workbook(xlsx_path)
-    wb_values = load_workbook(xlsx_path, data_only=True)
-
-    if sheet_name not in wb.sheetnames:
-        raise ValueError(
-            f"シート '{sheet_name}' が見つかりません。存在: {wb.sheetnames}"
-        )
-
-    ws = wb[sheet_name]
-    ws_values = wb_values[sheet_name]
-    changed_refs = set()
-
     no_col = column_index_from_string(measure_no_col)
     measure_no_to_row = {}
-    max_r = min(measure_row_max, ws.max_row or measure_row_max)
+    max_r = min(measure_row_max, sheet.max_row or measure_row_max)
     debug_info = []
 
     for row_index in range(measure_row_min, max_r + 1):
-        value = ws_values.cell(row_index, no_col).value
-        cell_obj = ws.cell(row_index, no_col)
+        value = sheet.cached_value(row_index, no_col)
         formula = None
 
         if value is None:
-            value = cell_obj.value
+            value = sheet.value(row_index, no_col)
             if isinstance(value, str) and value.startswith("="):
                 formula = value
 
@@ -972,9 +703,8 @@ def write_measurement_not_required(
     target_row = not_required_row
 
     e_col = column_index_from_string("E")
-    target_e_cell = _get_writable_cell(ws, target_row, e_col)
-    target_e_cell.value = "測定不要"
-    changed_refs.add(target_e_cell.coordinate)
+    target_e_row, target_e_col = _get_writable_cell(sheet, target_row, e_col)
+    sheet.set_value(target_e_row, target_e_col, "測定不要")
 
     flag_col_start = column_index_from_string("L")
     flag_col_end = column_index_from_string("SR")
@@ -988,15 +718,18 @@ def write_measurement_not_required(
         for col_idx in range(flag_col_start, flag_col_end + 1):
             col_letter = get_column_letter(col_idx)
             target_cell = f"{col_letter}{target_row}"
-            current_cell = ws.cell(row_index, col_idx)
-            if not _can_overwrite_with_formula(current_cell.value):
+            current_value = sheet.value(row_index, col_idx)
+            if not _can_overwrite_with_formula(current_value):
                 continue
-            current_cell.value = _build_not_required_overlay_formula(
-                current_cell.value,
-                target_cell,
-                formula_arg_sep,
+            sheet.set_value(
+                row_index,
+                col_idx,
+                _build_not_required_overlay_formula(
+                    current_value,
+                    target_cell,
+                    formula_arg_sep,
+                ),
             )
-            changed_refs.add(current_cell.coordinate)
         written_count += 1
 
     if written_count == 0 and target_nos:
@@ -1019,24 +752,108 @@ def write_measurement_not_required(
             f"※測定Noが数式の場合、Excelで一度ファイルを開いて保存してから再実行してください。"
         )
 
-    normalized_refs = _normalize_single_cell_array_formulas_in_column(
-        ws,
+
+@phase("normalize_array_formulas")
+def _normalize_measure_column_formulas(sheet: TargetSheet, cfg: dict):
+    measure_row_min = int(cfg.get("measure_row_min", 11))
+    tool_start_row = int(cfg.get("tool_start_row", 200))
+    measure_row_max = int(cfg.get("measure_row_max", tool_start_row - 4))
+    return _normalize_single_cell_array_formulas_in_column(
+        sheet,
         "B",
         row_start=measure_row_min,
         row_end=measure_row_max,
     )
-    if normalized_refs:
-        changed_refs.update(normalized_refs)
-        print(f"[info] B列の単一セル配列数式を通常数式へ変換: {len(normalized_refs)}件")
-
-    saved_path = _finalize_modified_workbook(
-        wb,
-        wb_values,
-        source_xlsx_path=xlsx_path,
-        out_path=out_path,
-        sheet_name=sheet_name,
-        changed_refs=changed_refs,
-        parent=parent,
+
+
+def _save_generated_sheet(
+    sheet: TargetSheet,
+    xlsx_path: str,
+    out_path: str,
+    cfg: dict,
+    *,
+    on_file_locked: FileLockedHandler | None = None,
+) -> str:
+    normalized_positions = _normalize_measure_column_formulas(sheet, cfg)
+    if normalized_positions:
+        print(f"[info] B列の単一セル配列数式を通常数式へ変換: {len(normalized_positions)}件")
+
+    saved_path = _save_preserving_package_parts(
+        xlsx_path,
+        out_path,
+        sheet,
+        on_file_locked=on_file_locked,
     )
     _force_excel_recalc_and_save(saved_path)
     return saved_path
+
+
+def build_request_formulas(
+    xlsx_path: str,
+    out_path: str,
+    cfg: dict,
+    *,
+    on_file_locked: FileLockedHandler | None = None,
+    on_progress: ProgressHandler | None = None,
+    cancel_token: CancelToken | None = None,
+):
+    with track_progress(on_progress, cancel_token):
+        sheet = load_template_sheet(xlsx_path, cfg["sheet_name"])
+        _apply_request_formulas(sheet, cfg)
+        return _save_generated_sheet(sheet, xlsx_path, out_path, cfg, on_file_locked=on_file_locked)
+
+
+def write_measurement_not_required(
+    xlsx_path: str,
+    out_path: str,
+    cfg: dict,
+    target_nos: list | None = None,
+    *,
+    on_file_locked: FileLockedHandler | None = None,
+    on_progress: ProgressHandler | None = None,
+    cancel_token: CancelToken | None = None,
+):
+    if target_nos is None:
+        target_nos = []
+
+    with track_progress(on_progress, cancel_token):
+        sheet = load_template_sheet(xlsx_path, cfg.get("sheet_name", "工程内検査シート"))
+        _apply_measurement_not_required(sheet, cfg, target_nos)
+        return _save_generated_sheet(sheet, xlsx_path, out_path, cfg, on_file_locked=on_file_locked)
+
+
+def generate_inspection_sheet(
+    xlsx_path: str,
+    out_path: str,
+    cfg: dict,
+    not_required_nos: list | None = None,
+    *,
+    on_file_locked: FileLockedHandler | None = None,
+    on_progress: ProgressHandler | None = None,
+    cancel_token: CancelToken | None = None,
+):
+    """依頼式・自動測定式と測定不要の上書きを 1 回の読み込み・1 回の保存でまとめて行う。
+
+    測定不要の書き込みだけが失敗した場合は依頼式のみを保存し、
+    保存先を持つ MeasurementNotRequiredError を送出する。
+    on_progress / cancel_token は `progress.track_progress()` と同じ（取り消すと GenerationCancelled）。
+    """
+    with track_progress(on_progress, cancel_token):
+        sheet = load_template_sheet(xlsx_path, cfg["sheet_name"])
+        _apply_request_formulas(sheet, cfg)
+
+        not_required_error = None
+        if not_required_nos:
+            request_changes = dict(sheet.changes)
+            try:
+                _apply_measurement_not_required(sheet, cfg, not_required_nos)
+            except GenerationCancelled:
+                raise
+            except Exception as e:
+                sheet.changes = request_changes
+                not_required_error = e
+
+        saved_path = _save_generated_sheet(sheet, xlsx_path, out_path, cfg, on_file_locked=on_file_locked)
+    if not_required_error is not None:
+        raise MeasurementNotRequiredError(str(not_required_error), saved_path) from not_required_error
+    return saved_path
@@ -0,0 +1,893 @@
+"""本ツールが生成する数式（IF / OR / IFERROR / LEN / TRIM / SUMPRODUCT / MOD / ROW など）だけを評価する簡易計算器。
+
+Excel の全機能は扱わず、対応外の関数や構文は UnsupportedFormula を送出する。
+呼び出し側はその場合キャッシュ値を書かずに Excel の再計算へ任せる。
+"""
+import math
+import operator
+import re
+from functools import lru_cache, partial
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+
+_MAX_ROW_INDEX = 1048576
+_MAX_COLUMN_INDEX = 16384
+
+
+class UnsupportedFormula(Exception):
+    """評価器が扱わない関数・構文・参照を含む数式。"""
+
+
+class ExcelError:
+    """`#VALUE!` などの Excel エラー値。"""
+
+    __slots__ = ("code",)
+
+    def __init__(self, code: str):
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return f"ExcelError({self.code!r})"
+
+
+VALUE_ERROR = ExcelError("#VALUE!")
+DIV0_ERROR = ExcelError("#DIV/0!")
+NUM_ERROR = ExcelError("#NUM!")
+ERROR_CODES = frozenset(
+    ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A", "#GETTING_DATA", "#SPILL!", "#CALC!")
+)
+
+
+class Array:
+    """範囲参照や配列演算の結果（行のリスト）。"""
+
+    __slots__ = ("rows",)
+
+    def __init__(self, rows: list[list]):
+        self.rows = rows
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.rows), len(self.rows[0]) if self.rows else 0
+
+    def values(self):
+        for row in self.rows:
+            yield from row
+
+
+_TOKEN_PATTERN = re.compile(
+    r"(?P<space>\s+)"
+    r'|(?P<string>"(?:[^"]|"")*")'
+    r"|(?P<sheet>(?:'(?:[^']|'')*'|[^\s'\"!(),:&=<>+\-*/^%]+)!)"
+    r"|(?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)(?![A-Za-z0-9_(])"
+    r"|(?P<ref>\$?[A-Z]{1,3}\$?\d+)(?![A-Za-z0-9_(])"
+    r"|(?P<wholerange>\$?[A-Z]{1,3}:\$?[A-Z]{1,3}|\$?\d+:\$?\d+)(?![A-Za-z0-9_(])"
+    r"|(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)"
+    r"|(?P<func>[A-Za-z_][A-Za-z0-9_.]*)\("
+    r"|(?P<name>[A-Za-z_\\][A-Za-z0-9_.\\]*)"
+    r"|(?P<op><>|<=|>=|[-+*/^&=<>(),%])"
+)
+_CELL_PATTERN = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)")
+# 文字列リテラル・シート名・列全体参照・セル参照を左から順に拾う。関数名（LOG10( など）やシート名は参照として扱わない
+_COLUMN_KEY_TOKEN_PATTERN = re.compile(
+    r'"(?:[^"]|"")*"'
+    r"|'(?:[^']|'')*'!"
+    r"|(?P<columns>(?<![A-Za-z0-9_.$])\$?[A-Z]{1,3}:\$?[A-Z]{1,3}(?![A-Za-z0-9_(!]))"
+    r"|(?<![A-Za-z0-9_.$])(?P<col_abs>\$?)(?P<col>[A-Z]{1,3})(?P<row_abs>\$?)(?P<row>\d+)(?![A-Za-z0-9_(!])"
+)
+
+
+@lru_cache(maxsize=16384)
+def _column_relative_formula_key(formula: str, col: int) -> str | None:
+    """相対列参照を自セルからの列差へ置き換え、列方向にコピーした数式どうしが同じ値になるキーを作る。
+
+    共有数式の判定と、評価器の構文木キャッシュで使う。列全体参照を含む式は None。
+    """
+    parts = []
+    last_end = 0
+    for match in _COLUMN_KEY_TOKEN_PATTERN.finditer(formula):
+        if match.group("columns"):
+            # 列全体参照（L:L など）の列ずれは追跡しない
+            return None
+        col_letters = match.group("col")
+        if col_letters is None or match.group("col_abs"):
+            continue
+        ref_col = column_index_from_string(col_letters)
+        if ref_col > _MAX_COLUMN_INDEX:
+            continue
+        parts.append(formula[last_end:match.start()])
+        parts.append(f"\0C[{ref_col - col}]{match.group('row_abs')}{match.group('row')}")
+        last_end = match.end()
+    if not parts:
+        # 相対列参照を含まない数式も、同じ本文なら共有数式にまとめられる
+        return formula
+    parts.append(formula[last_end:])
+    return "".join(parts)
+
+
+_WHOLE_ROW_RANGE_PATTERN = re.compile(r"(?<![A-Za-z0-9_.$])\$?\d+:\$?\d+(?![A-Za-z0-9_(!])")
+
+
+def translate_formula(formula: str, row_offset: int, col_offset: int) -> str | None:
+    """相対参照を行・列方向へずらした数式を返す（共有数式の展開用）。
+
+    列全体・行全体の参照を含む場合や、ずらした結果がシートの範囲外になる場合は None を返す
+    （呼び出し側で openpyxl の Translator に任せる）。
+    """
+    if _WHOLE_ROW_RANGE_PATTERN.search(formula):
+        return None
+    parts = []
+    last_end = 0
+    for match in _COLUMN_KEY_TOKEN_PATTERN.finditer(formula):
+        if match.group("columns"):
+            return None
+        col_letters = match.group("col")
+        if col_letters is None:
+            continue
+        col_abs = match.group("col_abs")
+        row_abs = match.group("row_abs")
+        ref_col = column_index_from_string(col_letters)
+        ref_row = int(match.group("row"))
+        if not col_abs:
+            ref_col += col_offset
+        if not row_abs:
+            ref_row += row_offset
+        if not 1 <= ref_col <= _MAX_COLUMN_INDEX or not 1 <= ref_row <= _MAX_ROW_INDEX:
+            return None
+        parts.append(formula[last_end:match.start()])
+        parts.append(f"{col_abs}{get_column_letter(ref_col)}{row_abs}{ref_row}")
+        last_end = match.end()
+    parts.append(formula[last_end:])
+    return "".join(parts)
+
+
+def _tokenize(formula: str) -> list[tuple[str, str]]:
+    tokens = []
+    pos = 0
+    length = len(formula)
+    while pos < length:
+        match = _TOKEN_PATTERN.match(formula, pos)
+        if match is None:
+            raise UnsupportedFormula(f"解析できない文字があります: {formula[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        if kind == "func":
+            tokens.append(("func", match.group("func").upper()))
+            tokens.append(("op", "("))
+        elif kind != "space":
+            tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _parse_cell(text: str) -> tuple[int, int]:
+    match = _CELL_PATTERN.fullmatch(text)
+    col = column_index_from_string(match.group(1))
+    row = int(match.group(2))
+    if col > _MAX_COLUMN_INDEX or not 1 <= row <= _MAX_ROW_INDEX:
+        raise UnsupportedFormula(f"範囲外の参照です: {text}")
+    return row, col
+
+
+class _Parser:
+    """Excel の演算子優先順位（比較 < & < 加減 < 乗除 < べき乗 < 単項）に沿った再帰下降パーサ。"""
+
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect_op(self, op: str):
+        kind, text = self.take()
+        if kind != "op" or text != op:
+            raise UnsupportedFormula(f"'{op}' が必要です: {text!r}")
+
+    def parse(self):
+        node = self.comparison()
+        if self.pos != len(self.tokens):
+            raise UnsupportedFormula(f"解析できない字句があります: {self.peek()[1]!r}")
+        return node
+
+    def comparison(self):
+        node = self.concat()
+        while self.peek()[0] == "op" and self.peek()[1] in ("=", "<>", "<", ">", "<=", ">="):
+            op = self.take()[1]
+            node = ("cmp", op, node, self.concat())
+        return node
+
+    def concat(self):
+        node = self.additive()
+        while self.peek() == ("op", "&"):
+            self.take()
+            node = ("concat", node, self.additive())
+        return node
+
+    def additive(self):
+        node = self.term()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-"):
+            op = self.take()[1]
+            node = ("arith", op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.power()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/"):
+            op = self.take()[1]
+            node = ("arith", op, node, self.power())
+        return node
+
+    def power(self):
+        node = self.unary()
+        while self.peek() == ("op", "^"):
+            self.take()
+            node = ("arith", "^", node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek()[0] == "op" and self.peek()[1] in ("-", "+"):
+            op = self.take()[1]
+            operand = self.unary()
+            if op == "+":
+                return ("pos", operand)
+            if operand[0] == "neg":
+                # `--(条件)` は論理値を 0/1 へ変換する定型なので、数値化 1 回にまとめる
+                return ("number", operand[1])
+            return ("neg", operand)
+        return self.primary()
+
+    def primary(self):
+        kind, text = self.take()
+        if kind == "number":
+            return ("const", float(text) if any(ch in text for ch in ".eE") else int(text))
+        if kind == "string":
+            return ("const", text[1:-1].replace('""', '"'))
+        if kind == "ref":
+            row, col = _parse_cell(text)
+            return ("ref", row, col, not text.startswith("$"))
+        if kind == "range":
+            start, end = text.split(":")
+            start_row, start_col = _parse_cell(start)
+            end_row, end_col = _parse_cell(end)
+            (min_col, min_relative), (max_col, max_relative) = sorted(
+                ((start_col, not start.startswith("$")), (end_col, not end.startswith("$")))
+            )
+            return (
+                "range",
+                min(start_row, end_row),
+                min_col,
+                max(start_row, end_row),
+                max_col,
+                min_relative,
+                max_relative,
+            )
+        if kind == "name" and text.upper() in ("TRUE", "FALSE"):
+            return ("const", text.upper() == "TRUE")
+        if kind == "func":
+            return self.function(text)
+        if kind == "op" and text == "(":
+            node = self.comparison()
+            self.expect_op(")")
+            return node
+        raise UnsupportedFormula(f"対応していない字句です: {text!r}")
+
+    def function(self, name: str):
+        if name not in _FUNCTIONS:
+            raise UnsupportedFormula(f"対応していない関数です: {name}")
+        self.expect_op("(")
+        args = []
+        if self.peek() == ("op", ")"):
+            self.take()
+            return ("func", name, args)
+        while True:
+            if self.peek()[0] == "op" and self.peek()[1] in (",", ")"):
+                raise UnsupportedFormula(f"省略された引数には対応していません: {name}")
+            args.append(self.comparison())
+            kind, text = self.take()
+            if kind == "op" and text == ")":
+                return ("func", name, args)
+            if kind != "op" or text != ",":
+                raise UnsupportedFormula(f"{name} の引数を解析できません: {text!r}")
+
+
+def _is_constant(node) -> bool:
+    kind = node[0]
+    if kind == "const":
+        return True
+    if kind in ("ref", "range"):
+        return False
+    if kind == "func":
+        if node[1] == "ROW":
+            # ROW(範囲) はセルの値を読まないため定数。引数なしの ROW() は数式のあるセルで変わる
+            return bool(node[2])
+        return all(_is_constant(arg) for arg in node[2])
+    return all(_is_constant(child) for child in node[1:] if isinstance(child, tuple))
+
+
+def _prepare_node(node, anchor_col: int):
+    """相対列参照を基準列からの差に置き換え、セルの値に依存しない部分木を計算済みの定数にする。
+
+    `MOD(ROW(L11:L119)-ROW(L11),3)=0` のような行番号だけの式は、列方向にコピーした数式全体で 1 回だけ計算される。
+    """
+    kind = node[0]
+    if kind == "const":
+        return node
+    if kind == "ref":
+        _, row, col, relative = node
+        return ("ref", row, col - anchor_col if relative else col, relative)
+    if kind == "range":
+        _, min_row, min_col, max_row, max_col, min_relative, max_relative = node
+        return (
+            "range",
+            min_row,
+            min_col - anchor_col if min_relative else min_col,
+            max_row,
+            max_col - anchor_col if max_relative else max_col,
+            min_relative,
+            max_relative,
+        )
+    if _is_constant(node):
+        return ("const", FormulaEvaluator(_no_cell_reference).evaluate(node, 0, 0))
+    if kind == "cmp" and node[1] in ("=", "<>") and node[3] == ("const", ""):
+        # 生成式に多い空欄判定 `X<>""` は型変換を省いた専用の判定にする
+        return ("blank", node[1] == "=", _prepare_node(node[2], anchor_col))
+    if kind == "func":
+        return ("func", node[1], [_prepare_node(arg, anchor_col) for arg in node[2]])
+    return tuple(_prepare_node(child, anchor_col) if isinstance(child, tuple) else child for child in node)
+
+
+def _no_cell_reference(row: int, col: int):
+    raise UnsupportedFormula("定数式からセルは参照できません。")
+
+
+_PARSED_FORMULA_CACHE_SIZE = 4096
+_parsed_formulas: dict = {}
+
+
+def parse_formula(formula: str, col: int):
+    """`=` を除いた col 列の数式本文を構文木へ変換する。対応外なら UnsupportedFormula。
+
+    列方向にコピーした関係の数式は同じ構文木を共有するため、解析と定数計算は形ごとに 1 回で済む。
+    """
+    key = _column_relative_formula_key(formula, col)
+    cache_key = key if key is not None else (formula, col)
+    node = _parsed_formulas.get(cache_key)
+    if node is None:
+        node = _prepare_node(_Parser(_tokenize(formula)).parse(), col)
+        if len(_parsed_formulas) >= _PARSED_FORMULA_CACHE_SIZE:
+            _parsed_formulas.clear()
+        _parsed_formulas[cache_key] = node
+    return node
+
+
+def formula_references(formula: str):
+    """数式中の参照を (シート名 or None, 開始行, 開始列, 終了行, 終了列) で返す。
+
+    OFFSET・名前定義など参照先を静的に特定できない要素があれば None を返す。
+    列全体・行全体の参照と、先頭の文字列で別シートを指す INDIRECT はシートの端までの範囲として返す。
+    """
+    references = _references_with_column_flags(formula)
+    if references is None:
+        return None
+    return [reference[:5] for reference in references]
+
+
+_REFERENCE_CACHE_SIZE = 4096
+_cached_references: dict = {}
+
+
+def formula_references_at(formula: str, col: int):
+    """col 列にある数式の参照を formula_references と同じ形で返す。
+
+    列方向にコピーした関係の数式は解析結果を共有し、相対列参照の列だけをずらす。
+    """
+    key = _column_relative_formula_key(formula, col)
+    if key is None:
+        return formula_references(formula)
+    relative_references = _cached_references.get(key)
+    if relative_references is None:
+        references = _references_with_column_flags(formula)
+        if references is None:
+            return None
+        relative_references = [
+            (sheet_name, min_row, min_col - col if min_relative else min_col, max_row,
+             max_col - col if max_relative else max_col, min_relative, max_relative)
+            for sheet_name, min_row, min_col, max_row, max_col, min_relative, max_relative in references
+        ]
+        if len(_cached_references) >= _REFERENCE_CACHE_SIZE:
+            _cached_references.clear()
+        _cached_references[key] = relative_references
+    return [
+        (sheet_name, min_row, min_col + col if min_relative else min_col, max_row,
+         max_col + col if max_relative else max_col)
+        for sheet_name, min_row, min_col, max_row, max_col, min_relative, max_relative in relative_references
+    ]
+
+
+def _references_with_column_flags(formula: str):
+    # formula_references の本体。各参照の末尾に開始列・終了列が相対参照かどうかを付ける
+    try:
+        tokens = _tokenize(formula)
+    except UnsupportedFormula:
+        return None
+
+    references = []
+    sheet_name = None
+    for index, (kind, text) in enumerate(tokens):
+        if kind == "sheet":
+            sheet_name = text[:-1]
+            if sheet_name.startswith("'"):
+                sheet_name = sheet_name[1:-1].replace("''", "'")
+            continue
+        try:
+            if kind == "ref":
+                row, col = _parse_cell(text)
+                relative = not text.startswith("$")
+                references.append((sheet_name, row, col, row, col, relative, relative))
+            elif kind == "range":
+                start, end = text.split(":")
+                start_row, start_col = _parse_cell(start)
+                end_row, end_col = _parse_cell(end)
+                start_relative = not start.startswith("$")
+                end_relative = not end.startswith("$")
+                if start_col > end_col:
+                    start_col, end_col = end_col, start_col
+                    start_relative, end_relative = end_relative, start_relative
+                references.append((
+                    sheet_name,
+                    min(start_row, end_row),
+                    start_col,
+                    max(start_row, end_row),
+                    end_col,
+                    start_relative,
+                    end_relative,
+                ))
+            elif kind == "wholerange":
+                start, end = text.replace("$", "").split(":")
+                if start.isdigit():
+                    first, last = sorted((int(start), int(end)))
+                    references.append((sheet_name, first, 1, last, _MAX_COLUMN_INDEX, False, False))
+                else:
+                    first, last = sorted((column_index_from_string(start), column_index_from_string(end)))
+                    references.append((sheet_name, 1, first, _MAX_ROW_INDEX, last, False, False))
+        except (UnsupportedFormula, ValueError):
+            return None
+        if kind == "func" and text.split(".")[-1] in _DYNAMIC_REFERENCE_FUNCTIONS:
+            indirect_sheet = _indirect_sheet_name(tokens, index, text)
+            if indirect_sheet is None:
+                return None
+            references.append((indirect_sheet, 1, 1, _MAX_ROW_INDEX, _MAX_COLUMN_INDEX, False, False))
+        elif kind == "name" and text.upper() not in ("TRUE", "FALSE"):
+            return None
+        sheet_name = None
+    return references
+
+
+# 参照先が実行時に決まる関数。INDIRECT は先頭の文字列でシート名を明示している場合だけ追跡する
+_DYNAMIC_REFERENCE_FUNCTIONS = frozenset(("INDIRECT", "OFFSET"))
+# 数値として読める文字列。float() が受け付ける inf / nan / 1_000 などは Excel では数値にならない
+_NUMERIC_TEXT_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_SHEET_PREFIX_PATTERN = re.compile(r"'((?:[^']|'')+)'!|([^'!]+)!")
+
+
+def _indirect_sheet_name(tokens, index: int, name: str) -> str | None:
+    if name != "INDIRECT" or index + 2 >= len(tokens):
+        return None
+    kind, text = tokens[index + 2]
+    if kind != "string":
+        return None
+    match = _SHEET_PREFIX_PATTERN.match(text[1:-1].replace('""', '"'))
+    if match is None:
+        return None
+    if match.group(1) is not None:
+        return match.group(1).replace("''", "'")
+    return match.group(2)
+
+
+def _to_number(value):
+    value_type = type(value)
+    if value_type is int or value_type is float or value_type is ExcelError:
+        return value
+    if value is None:
+        return 0
+    if value_type is bool:
+        return int(value)
+    text = str(value).strip()
+    if not _NUMERIC_TEXT_PATTERN.fullmatch(text):
+        return VALUE_ERROR
+    number = float(text)
+    if not math.isfinite(number):
+        return VALUE_ERROR
+    return int(number) if number.is_integer() and "." not in text and "e" not in text.lower() else number
+
+
+def to_text(value) -> str:
+    """Excel の文字列変換（`&` や LEN の引数）に合わせて値を文字列にする。"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return format(value, ".15g").upper()
+    return str(value)
+
+
+def _to_bool(value):
+    if isinstance(value, ExcelError):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    text = str(value).strip().upper()
+    if text in ("TRUE", "FALSE"):
+        return text == "TRUE"
+    return VALUE_ERROR
+
+
+def _type_rank(value) -> int:
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 1
+    return 0
+
+
+_COMPARE_OPERATORS = {
+    "=": operator.eq,
+    "<>": operator.ne,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+}
+
+
+def _compare(compare, left, right):
+    left_type = type(left)
+    right_type = type(right)
+    if left_type is ExcelError:
+        return left
+    if right_type is ExcelError:
+        return right
+    # 空セルは比較相手の型の空値（"" / FALSE / 0）として扱う
+    if left is None:
+        left = "" if right_type is str else (False if right_type is bool else 0)
+        left_type = type(left)
+    if right is None:
+        right = "" if left_type is str else (False if left_type is bool else 0)
+        right_type = type(right)
+    if left_type is str and right_type is str:
+        return compare(left.lower(), right.lower())
+    left_rank = _type_rank(left)
+    right_rank = _type_rank(right)
+    if left_rank != right_rank:
+        return compare(left_rank, right_rank)
+    return compare(left, right)
+
+
+def _is_blank(value):
+    if value is None:
+        return True
+    value_type = type(value)
+    if value_type is str:
+        return value == ""
+    if value_type is ExcelError:
+        return value
+    return False
+
+
+def _is_not_blank(value):
+    result = _is_blank(value)
+    return result if type(result) is ExcelError else not result
+
+
+def _arith(op: str, left, right):
+    left = _to_number(left)
+    if isinstance(left, ExcelError):
+        return left
+    right = _to_number(right)
+    if isinstance(right, ExcelError):
+        return right
+    if op == "+":
+        return left + right
+    if op == "-":
+        return left - right
+    if op == "*":
+        return left * right
+    if op == "/":
+        return DIV0_ERROR if right == 0 else left / right
+    # Excel では 0^負数 は #DIV/0!、0^0 と負数の非整数乗は #NUM!（Python はそれぞれ例外・1・複素数になる）
+    if left == 0 and right < 0:
+        return DIV0_ERROR
+    if (left == 0 and right == 0) or (left < 0 and not float(right).is_integer()):
+        return NUM_ERROR
+    try:
+        result = float(left) ** right
+    except OverflowError:
+        return NUM_ERROR
+    return result if math.isfinite(result) else NUM_ERROR
+
+
+def _negate(value):
+    value = _to_number(value)
+    return value if isinstance(value, ExcelError) else -value
+
+
+def _concat(left, right):
+    if isinstance(left, ExcelError):
+        return left
+    if isinstance(right, ExcelError):
+        return right
+    return to_text(left) + to_text(right)
+
+
+def _map1(func, value):
+    if isinstance(value, Array):
+        return Array([[func(item) for item in row] for row in value.rows])
+    return func(value)
+
+
+def _map2(func, left, right):
+    if isinstance(left, Array) and isinstance(right, Array):
+        if left.shape == right.shape:
+            return Array([
+                [func(left_item, right_item) for left_item, right_item in zip(left_row, right_row)]
+                for left_row, right_row in zip(left.rows, right.rows)
+            ])
+        if left.shape == (1, 1):
+            left = left.rows[0][0]
+        elif right.shape == (1, 1):
+            right = right.rows[0][0]
+        else:
+            raise UnsupportedFormula("形の異なる配列どうしの演算には対応していません。")
+    if isinstance(left, Array):
+        return Array([[func(item, right) for item in row] for row in left.rows])
+    if isinstance(right, Array):
+        return Array([[func(left, item) for item in row] for row in right.rows])
+    return func(left, right)
+
+
+def _trim(value):
+    if isinstance(value, ExcelError):
+        return value
+    return " ".join(part for part in to_text(value).split(" ") if part)
+
+
+def _length(value):
+    if isinstance(value, ExcelError):
+        return value
+    return len(to_text(value))
+
+
+def _mod(number, divisor):
+    number = _to_number(number)
+    if isinstance(number, ExcelError):
+        return number
+    divisor = _to_number(divisor)
+    if isinstance(divisor, ExcelError):
+        return divisor
+    if divisor == 0:
+        return DIV0_ERROR
+    return number - divisor * math.floor(number / divisor)
+
+
+def _logical_not(value):
+    value = _to_bool(value)
+    return value if isinstance(value, ExcelError) else not value
+
+
+def _iferror(value, fallback):
+    return fallback if isinstance(value, ExcelError) else value
+
+
+class FormulaEvaluator:
+    """構文木を評価する。セル値は resolve(row, col) から取得する。
+
+    resolved を渡すと、範囲参照の展開では関数呼び出しの前にその辞書（評価済みセル）を引く。
+    """
+
+    def __init__(self, resolve, resolved: dict | None = None):
+        self.resolve = resolve
+        self.resolved = resolved if resolved is not None else {}
+
+    def evaluate(self, node, row: int, col: int):
+        kind = node[0]
+        if kind == "const":
+            return node[1]
+        if kind == "ref":
+            return self.resolve(node[1], node[2] + col if node[3] else node[2])
+        if kind == "range":
+            _, min_row, min_col, max_row, max_col, min_relative, max_relative = node
+            if min_relative:
+                min_col += col
+            if max_relative:
+                max_col += col
+            resolve = self.resolve
+            resolved = self.resolved
+            return Array([
+                [resolved[(r, c)] if (r, c) in resolved else resolve(r, c) for c in range(min_col, max_col + 1)]
+                for r in range(min_row, max_row + 1)
+            ])
+        if kind == "neg":
+            return _map1(_negate, self.evaluate(node[1], row, col))
+        if kind == "number":
+            return _map1(_to_number, self.evaluate(node[1], row, col))
+        if kind == "pos":
+            return self.evaluate(node[1], row, col)
+        if kind == "arith":
+            left = self.evaluate(node[2], row, col)
+            right = self.evaluate(node[3], row, col)
+            return _map2(partial(_arith, node[1]), left, right)
+        if kind == "cmp":
+            left = self.evaluate(node[2], row, col)
+            right = self.evaluate(node[3], row, col)
+            return _map2(partial(_compare, _COMPARE_OPERATORS[node[1]]), left, right)
+        if kind == "blank":
+            return _map1(_is_blank if node[1] else _is_not_blank, self.evaluate(node[2], row, col))
+        if kind == "concat":
+            return _map2(_concat, self.evaluate(node[1], row, col), self.evaluate(node[2], row, col))
+        return _FUNCTIONS[node[1]](self, node[2], row, col)
+
+    def scalar(self, node, row: int, col: int):
+        value = self.evaluate(node, row, col)
+        if isinstance(value, Array):
+            if value.shape != (1, 1):
+                raise UnsupportedFormula("配列を返す数式には対応していません。")
+            return value.rows[0][0]
+        return value
+
+
+def _function_if(evaluator: FormulaEvaluator, args, row, col):
+    if len(args) not in (2, 3):
+        raise UnsupportedFormula("IF の引数の数が不正です。")
+    condition = _to_bool(evaluator.scalar(args[0], row, col))
+    if isinstance(condition, ExcelError):
+        return condition
+    if condition:
+        return evaluator.evaluate(args[1], row, col)
+    if len(args) == 3:
+        return evaluator.evaluate(args[2], row, col)
+    return False
+
+
+def _logical_values(evaluator: FormulaEvaluator, args, row, col):
+    for arg in args:
+        value = evaluator.evaluate(arg, row, col)
+        if isinstance(value, Array):
+            # 配列・範囲の中の文字列と空セルは無視される
+            for item in value.values():
+                if isinstance(item, ExcelError):
+                    yield item
+                elif isinstance(item, (bool, int, float)):
+                    yield bool(item)
+            continue
+        if value is None:
+            continue
+        yield _to_bool(value)
+
+
+def _function_or(evaluator: FormulaEvaluator, args, row, col):
+    result = None
+    for value in _logical_values(evaluator, args, row, col):
+        if isinstance(value, ExcelError):
+            return value
+        result = bool(result) or value
+    return VALUE_ERROR if result is None else result
+
+
+def _function_and(evaluator: FormulaEvaluator, args, row, col):
+    result = None
+    for value in _logical_values(evaluator, args, row, col):
+        if isinstance(value, ExcelError):
+            return value
+        result = value if result is None else (result and value)
+    return VALUE_ERROR if result is None else result
+
+
+def _function_not(evaluator: FormulaEvaluator, args, row, col):
+    if len(args) != 1:
+        raise UnsupportedFormula("NOT の引数の数が不正です。")
+    return _map1(_logical_not, evaluator.evaluate(args[0], row, col))
+
+
+def _function_iferror(evaluator: FormulaEvaluator, args, row, col):
+    if len(args) != 2:
+        raise UnsupportedFormula("IFERROR の引数の数が不正です。")
+    value = evaluator.evaluate(args[0], row, col)
+    if isinstance(value, Array):
+        return _map2(_iferror, value, evaluator.evaluate(args[1], row, col))
+    if isinstance(value, ExcelError):
+        return evaluator.evaluate(args[1], row, col)
+    return value
+
+
+def _function_len(evaluator: FormulaEvaluator, args, row, col):
+    if len(args) != 1:
+        raise UnsupportedFormula("LEN の引数の数が不正です。")
+    return _map1(_length, evaluator.evaluate(args[0], row, col))
+
+
+def _function_trim(evaluator: FormulaEvaluator, args, row, col):
+    if len(args) != 1:
+        raise UnsupportedFormula("TRIM の引数の数が不正です。")
+    return _map1(_trim, evaluator.evaluate(args[0], row, col))
+
+
+def _function_mod(evaluator: FormulaEvaluator, args, row, col):
+    if len(args) != 2:
+        raise UnsupportedFormula("MOD の引数の数が不正です。")
+    return _map2(_mod, evaluator.evaluate(args[0], row, col), evaluator.evaluate(args[1], row, col))
+
+
+def _function_row(evaluator: FormulaEvaluator, args, row, col):
+    if not args:
+        return row
+    if len(args) != 1 or args[0][0] not in ("ref", "range"):
+        raise UnsupportedFormula("ROW の引数はセル参照か範囲のみ対応しています。")
+    if args[0][0] == "ref":
+        return args[0][1]
+    min_row, max_row = args[0][1], args[0][3]
+    if min_row == max_row:
+        return min_row
+    return Array([[r] for r in range(min_row, max_row + 1)])
+
+
+def _function_sumproduct(evaluator: FormulaEvaluator, args, row, col):
+    if not args:
+        raise UnsupportedFormula("SUMPRODUCT の引数がありません。")
+    arrays = []
+    for arg in args:
+        value = evaluator.evaluate(arg, row, col)
+        arrays.append(value if isinstance(value, Array) else Array([[value]]))
+    shape = arrays[0].shape
+    if any(array.shape != shape for array in arrays):
+        return VALUE_ERROR
+    total = 0
+    for items in zip(*(array.values() for array in arrays)):
+        product = 1
+        for item in items:
+            item_type = type(item)
+            if item_type is int or item_type is float:
+                product *= item
+            elif item_type is ExcelError:
+                return item
+            else:
+                # SUMPRODUCT は数値以外（文字列・論理値・空セル）を 0 とみなす
+                product = 0
+        total += product
+    return total
+
+
+_FUNCTIONS = {
+    "IF": _function_if,
+    "OR": _function_or,
+    "AND": _function_and,
+    "NOT": _function_not,
+    "IFERROR": _function_iferror,
+    "LEN": _function_len,
+    "TRIM": _function_trim,
+    "MOD": _function_mod,
+    "ROW": _function_row,
+    "SUMPRODUCT": _function_sumproduct,
+}
@@ -1,26 +1,40 @@
-import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
 import ttkbootstrap as tb
 from ttkbootstrap.constants import INFO, SECONDARY
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
 
 from .help_dialog import open_help_window
 from .excel_ops import (
     AUTO_DATA_MAX_ITEMS,
     LOCKED_BASIC_SETTINGS,
     NOT_REQUIRED_ROW_DEFAULT,
+    MeasurementNotRequiredError,
     _derive_auto_data_start_row,
     _derive_layout_rows,
     _normalize_measure_no_key,
     _parse_int_list,
     _try_extract_int,
-    build_request_formulas,
-    write_measurement_not_required,
 )
-from .ui_helpers import LoadingDialog, pick_save_path
+from .incremental import generate_with_record
+from .phase_timing import (
+    append_timing_log,
+    collect_phase_timings,
+    format_phase_breakdown,
+    memory_profiling_enabled,
+    timing_log_path,
+)
+from .preview_reader import PREVIEW_HEADER_ROW, PREVIEW_ROW_STEP, read_sheet_preview
+from .progress import CancelToken, GenerationCancelled
+from .template_index import warm_template
+from .ui_helpers import (
+    LoadingDialog,
+    UiTaskRunner,
+    ask_retry_when_file_locked,
+    format_progress_status,
+    pick_save_path,
+)
 from .ui_theme import (
     HINT_WRAPLENGTH,
     THEME_NAME,
@@ -89,6 +103,8 @@ class ConfigEditor(tb.Window):
 
         self.selected_xlsx = tk.StringVar(value="")
         self.preview_title = tk.StringVar(value="まだ表を表示していません")
+        self.tasks = UiTaskRunner(self)
+        self._preview_loading = None
 
         self._build_ui()
 
@@ -525,136 +541,91 @@ class ConfigEditor(tb.Window):
         if not path:
             return
         self.selected_xlsx.set(path)
+        self._request_preview(path, "読み込み中...", "Excelファイルを読み込んでいます...", "読み込み失敗", warm=True)
 
-        loading = LoadingDialog(self, "読み込み中...", "Excelファイルを読み込んでいます...")
-        result = {"success": False, "error": None}
-
-        def load_task():
-            try:
-                self._render_preview_internal()
-                result["success"] = True
-            except Exception as e:
-                result["error"] = e
-
-        thread = threading.Thread(target=load_task, daemon=True)
-        thread.start()
-
-        def check_completion():
-            if thread.is_alive():
-                self.after(100, check_completion)
-                return
-            loading.close()
-            if result["error"]:
-                messagebox.showerror("読み込み失敗", str(result["error"]), parent=self)
-
-        self.after(100, check_completion)
+    def _warm_template_in_background(self, path: str):
+        """生成をすぐ始められるよう、選んだテンプレートの解析と書き戻し用のツリーの準備を先に済ませておく。"""
+        sheet_name = self.vars["sheet_name"].get().strip() or "工程内検査シート"
+        # 読めないファイルやシートは、生成したときにエラーとして表示する
+        self.tasks.submit(lambda: warm_template(path, sheet_name), on_error=lambda e: None, key="warm")
 
     def _render_preview(self):
         path = self.selected_xlsx.get().strip()
         if not path:
             messagebox.showinfo("読み込み待ち", "先にExcelファイルを選択してください。", parent=self)
             return
+        self._request_preview(path, "更新中...", "プレビューを更新しています...", "更新失敗")
 
-        loading = LoadingDialog(self, "更新中...", "プレビューを更新しています...")
-        result = {"success": False, "error": None}
-
-        def render_task():
-            try:
-                self._render_preview_internal()
-                result["success"] = True
-            except Exception as e:
-                result["error"] = e
-
-        thread = threading.Thread(target=render_task, daemon=True)
-        thread.start()
-
-        def check_completion():
-            if thread.is_alive():
-                self.after(100, check_completion)
+    def _request_preview(self, path: str, title: str, message: str, error_title: str, warm: bool = False):
+        # 読み込み中に再度依頼されたら、同じローディング表示のまま最後の依頼の結果だけを表示する
+        sheet_name = self.vars["sheet_name"].get().strip() or "工程内検査シート"
+        if self._preview_loading is None:
+            self._preview_loading = LoadingDialog(self, title, message)
+
+        def close_loading():
+            if self._preview_loading is not None:
+                self._preview_loading.close()
+                self._preview_loading = None
+
+        def on_done(preview):
+            close_loading()
+            if not preview.rows:
+                self.preview_tree.delete(*self.preview_tree.get_children())
+                messagebox.showerror(
+                    error_title,
+                    f"{PREVIEW_HEADER_ROW + 1}行目以降の先頭行(A列)が空のため表示できるデータがありません。",
+                    parent=self,
+                )
                 return
-            loading.close()
-            if result["error"]:
-                messagebox.showerror("更新失敗", str(result["error"]), parent=self)
-
-        self.after(100, check_completion)
-
-    def _render_preview_internal(self):
-        path = self.selected_xlsx.get().strip()
-        if not path:
-            return
+            self._show_preview(sheet_name, preview)
+            if warm:
+                self._warm_template_in_background(path)
+
+        def on_error(error):
+            close_loading()
+            messagebox.showerror(error_title, str(error), parent=self)
+
+        self.tasks.submit(
+            lambda: self._read_preview(path, sheet_name),
+            on_done,
+            on_error,
+            key="preview",
+        )
 
-        sheet_name = self.vars["sheet_name"].get().strip() or "工程内検査シート"
+    def _read_preview(self, path: str, sheet_name: str):
         try:
-            wb = load_workbook(path, data_only=True)
+            return read_sheet_preview(path, sheet_name, self.preview_columns)
+        except ValueError as e:
+            raise Exception(f"{e}\nシート名を確認して再度プレビューしてください。")
         except Exception as e:
             raise Exception(f"Excelを開けませんでした。\n{e}")
 
-        if sheet_name not in wb.sheetnames:
-            raise Exception(
-                f"シート「{sheet_name}」が見つかりません。\nシート名を確認して再度プレビューしてください。"
-            )
-
-        ws = wb[sheet_name]
-        preview_col_indices = [column_index_from_string(column) for column in self.preview_columns]
-
-        if not ws.max_row or not ws.max_column:
-            raise Exception("表示できるデータがありません。")
-
+    def _show_preview(self, sheet_name: str, preview):
         col_widths = {"A": 80, "B": 120, "G": 140, "K": 140}
 
-        def update_ui():
-            self.preview_tree.configure(columns=self.preview_columns)
-            for col in self.preview_columns:
-                self.preview_tree.heading(col, text=col, anchor="center")
-                self.preview_tree.column(
-                    col,
-                    width=col_widths.get(col, 120),
-                    minwidth=60,
-                    anchor="center",
-                    stretch=False,
-                )
-
-            for item in self.preview_tree.get_children():
-                self.preview_tree.delete(item)
-
-            header_row = 10
-            group_size = 3
-            max_row_value = ws.max_row or 0
-
-            if max_row_value < header_row:
-                raise Exception(f"{header_row}行目以降に表示できるデータがありません。")
-
-            header_vals = []
-            for col_idx in preview_col_indices:
-                value = ws.cell(header_row, col_idx).value
-                header_vals.append("" if value is None else str(value))
-            self.preview_tree.insert("", "end", values=header_vals)
-
-            data_start_row = header_row + 1
-            row_count = 0
-            for row_index in range(data_start_row, max_row_value + 1, group_size):
-                a_val = ws.cell(row_index, preview_col_indices[0]).value
-                if a_val is None or (isinstance(a_val, str) and not a_val.strip()):
-                    break
-
-                row_vals = []
-                for col_idx in preview_col_indices:
-                    value = ws.cell(row_index, col_idx).value
-                    row_vals.append("" if value is None else str(value))
-
-                self.preview_tree.insert("", "end", values=row_vals)
-                row_count += 1
+        self.preview_tree.configure(columns=self.preview_columns)
+        for col in self.preview_columns:
+            self.preview_tree.heading(col, text=col, anchor="center")
+            self.preview_tree.column(
+                col,
+                width=col_widths.get(col, 120),
+                minwidth=60,
+                anchor="center",
+                stretch=False,
+            )
 
-            if row_count == 0:
-                for item in self.preview_tree.get_children():
-                    self.preview_tree.delete(item)
-                raise Exception("11行目以降の先頭行(A列)が空のため表示できるデータがありません。")
+        for item in self.preview_tree.get_children():
+            self.preview_tree.delete(item)
 
-            self.preview_title.set(
-                f"{sheet_name} プレビュー（{row_count}行: 10行目ヘッダー＋11行目以降3行刻み先頭行）"
-            )
+        self.preview_tree.insert("", "end", values=preview.header)
+        for row_vals in preview.rows:
+            self.preview_tree.insert("", "end", values=row_vals)
+        row_count = len(preview.rows)
 
-        self.after(0, update_ui)
+        self.preview_title.set(
+            f"{sheet_name} プレビュー（{row_count}行: {PREVIEW_HEADER_ROW}行目ヘッダー＋"
+            f"{PREVIEW_HEADER_ROW + 1}行目以降{PREVIEW_ROW_STEP}行刻み先頭行）"
+        )
 
     def _insert_tool(self, tool_name: str, nos_text: str):
         self.tools_tree.insert("", "end", values=(tool_name, nos_text))
@@ -934,55 +905,63 @@ class ConfigEditor(tb.Window):
         if not out_path:
             return
 
-        loading = LoadingDialog(self, "生成中...", "Excelファイルを生成しています...")
-        result = {"success": False, "error": None, "saved_path": None}
+        cancel_token = CancelToken()
+        loading = LoadingDialog(self, "生成中...", "Excelファイルを生成しています...", on_cancel=cancel_token.cancel)
+        started = time.perf_counter()
+
+        target_nos = self._collect_not_required_nos()
+
+        def show_progress(progress):
+            loading.set_progress(progress.fraction, format_progress_status(progress, time.perf_counter() - started))
 
         def build_task():
-            try:
-                saved_path = build_request_formulas(xlsx, out_path, cfg, parent=self)
-                result["saved_path"] = saved_path
-
-                target_nos = self._collect_not_required_nos()
-                if target_nos:
-                    try:
-                        saved_path = write_measurement_not_required(
-                            saved_path,
-                            out_path,
-                            cfg,
-                            target_nos=target_nos,
-                            parent=self,
-                        )
-                        result["saved_path"] = saved_path
-                    except Exception as e:
-                        result["error"] = f"測定不要書き込みでエラーが発生しました:\n{e}"
-                        result["success"] = True
-                        return
-
-                result["success"] = True
-            except Exception as e:
-                result["error"] = str(e)
-
-        thread = threading.Thread(target=build_task, daemon=True)
-        thread.start()
-
-        def check_completion():
-            if thread.is_alive():
-                self.after(100, check_completion)
-                return
+            result = {"saved_path": None, "warning": None, "cancelled": False}
+            with collect_phase_timings(trace_memory=memory_profiling_enabled()) as timings:
+                try:
+                    result["saved_path"] = generate_with_record(
+                        xlsx,
+                        out_path,
+                        cfg,
+                        target_nos,
+                        on_file_locked=self.tasks.in_ui(ask_retry_when_file_locked(self)),
+                        on_progress=lambda progress: self.tasks.post(show_progress, progress),
+                        cancel_token=cancel_token,
+                    ).saved_path
+                except GenerationCancelled:
+                    result["cancelled"] = True
+                except MeasurementNotRequiredError as e:
+                    result["saved_path"] = e.saved_path
+                    result["warning"] = f"測定不要書き込みでエラーが発生しました:\n{e}"
+            elapsed = time.perf_counter() - started
+            result["breakdown"] = format_phase_breakdown(timings, elapsed)
+            if timing_log_path() and result["saved_path"]:
+                append_timing_log(timing_log_path(), timings, elapsed, source=xlsx, out=out_path)
+            return result
+
+        def on_done(result):
             loading.close()
-            if result["success"]:
-                if result["error"]:
-                    messagebox.showwarning(
-                        "警告",
-                        f"Excel生成は完了しましたが、{result['error']}",
-                        parent=self,
-                    )
-                else:
-                    messagebox.showinfo("完了", f"生成しました:\n{result['saved_path']}", parent=self)
-                return
-            messagebox.showerror("失敗", result["error"], parent=self)
+            self._warm_template_in_background(xlsx)
+            if result["cancelled"]:
+                messagebox.showinfo("取り消し", "生成を取り消しました。出力先のファイルは変更していません。", parent=self)
+            elif result["warning"]:
+                messagebox.showwarning(
+                    "警告",
+                    f"Excel生成は完了しましたが、{result['warning']}",
+                    parent=self,
+                )
+            else:
+                messagebox.showinfo(
+                    "完了",
+                    f"生成しました:\n{result['saved_path']}\n\n所要時間の内訳:\n{result['breakdown']}",
+                    parent=self,
+                )
+
+        def on_error(error):
+            loading.close()
+            self._warm_template_in_background(xlsx)
+            messagebox.showerror("失敗", str(error), parent=self)
 
-        self.after(100, check_completion)
+        self.tasks.submit(build_task, on_done, on_error)
 
     def _run_write_not_required(self):
         try:
@@ -1020,18 +999,29 @@ class ConfigEditor(tb.Window):
         if not out_path:
             return
 
-        try:
-            saved_path = write_measurement_not_required(
+        loading = LoadingDialog(self, "書き込み中...", "測定不要を書き込んでいます...")
+
+        def write_task():
+            return generate_with_record(
                 xlsx,
                 out_path,
                 cfg,
-                target_nos=target_nos,
-                parent=self,
-            )
-        except Exception as e:
-            messagebox.showerror("失敗", str(e), parent=self)
-            return
-        messagebox.showinfo("完了", f"書き込み完了:\n{saved_path}", parent=self)
+                target_nos,
+                mode="not_required",
+                on_file_locked=self.tasks.in_ui(ask_retry_when_file_locked(self)),
+            ).saved_path
+
+        def on_done(saved_path):
+            loading.close()
+            self._warm_template_in_background(xlsx)
+            messagebox.showinfo("完了", f"書き込み完了:\n{saved_path}", parent=self)
+
+        def on_error(error):
+            loading.close()
+            self._warm_template_in_background(xlsx)
+            messagebox.showerror("失敗", str(error), parent=self)
+
+        self.tasks.submit(write_task, on_done, on_error)
 
     def _show_help(self):
         open_help_window(self)
@@ -0,0 +1,263 @@
+"""前回の出力と、そのとき使った設定の記録から、変わるセルだけを書き換えて再生成する処理。
+
+生成結果はテンプレートと設定だけで決まるため、同じテンプレートのセルモデルに旧設定・新設定を
+それぞれ適用して変更内容を比べれば、前回の出力から書き換えるべきセルが分かる。
+工具の測定 No を 1 件直しただけなら、変わるのはその測定行の L〜SR だけになる。
+
+記録は出力先ごとにキャッシュフォルダへ保存し、出力ファイルのハッシュが記録と違う場合
+（Excel で編集した、別の処理で上書きしたなど）は通常の生成に戻る。
+"""
+import hashlib
+import json
+import os
+from typing import NamedTuple
+
+from openpyxl.worksheet.formula import ArrayFormula
+
+from . import __version__
+from .app_cache import cache_dir, file_digest
+from .excel_ops import (
+    FileLockedHandler,
+    MeasurementNotRequiredError,
+    _apply_measurement_not_required,
+    _apply_request_formulas,
+    _normalize_measure_column_formulas,
+    _save_generated_sheet,
+    generate_inspection_sheet,
+    write_measurement_not_required,
+)
+from .formula_eval import formula_references_at
+from .phase_timing import phase
+from .progress import CancelToken, ProgressHandler, track_progress
+from .sheet_editor import TargetSheet
+from .sheet_recalc import _ChangedCellIndex
+from .template_index import load_template_cells
+from .xlsx_package import SheetCells, read_sheet_tree
+
+
+GENERATION_RECORD_VERSION = 1
+
+
+class GenerationOutcome(NamedTuple):
+    """保存先と、差分で再生成した場合は書き換えたセル数（通常の生成なら None）。"""
+
+    saved_path: str
+    patched_cells: int | None = None
+
+
+def _record_path(out_path: str) -> str | None:
+    records_dir = cache_dir("records")
+    if records_dir is None:
+        return None
+    out_key = hashlib.sha1(os.path.normcase(os.path.abspath(out_path)).encode("utf-8")).hexdigest()
+    return os.path.join(records_dir, f"{out_key}.json")
+
+
+def _load_record(out_path: str) -> dict | None:
+    record_path = _record_path(out_path)
+    if record_path is None:
+        return None
+    try:
+        with open(record_path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(record, dict) or record.get("record_version") != GENERATION_RECORD_VERSION:
+        return None
+    return record
+
+
+def record_generation(out_path: str, source_path: str, cfg: dict, not_required_nos: list, mode: str):
+    """出力と、それを作った設定を記録する（次回の差分再生成に使う）。"""
+    record_path = _record_path(out_path)
+    if record_path is None:
+        return
+    record = {
+        "record_version": GENERATION_RECORD_VERSION,
+        "tool_version": __version__,
+        "source_hash": file_digest(source_path),
+        "output_hash": file_digest(out_path),
+        "cfg": cfg,
+        "not_required_nos": list(not_required_nos),
+        "mode": mode,
+    }
+    try:
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        temp_path = f"{record_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, default=str)
+        os.replace(temp_path, record_path)
+    except OSError as e:
+        print(f"[warn] 生成設定の記録を保存できませんでした: {e}")
+
+
+def _discard_record(out_path: str):
+    record_path = _record_path(out_path)
+    if record_path is not None and os.path.exists(record_path):
+        os.remove(record_path)
+
+
+def _planned_changes(cells: SheetCells, cfg: dict, not_required_nos: list, mode: str) -> dict:
+    """テンプレートのセルモデルに設定を適用したときの変更内容（保存はしない）。"""
+    sheet = TargetSheet(None, None, cells, cfg["sheet_name"])
+    if mode == "not_required":
+        _apply_measurement_not_required(sheet, cfg, not_required_nos)
+    else:
+        _apply_request_formulas(sheet, cfg)
+        if not_required_nos:
+            _apply_measurement_not_required(sheet, cfg, not_required_nos)
+    _normalize_measure_column_formulas(sheet, cfg)
+    return sheet.changes
+
+
+def _diff_changes(cells: SheetCells, sheet_name: str, old_changes: dict, new_changes: dict) -> dict | None:
+    """前回の出力から新しい出力へ書き換えるセルと値。差分で表せない場合は None。"""
+    template = TargetSheet(None, None, cells, sheet_name)
+    patch = {}
+    for position in old_changes.keys() | new_changes.keys():
+        old_value = old_changes[position] if position in old_changes else template.value(*position)
+        new_value = new_changes[position] if position in new_changes else template.value(*position)
+        if isinstance(old_value, ArrayFormula) or isinstance(new_value, ArrayFormula):
+            # 配列数式はキャッシュ値を計算できないため、差分に含まれる場合は通常の生成に任せる
+            return None
+        if old_value != new_value:
+            patch[position] = new_value
+    return patch
+
+
+def _stale_generated_formulas(sheet_name: str, new_changes: dict, patch: dict) -> set[tuple[int, int]]:
+    """書き換えるセルを（間接的にも）参照する生成式を集める。本文は前回と同じでもキャッシュ値が変わる。"""
+    candidate_references = {}
+    for position, value in new_changes.items():
+        if position in patch or not isinstance(value, str) or not value.startswith("="):
+            continue
+        references = formula_references_at(value[1:], position[1])
+        if references is not None:
+            references = [reference[1:] for reference in references if reference[0] in (None, sheet_name)]
+        candidate_references[position] = references
+
+    stale = set()
+    changed_positions = set(patch)
+    while changed_positions:
+        changed_index = _ChangedCellIndex(changed_positions)
+        changed_positions = set()
+        for position, references in candidate_references.items():
+            if position in stale:
+                continue
+            # 参照先を特定できない式は、念のため計算し直す
+            if references is None or any(changed_index.intersects(*reference) for reference in references):
+                changed_positions.add(position)
+        stale |= changed_positions
+    return stale
+
+
+def regenerate_incrementally(
+    xlsx_path: str,
+    out_path: str,
+    cfg: dict,
+    not_required_nos: list,
+    mode: str = "generate",
+    *,
+    on_file_locked: FileLockedHandler | None = None,
+) -> GenerationOutcome | None:
+    """出力先にある前回の出力を、変わるセルだけ書き換えて更新する。差分で更新できない場合は None。"""
+    record = _load_record(out_path)
+    if record is None or record.get("tool_version") != __version__:
+        return None
+    if not os.path.isfile(out_path) or file_digest(out_path) != record.get("output_hash"):
+        return None
+    if file_digest(xlsx_path) != record.get("source_hash"):
+        return None
+    previous_cfg = record.get("cfg")
+    if not isinstance(previous_cfg, dict) or previous_cfg.get("sheet_name") != cfg["sheet_name"]:
+        return None
+
+    with phase("template_load"):
+        cells = load_template_cells(xlsx_path, cfg["sheet_name"])
+    with phase("incremental_diff"):
+        try:
+            previous_changes = _planned_changes(
+                cells,
+                previous_cfg,
+                record.get("not_required_nos", []),
+                record.get("mode"),
+            )
+            new_changes = _planned_changes(cells, cfg, not_required_nos, mode)
+        except (ValueError, KeyError, TypeError):
+            # 設定がエラーになる場合は、通常の生成で同じエラー（または警告付きの保存）にする
+            return None
+        patch = _diff_changes(cells, cfg["sheet_name"], previous_changes, new_changes)
+        if patch is None:
+            return None
+        if not patch:
+            return GenerationOutcome(os.path.abspath(out_path), 0)
+        stale_positions = _stale_generated_formulas(cfg["sheet_name"], new_changes, patch)
+
+    with phase("previous_output_read"):
+        source_xml, root, previous_cells = read_sheet_tree(out_path, cfg["sheet_name"])
+    previous_output = TargetSheet(source_xml, root, previous_cells, cfg["sheet_name"])
+    previous_output.changes.update(patch)
+    previous_output.changes.update((position, new_changes[position]) for position in stale_positions)
+    previous_output.recalc_positions = stale_positions
+    saved_path = _save_generated_sheet(previous_output, out_path, out_path, cfg, on_file_locked=on_file_locked)
+    print(
+        f"[info] 前回の出力から変わるセルだけを書き換えました: {len(patch)}件"
+        f"（キャッシュ値の再計算 {len(stale_positions)}件）"
+    )
+    return GenerationOutcome(saved_path, len(patch))
+
+
+def generate_with_record(
+    xlsx_path: str,
+    out_path: str,
+    cfg: dict,
+    not_required_nos: list | None = None,
+    *,
+    mode: str = "generate",
+    incremental: bool = True,
+    on_file_locked: FileLockedHandler | None = None,
+    on_progress: ProgressHandler | None = None,
+    cancel_token: CancelToken | None = None,
+) -> GenerationOutcome:
+    """生成して設定を記録する。incremental が True なら、可能な場合は前回の出力からの差分で再生成する。
+
+    mode が "not_required" なら測定不要の書き込みだけを行う。
+    測定不要の書き込みだけが失敗した場合は MeasurementNotRequiredError を送出する（記録は残さない）。
+    on_progress / cancel_token は `progress.track_progress()` と同じ（取り消すと GenerationCancelled）。
+    """
+    not_required_nos = list(not_required_nos or [])
+    with track_progress(on_progress, cancel_token):
+        outcome = None
+        if incremental:
+            outcome = regenerate_incrementally(
+                xlsx_path,
+                out_path,
+                cfg,
+                not_required_nos,
+                mode,
+                on_file_locked=on_file_locked,
+            )
+        if outcome is None:
+            try:
+                if mode == "not_required":
+                    saved_path = write_measurement_not_required(
+                        xlsx_path,
+                        out_path,
+                        cfg,
+                        target_nos=not_required_nos,
+                        on_file_locked=on_file_locked,
+                    )
+                else:
+                    saved_path = generate_inspection_sheet(
+                        xlsx_path,
+                        out_path,
+                        cfg,
+                        not_required_nos=not_required_nos,
+                        on_file_locked=on_file_locked,
+                    )
+            except MeasurementNotRequiredError:
+                _discard_record(out_path)
+                raise
+            outcome = GenerationOutcome(saved_path)
+    record_generation(outcome.saved_path, xlsx_path, cfg, not_required_nos, mode)
+    return outcome
@@ -0,0 +1,184 @@
+"""GUI を使わずに生成を行うためのジョブファイル（JSON）の読み込みと実行。
+
+ジョブファイルは次のいずれかの形式で書く。相対パスはジョブファイルのあるフォルダを基準にする。
+
+- ジョブ 1 件: `{"source": ..., "out": ..., "cfg": {...}, "not_required_nos": [...]}`
+- ジョブの配列: `[{...}, {...}]`
+- 共通設定付き: `{"cfg": {...}, "not_required_nos": [...], "jobs": [{"source": ..., "out": ...}, ...]}`
+  （各ジョブに cfg / not_required_nos があればそちらを優先する）
+
+cfg は GUI の `_gather_cfg` が作る辞書と同じ内容。
+"""
+import json
+import os
+import time
+from typing import NamedTuple
+
+from .excel_ops import MeasurementNotRequiredError, _parse_int_list
+from .incremental import generate_with_record, record_generation
+from .phase_timing import PhaseTiming, collect_phase_timings, memory_profiling_enabled
+from .result_cache import restore_cached_result, result_key, store_result
+
+
+JOB_MODES = ("generate", "not_required")
+_REQUIRED_CFG_KEYS = ("sheet_name", "tools", "tool_to_measure_nos")
+
+
+class BatchJob(NamedTuple):
+    """生成 1 件分の入力。mode が "not_required" のときは測定不要の書き込みだけを行う。"""
+
+    source: str
+    out: str
+    cfg: dict
+    not_required_nos: list[int]
+    mode: str = "generate"
+    name: str = ""
+
+
+class JobResult(NamedTuple):
+    """ジョブ 1 件の実行結果。saved_path があれば出力は保存済み（warning 付きの場合を含む）。"""
+
+    job: BatchJob
+    saved_path: str | None
+    error: str = ""
+    warning: str = ""
+    elapsed: float = 0.0
+    cached: bool = False
+    patched_cells: int | None = None
+    phases: tuple[PhaseTiming, ...] = ()
+    peak_memory: int | None = None
+
+
+def _int_list(value, field: str) -> list[int]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return _parse_int_list(value)
+    if isinstance(value, list) and all(isinstance(item, int) and not isinstance(item, bool) for item in value):
+        return list(value)
+    raise ValueError(f"{field} は整数の配列、またはカンマ区切りの文字列で指定してください。")
+
+
+def _normalize_cfg(cfg) -> dict:
+    if not isinstance(cfg, dict):
+        raise ValueError("cfg がありません。GUI の設定と同じ内容の辞書を指定してください。")
+    missing = [key for key in _REQUIRED_CFG_KEYS if key not in cfg]
+    if missing:
+        raise ValueError(f"cfg に必要な項目がありません: {', '.join(missing)}")
+    normalized = dict(cfg)
+    normalized["tools"] = [str(tool) for tool in cfg["tools"]]
+    if not normalized["tools"]:
+        raise ValueError("工具が1件もありません。")
+    tool_to_measure_nos = cfg["tool_to_measure_nos"]
+    if not isinstance(tool_to_measure_nos, dict):
+        raise ValueError("tool_to_measure_nos は工具名をキーにした辞書で指定してください。")
+    normalized["tool_to_measure_nos"] = {
+        str(tool): _int_list(nos, f"tool_to_measure_nos[{tool}]") for tool, nos in tool_to_measure_nos.items()
+    }
+    return normalized
+
+
+def _resolve_path(path, base_dir: str, field: str) -> str:
+    if not isinstance(path, str) or not path.strip():
+        raise ValueError(f"{field} にファイルのパスを指定してください。")
+    return os.path.normpath(os.path.join(base_dir, os.path.expanduser(path.strip())))
+
+
+def _build_job(entry, defaults: dict, base_dir: str, label: str) -> BatchJob:
+    if not isinstance(entry, dict):
+        raise ValueError(f"{label}: ジョブは辞書で指定してください。")
+    mode = entry.get("mode", defaults.get("mode", "generate"))
+    if mode not in JOB_MODES:
+        raise ValueError(f"{label}: mode は {' / '.join(JOB_MODES)} のいずれかを指定してください。")
+    not_required_nos = _int_list(
+        entry.get("not_required_nos", defaults.get("not_required_nos")),
+        "not_required_nos",
+    )
+    if mode == "not_required" and not not_required_nos:
+        raise ValueError(f"{label}: 測定不要の書き込みには not_required_nos を1件以上指定してください。")
+    try:
+        cfg = _normalize_cfg(entry.get("cfg", defaults.get("cfg")))
+    except ValueError as e:
+        raise ValueError(f"{label}: {e}") from e
+    return BatchJob(
+        source=_resolve_path(entry.get("source"), base_dir, f"{label}: source"),
+        out=_resolve_path(entry.get("out"), base_dir, f"{label}: out"),
+        cfg=cfg,
+        not_required_nos=not_required_nos,
+        mode=mode,
+        name=str(entry.get("name") or label),
+    )
+
+
+def load_job_file(path: str) -> list[BatchJob]:
+    """ジョブファイルを読み込み、パスを解決したジョブの一覧を返す。"""
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"ジョブファイルの JSON が不正です: {path}（{e.lineno}行目）") from e
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    file_label = os.path.basename(path)
+    if isinstance(data, list):
+        defaults, entries = {}, data
+    elif isinstance(data, dict) and "jobs" in data:
+        defaults, entries = data, data["jobs"]
+        if not isinstance(entries, list):
+            raise ValueError(f"{file_label}: jobs はジョブの配列で指定してください。")
+    elif isinstance(data, dict):
+        defaults, entries = {}, [data]
+    else:
+        raise ValueError(f"{file_label}: ジョブファイルの形式が不正です。")
+    if not entries:
+        raise ValueError(f"{file_label}: ジョブが1件もありません。")
+    return [
+        _build_job(entry, defaults, base_dir, f"{file_label}#{index}")
+        for index, entry in enumerate(entries, start=1)
+    ]
+
+
+def run_job(job: BatchJob, use_cache: bool = True, incremental: bool = True) -> JobResult:
+    """ジョブを 1 件実行する。例外は結果に変換し、呼び出し側へは送出しない。
+
+    use_cache が True なら、入力が同じ過去の生成結果があれば生成せずに複写する。
+    incremental が True なら、出力先にある前回の出力を変わるセルだけ書き換えて更新できる場合はそうする。
+    結果には所要時間と工程ごとの内訳（phases）を付ける。メモリ計測が有効なら全体のピーク（peak_memory）も付ける。
+    """
+    started = time.perf_counter()
+    with collect_phase_timings(trace_memory=memory_profiling_enabled()) as timings:
+        result = _execute_job(job, use_cache, incremental)
+    return result._replace(
+        elapsed=time.perf_counter() - started,
+        phases=tuple(timings),
+        peak_memory=timings.peak_memory,
+    )
+
+
+def _execute_job(job: BatchJob, use_cache: bool, incremental: bool) -> JobResult:
+    try:
+        out_dir = os.path.dirname(job.out)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        cache_key = result_key(job.source, job.cfg, job.not_required_nos, job.mode) if use_cache else None
+        if cache_key is not None:
+            saved_path = restore_cached_result(cache_key, job.out)
+            if saved_path is not None:
+                record_generation(saved_path, job.source, job.cfg, job.not_required_nos, job.mode)
+                return JobResult(job, saved_path, cached=True)
+        outcome = generate_with_record(
+            job.source,
+            job.out,
+            job.cfg,
+            job.not_required_nos,
+            mode=job.mode,
+            incremental=incremental,
+        )
+    except MeasurementNotRequiredError as e:
+        # 測定不要の書き込みに失敗した出力は指定どおりの結果ではないため、キャッシュしない
+        return JobResult(job, e.saved_path, warning=f"測定不要書き込みでエラーが発生しました: {e}")
+    except Exception as e:
+        return JobResult(job, None, error=str(e) or type(e).__name__)
+    if cache_key is not None:
+        store_result(cache_key, outcome.saved_path)
+    return JobResult(job, outcome.saved_path, patched_cells=outcome.patched_cells)
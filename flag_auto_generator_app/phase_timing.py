@@ -0,0 +1,236 @@
+"""生成処理の工程ごとの所要時間の計測と記録。
+
+`collect_phase_timings()` で囲んだ範囲でだけ計測し、それ以外では `phase()` は何もしない。
+工程の中で別の工程が呼ばれた場合は外側だけを記録する（差分再生成で依頼式の組み立てを
+内部で使う場合などに二重に数えない）。記録は JSON Lines（1 行 1 工程）で追記できる。
+
+メモリ計測（`collect_phase_timings(trace_memory=True)`）では tracemalloc を動かし、工程ごとに
+終了時点で増えた量と工程中のピーク、全体のピークを記録する。tracemalloc で処理が数倍遅くなるため、
+環境変数 FLAG_AUTO_GENERATOR_PROFILE_MEMORY か CLI の --profile-memory を指定したときだけ使う。
+"""
+import contextvars
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import NamedTuple
+
+from .progress import _active_tracker
+
+
+TIMING_LOG_ENV = "FLAG_AUTO_GENERATOR_TIMING_LOG"
+PROFILE_MEMORY_ENV = "FLAG_AUTO_GENERATOR_PROFILE_MEMORY"
+
+PHASE_LABELS = {
+    "template_load": "テンプレート読み込み",
+    "previous_output_read": "前回の出力の読み込み",
+    "incremental_diff": "差分の計算",
+    "measure_scan": "測定Noの読み取り",
+    "tool_rows": "工具行の書き込み",
+    "summary_formulas": "先頭集計式",
+    "formula_grid": "依頼式（L〜SR）",
+    "not_required": "測定不要の上書き",
+    "normalize_array_formulas": "B列配列数式の変換",
+    "calc_chain": "calcChain の作り直し",
+    "evaluate": "キャッシュ値の計算",
+    "merge": "シート XML への差し込み",
+    "zip_write": "ZIP の書き出し",
+    "excel_recalc": "Excel 強制再計算",
+}
+
+
+class PhaseTiming(NamedTuple):
+    """工程 1 件の記録。allocated / peak（バイト）はメモリ計測時だけ入る。"""
+
+    name: str
+    seconds: float
+    allocated: int | None = None
+    peak: int | None = None
+
+
+class PhaseTimings(list):
+    """`collect_phase_timings()` が返す記録の一覧。peak_memory はメモリ計測時の全体のピーク（バイト）。"""
+
+    peak_memory: int | None = None
+
+
+class _PhaseCollector:
+    def __init__(self, trace_memory: bool):
+        self.timings = PhaseTimings()
+        self.depth = 0
+        self.trace_memory = trace_memory
+        self.peak_memory = 0
+
+    def start_memory_phase(self) -> int:
+        # 工程ごとのピークを取るため、それまでのピークを全体のピークへ移してから測り直す
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_memory = max(self.peak_memory, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def finish_memory_phase(self) -> tuple[int, int]:
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_memory = max(self.peak_memory, peak)
+        return current, peak
+
+
+_active_collector = contextvars.ContextVar("phase_collector", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """工程の所要時間を計測する。`with phase("merge"):` のほか、関数のデコレータとしても使える。
+
+    `progress.track_progress()` の範囲では、工程の始まりと終わりを進み具合として通知する。
+    """
+    collector = _active_collector.get()
+    tracker = _active_tracker.get()
+    if collector is None and tracker is None:
+        yield
+        return
+    if tracker is not None:
+        tracker.enter_phase(name)
+    succeeded = False
+    try:
+        with _timed_phase(collector, name):
+            yield
+        succeeded = True
+    finally:
+        if tracker is not None:
+            tracker.leave_phase(name, succeeded)
+
+
+@contextmanager
+def _timed_phase(collector: _PhaseCollector | None, name: str):
+    if collector is None:
+        yield
+        return
+    collector.depth += 1
+    trace_memory = collector.depth == 1 and collector.trace_memory and tracemalloc.is_tracing()
+    memory_before = collector.start_memory_phase() if trace_memory else 0
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.depth -= 1
+        if collector.depth == 0:
+            seconds = time.perf_counter() - started
+            if trace_memory:
+                current, peak = collector.finish_memory_phase()
+                collector.timings.append(PhaseTiming(name, seconds, current - memory_before, peak))
+            else:
+                collector.timings.append(PhaseTiming(name, seconds))
+
+
+def memory_profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_MEMORY_ENV, "").strip() not in ("", "0")
+
+
+@contextmanager
+def collect_phase_timings(trace_memory: bool = False):
+    """囲んだ範囲の工程の所要時間を、終了順に並べたリスト（PhaseTimings）として集める。
+
+    trace_memory が True なら tracemalloc でメモリも計測する（既に動いていればそれを使い、止めない）。
+    """
+    collector = _PhaseCollector(trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif trace_memory:
+        tracemalloc.reset_peak()
+    token = _active_collector.set(collector)
+    try:
+        yield collector.timings
+    finally:
+        _active_collector.reset(token)
+        if trace_memory:
+            collector.finish_memory_phase()
+            collector.timings.peak_memory = collector.peak_memory
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def phase_label(name: str) -> str:
+    return PHASE_LABELS.get(name, name)
+
+
+def format_memory(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f}MB"
+
+
+def format_phase_breakdown(
+    timings: list[PhaseTiming],
+    total: float | None = None,
+    *,
+    peak_memory: int | None = None,
+) -> str:
+    """完了ダイアログなどに出す内訳（1 行 1 工程、0.01 秒未満の工程は省く）。
+
+    メモリ計測時は工程ごとのピークと増加量、最後に全体のピークを添える。
+    peak_memory を省くと timings（PhaseTimings）の値を使う。
+    """
+    if peak_memory is None:
+        peak_memory = getattr(timings, "peak_memory", None)
+    lines = []
+    for timing in timings:
+        if timing.seconds < 0.01:
+            continue
+        line = f"{phase_label(timing.name)}: {timing.seconds:.2f}秒"
+        if timing.peak is not None:
+            line += f"（ピーク {format_memory(timing.peak)}・増加 {format_memory(timing.allocated)}）"
+        lines.append(line)
+    if total is not None:
+        lines.append(f"合計: {total:.2f}秒")
+    if peak_memory is not None:
+        lines.append(f"最大メモリ: {format_memory(peak_memory)}")
+    return "\n".join(lines)
+
+
+def _timing_record(timing: PhaseTiming) -> dict:
+    record = {"phase": timing.name, "seconds": round(timing.seconds, 4)}
+    if timing.peak is not None:
+        record["allocated_bytes"] = timing.allocated
+        record["peak_bytes"] = timing.peak
+    return record
+
+
+def timing_log_path() -> str | None:
+    return os.environ.get(TIMING_LOG_ENV, "").strip() or None
+
+
+def append_timing_log(
+    log_path: str,
+    timings: list[PhaseTiming],
+    total: float,
+    *,
+    peak_memory: int | None = None,
+    **fields,
+):
+    """工程ごとの記録を JSON Lines で追記する（log_path が "-" なら標準出力）。fields（出力先など）は各行に同じ値を入れる。
+
+    メモリ計測時は各行に allocated_bytes / peak_bytes を、total の行に全体の peak_bytes を入れる。
+    記録は調査用のため、書き込みの失敗は警告だけにする。
+    """
+    if peak_memory is None:
+        peak_memory = getattr(timings, "peak_memory", None)
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    records = [{"timestamp": timestamp, **fields, **_timing_record(timing)} for timing in timings]
+    total_record = {"timestamp": timestamp, **fields, "phase": "total", "seconds": round(total, 4)}
+    if peak_memory is not None:
+        total_record["peak_bytes"] = peak_memory
+    records.append(total_record)
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    if log_path == "-":
+        sys.stdout.write(lines)
+        sys.stdout.flush()
+        return
+    try:
+        log_dir = os.path.dirname(os.path.abspath(log_path))
+        os.makedirs(log_dir, exist_ok=True)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+    except OSError as e:
+        print(f"[warn] 所要時間の記録を書き込めませんでした: {log_path}: {e}")
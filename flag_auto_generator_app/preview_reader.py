@@ -0,0 +1,94 @@
+"""Step 1 のプレビュー表に出すセルだけを、対象シートの XML から順に読み出す処理。
+
+ブック全体は読み込まず、10 行目の見出しと 11 行目から 3 行おきの行の指定列だけを取り出し、
+先頭の列（A 列）が空の行で読むのをやめる。読み取り結果は (パス, 更新時刻, サイズ, シート名, 列) ごとに覚え、
+同じファイルの「表を再表示」ではファイルを開かない。
+"""
+import os
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import NamedTuple
+
+from openpyxl.utils import column_index_from_string
+
+from .xlsx_package import _ROW_TAG, _collect_row_cells, _read_shared_strings, _worksheet_path_in_zip
+
+
+PREVIEW_HEADER_ROW = 10
+PREVIEW_ROW_STEP = 3
+_PREVIEW_CACHE_SIZE = 8
+
+
+class SheetPreview(NamedTuple):
+    """プレビューの見出し（10 行目）とデータ行。値は表示用の文字列。"""
+
+    header: list[str]
+    rows: list[list[str]]
+
+
+_preview_cache: dict[tuple, SheetPreview] = {}
+_preview_cache_lock = threading.Lock()
+
+
+def _is_blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _row_values(row_elem, row: int, shared_strings: list[str], col_indices: list[int]) -> list:
+    cells = {}
+    _collect_row_cells(row_elem, row, shared_strings, cells, {}, [])
+    values = []
+    for col in col_indices:
+        cell = cells.get((row, col))
+        values.append(None if cell is None else cell.value)
+    return values
+
+
+def _display_values(values: list) -> list[str]:
+    return ["" if value is None else str(value) for value in values]
+
+
+def _read_preview(xlsx_path: str, sheet_name: str, col_indices: list[int]) -> SheetPreview:
+    header = [""] * len(col_indices)
+    rows = []
+    next_data_row = PREVIEW_HEADER_ROW + 1
+    current_row = 0
+    with zipfile.ZipFile(xlsx_path, "r") as workbook_zip:
+        sheet_path = _worksheet_path_in_zip(workbook_zip, sheet_name)
+        shared_strings = _read_shared_strings(workbook_zip)
+        with workbook_zip.open(sheet_path) as sheet_stream:
+            for _, elem in ET.iterparse(sheet_stream, events=("end",)):
+                if elem.tag != _ROW_TAG:
+                    continue
+                current_row = int(elem.attrib.get("r", current_row + 1))
+                if current_row > next_data_row:
+                    # 行要素が無い行は A 列も空なので、そこで終わり
+                    break
+                if current_row == PREVIEW_HEADER_ROW:
+                    header = _display_values(_row_values(elem, current_row, shared_strings, col_indices))
+                elif current_row == next_data_row:
+                    values = _row_values(elem, current_row, shared_strings, col_indices)
+                    if _is_blank(values[0]):
+                        break
+                    rows.append(_display_values(values))
+                    next_data_row += PREVIEW_ROW_STEP
+                elem.clear()
+    return SheetPreview(header, rows)
+
+
+def read_sheet_preview(xlsx_path: str, sheet_name: str, columns: tuple[str, ...]) -> SheetPreview:
+    """プレビュー用の見出しとデータ行を返す。ファイルの更新時刻とサイズが同じなら前回の読み取り結果を使う。"""
+    stat = os.stat(xlsx_path)
+    key = (os.path.abspath(xlsx_path), stat.st_mtime_ns, stat.st_size, sheet_name, tuple(columns))
+    with _preview_cache_lock:
+        cached = _preview_cache.get(key)
+    if cached is not None:
+        return cached
+
+    preview = _read_preview(xlsx_path, sheet_name, [column_index_from_string(column) for column in columns])
+    with _preview_cache_lock:
+        _preview_cache[key] = preview
+        while len(_preview_cache) > _PREVIEW_CACHE_SIZE:
+            del _preview_cache[next(iter(_preview_cache))]
+    return preview
@@ -0,0 +1,171 @@
+"""生成の進み具合の通知と取り消し。
+
+`track_progress()` で囲んだ範囲では、`phase()` の工程の始まりと終わり、工程の中の `report_progress()` で
+進み具合（0〜1）を通知し、そのたびに取り消されていないかを確かめる。進み具合は実テンプレートでの
+工程ごとの所要時間の比から見積もる（実行されなかった工程の分はまとめて進む）。
+"""
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Callable, NamedTuple
+
+
+# 実テンプレートでの工程ごとの所要時間（秒）。進み具合の重みに使う
+PHASE_WEIGHTS = {
+    "template_load": 0.5,
+    "incremental_diff": 0.05,
+    "previous_output_read": 0.8,
+    "measure_scan": 0.01,
+    "tool_rows": 0.01,
+    "summary_formulas": 0.01,
+    "formula_grid": 0.05,
+    "not_required": 0.01,
+    "normalize_array_formulas": 0.01,
+    "calc_chain": 0.15,
+    "evaluate": 1.0,
+    "merge": 1.0,
+    "zip_write": 0.1,
+    "excel_recalc": 0.01,
+}
+# 通常の生成と差分再生成の工程の順序。最初は通常の生成とみなし、差分再生成の工程が始まったら切り替える
+_PHASE_PLANS = (
+    (
+        "template_load",
+        "measure_scan",
+        "tool_rows",
+        "summary_formulas",
+        "formula_grid",
+        "not_required",
+        "normalize_array_formulas",
+        "calc_chain",
+        "evaluate",
+        "merge",
+        "zip_write",
+        "excel_recalc",
+    ),
+    (
+        "template_load",
+        "incremental_diff",
+        "previous_output_read",
+        "normalize_array_formulas",
+        "calc_chain",
+        "evaluate",
+        "merge",
+        "zip_write",
+        "excel_recalc",
+    ),
+)
+# 出力ファイルの書き出しを始めたら取り消さない（保存した後に止めると、出力と生成の記録が食い違う）
+_COMMIT_PHASE = "zip_write"
+
+
+class GenerationCancelled(Exception):
+    """取り消しトークンで生成が取り消されたときに送出する。"""
+
+
+class CancelToken:
+    """別のスレッドから生成の取り消しを伝える。"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class Progress(NamedTuple):
+    """進み具合。done / total は工程の中の処理件数（依頼式の列数など）が分かる場合だけ入る。"""
+
+    fraction: float
+    phase: str
+    done: int | None = None
+    total: int | None = None
+
+
+ProgressHandler = Callable[[Progress], None]
+
+
+class _ProgressTracker:
+    def __init__(self, on_progress: ProgressHandler | None, cancel_token: CancelToken | None):
+        self.on_progress = on_progress
+        self.cancel_token = cancel_token
+        self.plan = _PHASE_PLANS[0]
+        self.depth = 0
+        self.current = None
+        self.fraction = 0.0
+        self.committed = False
+
+    def _check_cancelled(self):
+        if self.cancel_token is not None and self.cancel_token.cancelled and not self.committed:
+            raise GenerationCancelled("生成を取り消しました。")
+
+    def _span(self, name: str) -> tuple[float, float]:
+        # 工程の始まりと終わりの位置（0〜1）。順序に無い工程は今の位置のまま
+        if name not in self.plan:
+            for plan in _PHASE_PLANS:
+                if name in plan:
+                    self.plan = plan
+                    break
+            else:
+                return self.fraction, self.fraction
+        total = sum(PHASE_WEIGHTS[phase_name] for phase_name in self.plan)
+        before = sum(PHASE_WEIGHTS[phase_name] for phase_name in self.plan[:self.plan.index(name)])
+        return before / total, (before + PHASE_WEIGHTS[name]) / total
+
+    def _notify(self, fraction: float, name: str, done: int | None = None, total: int | None = None):
+        # 差分再生成から通常の生成へ戻った場合なども、表示が後戻りしないようにする
+        self.fraction = max(self.fraction, min(fraction, 1.0))
+        if self.on_progress is not None:
+            self.on_progress(Progress(self.fraction, name, done, total))
+
+    def enter_phase(self, name: str):
+        if self.depth == 0:
+            self._check_cancelled()
+            if name == _COMMIT_PHASE:
+                self.committed = True
+            self.current = name
+            self._notify(self._span(name)[0], name)
+        self.depth += 1
+
+    def leave_phase(self, name: str, succeeded: bool):
+        self.depth -= 1
+        if self.depth == 0 and succeeded:
+            self._notify(self._span(name)[1], name)
+
+    def report(self, done: int, total: int):
+        if self.current is None or self.depth != 1 or total <= 0:
+            return
+        self._check_cancelled()
+        start, end = self._span(self.current)
+        self._notify(start + (end - start) * done / total, self.current, done, total)
+
+
+_active_tracker = contextvars.ContextVar("progress_tracker", default=None)
+
+
+@contextmanager
+def track_progress(on_progress: ProgressHandler | None = None, cancel_token: CancelToken | None = None):
+    """囲んだ範囲の生成の進み具合を on_progress へ通知し、cancel_token が取り消されたら GenerationCancelled を送出する。
+
+    どちらも None なら何もしない（外側で始めた通知をそのまま使う）。
+    on_progress は生成を実行しているスレッドから呼ばれる。
+    """
+    if on_progress is None and cancel_token is None:
+        yield
+        return
+    token = _active_tracker.set(_ProgressTracker(on_progress, cancel_token))
+    try:
+        yield
+    finally:
+        _active_tracker.reset(token)
+
+
+def report_progress(done: int, total: int):
+    """工程の中の処理件数を通知する（取り消されていれば GenerationCancelled を送出する）。"""
+    tracker = _active_tracker.get()
+    if tracker is not None:
+        tracker.report(done, total)
@@ -0,0 +1,94 @@
+"""入力が同じジョブの生成結果を再利用するためのキャッシュ。
+
+キーは元ブックの内容・cfg・測定不要 No・処理の種類・ツールのバージョンから作る SHA-256 で、
+生成した xlsx をそのままキャッシュフォルダへ保存する。合計サイズが上限を超えたら使っていないものから削除する。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from . import __version__
+from .app_cache import cache_dir, file_digest, prune_cache
+from .excel_ops import FORCE_EXCEL_RECALC_ENV, FileLockedHandler, _replace_file_atomic
+
+
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def _normalized_cfg_text(cfg: dict) -> str:
+    # 最上位のキーだけ並べ替える。tools や tool_to_measure_nos の並び順は生成される式の順序に影響するため保つ
+    ordered_cfg = {key: cfg[key] for key in sorted(cfg)}
+    return json.dumps(ordered_cfg, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def result_key(source_path: str, cfg: dict, not_required_nos: list, mode: str) -> str:
+    digest = hashlib.sha256()
+    for part in (
+        __version__,
+        file_digest(source_path),
+        _normalized_cfg_text(cfg),
+        json.dumps(list(not_required_nos)),
+        mode,
+        # Excel COM で再計算した出力は内容が変わるため別のキーにする
+        "excel-recalc" if os.environ.get(FORCE_EXCEL_RECALC_ENV, "").strip() == "1" else "",
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _cached_path(key: str) -> str | None:
+    results_dir = cache_dir("results")
+    if results_dir is None:
+        return None
+    return os.path.join(results_dir, f"{key}.xlsx")
+
+
+def restore_cached_result(
+    key: str,
+    out_path: str,
+    *,
+    on_file_locked: FileLockedHandler | None = None,
+) -> str | None:
+    """キャッシュにあれば出力先へ複写して保存先を返す。無ければ None。"""
+    cached_path = _cached_path(key)
+    if cached_path is None or not os.path.isfile(cached_path):
+        return None
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".xlsx", dir=out_dir)
+    os.close(fd)
+    try:
+        shutil.copyfile(cached_path, temp_path)
+        saved_path = _replace_file_atomic(temp_path, out_path, on_file_locked=on_file_locked)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    try:
+        os.utime(cached_path)
+    except OSError:
+        pass
+    return saved_path
+
+
+def store_result(key: str, saved_path: str):
+    """生成した出力をキャッシュへ保存する。失敗しても生成結果には影響させない。"""
+    cached_path = _cached_path(key)
+    if cached_path is None:
+        return
+    temp_path = None
+    try:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".xlsx", dir=os.path.dirname(cached_path))
+        os.close(fd)
+        shutil.copyfile(saved_path, temp_path)
+        os.replace(temp_path, cached_path)
+        temp_path = None
+    except OSError as e:
+        print(f"[warn] 生成結果をキャッシュへ保存できませんでした: {e}")
+    finally:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+    prune_cache(os.path.dirname(cached_path), RESULT_CACHE_MAX_BYTES)
@@ -0,0 +1,371 @@
+"""対象シートの XML を直接編集し、変更セルだけを元の sheet XML へ書き戻す処理。"""
+import xml.etree.ElementTree as ET
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.worksheet.formula import ArrayFormula
+
+from .formula_eval import ExcelError, _column_relative_formula_key
+from .phase_timing import phase
+from .xlsx_package import (
+    MAIN_NS,
+    NS,
+    SheetCells,
+    _restore_root_namespace_declarations,
+    _serialize_xml,
+)
+
+
+_CELL_TAG = f"{{{MAIN_NS}}}c"
+_ROW_TAG = f"{{{MAIN_NS}}}row"
+_FORMULA_TAG = f"{{{MAIN_NS}}}f"
+_VALUE_TAG = f"{{{MAIN_NS}}}v"
+_INLINE_STRING_TAG = f"{{{MAIN_NS}}}is"
+_TEXT_TAG = f"{{{MAIN_NS}}}t"
+_XML_SPACE_ATTR = "{http://www.w3.org/XML/1998/namespace}space"
+
+
+class TargetSheet:
+    """対象シート 1 枚分の XML ツリーと、数式・キャッシュ値の二面ビュー、未保存の変更を保持する。"""
+
+    def __init__(self, source_xml: bytes, root, cells: SheetCells, sheet_name: str | None = None):
+        self.source_xml = source_xml
+        self.root = root
+        self.cells = cells
+        self.sheet_name = sheet_name
+        self.changes: dict[tuple[int, int], object] = {}
+        # 数式の本文は元と同じでも、参照先が変わるためキャッシュ値を計算し直す変更セル
+        self.recalc_positions: set[tuple[int, int]] = set()
+
+    @property
+    def sheet_path(self) -> str:
+        return self.cells.sheet_path
+
+    @property
+    def max_row(self) -> int:
+        return self.cells.max_row
+
+    @property
+    def merged_ranges(self) -> list[tuple[int, int, int, int]]:
+        return self.cells.merged_ranges
+
+    def value(self, row: int, col: int):
+        """openpyxl の通常読み込みと同じく、数式セルは数式文字列（配列数式は ArrayFormula）を返す。"""
+        position = (row, col)
+        if position in self.changes:
+            return self.changes[position]
+        cell = self.cells.get(row, col)
+        if cell is None:
+            return None
+        if cell.formula is None:
+            return cell.value
+        if cell.formula_type == "array":
+            return ArrayFormula(cell.formula_ref or _cell_ref(row, col), cell.formula)
+        return cell.formula
+
+    def cached_value(self, row: int, col: int):
+        return self.cells.value(row, col)
+
+    def set_value(self, row: int, col: int, value):
+        self.changes[(row, col)] = value
+
+
+def _cell_ref(row: int, col: int) -> str:
+    return f"{get_column_letter(col)}{row}"
+
+
+def _column_index(cell_ref: str) -> int:
+    return column_index_from_string(cell_ref.rstrip("0123456789"))
+
+
+def _column_style_ids(root) -> list[tuple[int, int, str]]:
+    column_styles = []
+    for col_elem in root.findall("main:cols/main:col", NS):
+        style_id = col_elem.attrib.get("style")
+        if style_id is None:
+            continue
+        column_styles.append((int(col_elem.attrib["min"]), int(col_elem.attrib["max"]), style_id))
+    return column_styles
+
+
+def _default_style_id(row_elem, col: int, column_styles) -> str | None:
+    # 空セルへ入力したときの Excel と同じく、行書式 → 列書式の順に引き継ぐ
+    if row_elem.attrib.get("customFormat") in ("1", "true") and "s" in row_elem.attrib:
+        return row_elem.attrib["s"]
+    for col_min, col_max, style_id in column_styles:
+        if col_min <= col <= col_max:
+            return style_id
+    return None
+
+
+def _plan_row_shared_formulas(row_index: int, row_changes, next_index: int):
+    """行内で列が連続し、列方向コピーの関係にある数式の並びを共有数式にまとめる。
+
+    戻り値は (列→(si, 親セルなら ref / 従属セルなら None), 次の si)。
+    """
+    shared_specs = {}
+    run_start = 0
+    run_key = None
+    change_count = len(row_changes)
+
+    def close_run(run_end: int):
+        nonlocal next_index
+        if run_end - run_start < 2:
+            return
+        first_col = row_changes[run_start][0]
+        last_col = row_changes[run_end - 1][0]
+        shared_ref = f"{get_column_letter(first_col)}{row_index}:{get_column_letter(last_col)}{row_index}"
+        shared_index = str(next_index)
+        next_index += 1
+        shared_specs[first_col] = (shared_index, shared_ref)
+        for col, _ in row_changes[run_start + 1:run_end]:
+            shared_specs[col] = (shared_index, None)
+
+    for pos in range(change_count):
+        col, value = row_changes[pos]
+        key = None
+        if isinstance(value, str) and value.startswith("=") and len(value) > 1:
+            key = _column_relative_formula_key(value[1:], col)
+        continuous = pos > 0 and row_changes[pos - 1][0] == col - 1
+        if key is None or not continuous or key != run_key:
+            close_run(pos)
+            run_start = pos
+            run_key = key
+    close_run(change_count)
+    return shared_specs, next_index
+
+
+def _append_cached_value(cell, cached_value):
+    """数式セルへ計算済みの値を `<v>` として付ける。"""
+    if cached_value is None:
+        return
+    if isinstance(cached_value, ExcelError):
+        cell.set("t", "e")
+        text = cached_value.code
+    elif isinstance(cached_value, bool):
+        cell.set("t", "b")
+        text = "1" if cached_value else "0"
+    elif isinstance(cached_value, float):
+        text = str(int(cached_value)) if cached_value.is_integer() else repr(cached_value)
+    elif isinstance(cached_value, int):
+        text = str(cached_value)
+    else:
+        cell.set("t", "str")
+        text = str(cached_value)
+    ET.SubElement(cell, _VALUE_TAG).text = text
+
+
+def _build_cell_element(
+    cell_ref: str,
+    value,
+    style_id: str | None,
+    shared_spec=None,
+    cached_value=None,
+):
+    """変更セル 1 つ分の `<c>` を作る。
+
+    値は None / "" （空セル）・文字列・`=` で始まる数式・ArrayFormula・bool・数値のいずれか。
+    shared_spec は `_plan_row_shared_formulas()` の (si, 親セルなら ref / 従属セルなら None)。
+    """
+    attrib = {"r": cell_ref}
+    if style_id is not None:
+        attrib["s"] = style_id
+    cell = ET.Element(_CELL_TAG, attrib)
+
+    if value is None or value == "":
+        return cell
+    if isinstance(value, ArrayFormula):
+        formula_elem = ET.SubElement(cell, _FORMULA_TAG, {"t": "array", "ref": value.ref or cell_ref})
+        formula_elem.text = str(value.text or "").lstrip("=")
+        _append_cached_value(cell, cached_value)
+        return cell
+    if isinstance(value, str) and value.startswith("="):
+        if shared_spec is None:
+            ET.SubElement(cell, _FORMULA_TAG).text = value[1:]
+        else:
+            shared_index, shared_ref = shared_spec
+            formula_elem = ET.SubElement(cell, _FORMULA_TAG, {"t": "shared"})
+            if shared_ref is not None:
+                formula_elem.set("ref", shared_ref)
+                formula_elem.set("si", shared_index)
+                formula_elem.text = value[1:]
+            else:
+                formula_elem.set("si", shared_index)
+        _append_cached_value(cell, cached_value)
+        return cell
+    if isinstance(value, bool):
+        cell.set("t", "b")
+        ET.SubElement(cell, _VALUE_TAG).text = "1" if value else "0"
+        return cell
+    if isinstance(value, (int, float)):
+        ET.SubElement(cell, _VALUE_TAG).text = repr(value)
+        return cell
+    if not isinstance(value, str):
+        # 日付などを文字列として黙って書き込まないよう、扱わない型はエラーにする
+        raise TypeError(f"{cell_ref} に書き込めない値です（{type(value).__name__}）: {value!r}")
+
+    text = value
+    cell.set("t", "inlineStr")
+    inline_elem = ET.SubElement(cell, _INLINE_STRING_TAG)
+    text_elem = ET.SubElement(inline_elem, _TEXT_TAG)
+    text_elem.text = text
+    if text != text.strip():
+        text_elem.set(_XML_SPACE_ATTR, "preserve")
+    return cell
+
+
+def _index_rows(sheet_data) -> dict[int, object]:
+    return {int(row.attrib.get("r", "0")): row for row in sheet_data.findall("main:row", NS)}
+
+
+def _merge_row_cells(
+    row_elem,
+    row_changes: list[tuple[int, object]],
+    column_styles,
+    shared_specs,
+    row_cached_values,
+):
+    """列順に並んだ既存セルと変更セルを 1 回の走査で突き合わせ、行の子要素を組み直す。
+
+    変更は列番号で持ち、セル参照（A1 形式）との変換は変更位置より左の既存セルと新しい `<c>` にだけ行う。
+    """
+    row_ref = row_elem.attrib["r"]
+    merged_children = []
+    change_pos = 0
+    change_count = len(row_changes)
+    children = list(row_elem)
+
+    for child_pos, child in enumerate(children):
+        if change_pos == change_count:
+            # 変更を置き終えた後の既存セルは列番号を読まずにそのまま残す
+            merged_children.extend(children[child_pos:])
+            break
+        if child.tag != _CELL_TAG:
+            merged_children.append(child)
+            continue
+        current_col = _column_index(child.attrib.get("r", ""))
+        while change_pos < change_count and row_changes[change_pos][0] < current_col:
+            col, value = row_changes[change_pos]
+            style_id = _default_style_id(row_elem, col, column_styles)
+            merged_children.append(
+                _build_cell_element(
+                    f"{get_column_letter(col)}{row_ref}",
+                    value,
+                    style_id,
+                    shared_specs.get(col),
+                    row_cached_values.get(col),
+                )
+            )
+            change_pos += 1
+        if change_pos < change_count and row_changes[change_pos][0] == current_col:
+            _, value = row_changes[change_pos]
+            merged_children.append(
+                _build_cell_element(
+                    child.attrib["r"],
+                    value,
+                    child.attrib.get("s"),
+                    shared_specs.get(current_col),
+                    row_cached_values.get(current_col),
+                )
+            )
+            change_pos += 1
+            continue
+        merged_children.append(child)
+
+    for col, value in row_changes[change_pos:]:
+        style_id = _default_style_id(row_elem, col, column_styles)
+        merged_children.append(
+            _build_cell_element(
+                f"{get_column_letter(col)}{row_ref}",
+                value,
+                style_id,
+                shared_specs.get(col),
+                row_cached_values.get(col),
+            )
+        )
+
+    row_elem[:] = merged_children
+
+
+def _detach_replaced_shared_formulas(sheet: TargetSheet, rows_by_index):
+    """変更で上書きされる共有数式の親セルについて、残る従属セルを展開済みの通常数式へ置き換える。"""
+    replaced_indexes = set()
+    for row, col in sheet.changes:
+        cell = sheet.cells.get(row, col)
+        # 従属セルも読み込み時に展開した式を持つため、親セルは ref の有無で見分ける
+        if cell is not None and cell.formula_type == "shared" and cell.formula_ref is not None:
+            replaced_indexes.add(cell.shared_index)
+    if not replaced_indexes:
+        return
+
+    for (row, col), cell in sheet.cells.cells.items():
+        if cell.formula_type != "shared" or cell.shared_index not in replaced_indexes:
+            continue
+        if (row, col) in sheet.changes:
+            continue
+        row_elem = rows_by_index.get(row)
+        if row_elem is None:
+            continue
+        cell_ref = _cell_ref(row, col)
+        for child in row_elem:
+            if child.attrib.get("r") == cell_ref:
+                formula_elem = child.find(_FORMULA_TAG)
+                if formula_elem is not None:
+                    formula_elem.attrib.clear()
+                    formula_elem.text = cell.formula[1:]
+                break
+
+
+@phase("merge")
+def _merge_sheet_cells(sheet: TargetSheet, cached_values: dict | None = None) -> bytes:
+    """変更セルを `<c>` 要素に変換し、読み込み済みの元 sheet XML ツリーへ直接差し込む。
+
+    行番号の索引と行内の列順マージで処理するため、変更セル数に対して線形の時間で済む。
+    行内で列方向にコピーした関係の数式は共有数式（`t="shared"`）として書き出し、
+    cached_values にある数式セルには計算済みの値を `<v>` として付ける。
+    """
+    if not sheet.changes:
+        return sheet.source_xml
+
+    sheet_data = sheet.root.find("main:sheetData", NS)
+    if sheet_data is None:
+        raise ValueError("sheetData の解析に失敗しました。")
+    column_styles = _column_style_ids(sheet.root)
+
+    changes_by_row: dict[int, list[tuple[int, object]]] = {}
+    for (row, col), value in sheet.changes.items():
+        changes_by_row.setdefault(row, []).append((col, value))
+    cached_values_by_row: dict[int, dict[int, object]] = {}
+    for (row, col), cached_value in (cached_values or {}).items():
+        cached_values_by_row.setdefault(row, {})[col] = cached_value
+
+    rows_by_index = _index_rows(sheet_data)
+    _detach_replaced_shared_formulas(sheet, rows_by_index)
+
+    next_shared_index = sheet.cells.next_shared_index()
+    rows_created = False
+    for row_index in sorted(changes_by_row):
+        row_changes = changes_by_row[row_index]
+        row_elem = rows_by_index.get(row_index)
+        if row_elem is None:
+            row_elem = ET.Element(_ROW_TAG, {"r": str(row_index)})
+            rows_by_index[row_index] = row_elem
+            rows_created = True
+        row_changes.sort(key=lambda change: change[0])
+        shared_specs, next_shared_index = _plan_row_shared_formulas(
+            row_index,
+            row_changes,
+            next_shared_index,
+        )
+        _merge_row_cells(
+            row_elem,
+            row_changes,
+            column_styles,
+            shared_specs,
+            cached_values_by_row.get(row_index, {}),
+        )
+
+    if rows_created:
+        sheet_data[:] = [rows_by_index[row_index] for row_index in sorted(rows_by_index)]
+
+    merged_xml = _serialize_xml(sheet.root)
+    return _restore_root_namespace_declarations(merged_xml, sheet.source_xml)
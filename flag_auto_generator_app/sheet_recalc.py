@@ -0,0 +1,302 @@
+"""生成したセルのキャッシュ値を計算し、Excel 側の全再計算が必要かどうかを判定する処理。"""
+import bisect
+import io
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import NamedTuple
+
+from openpyxl.worksheet.formula import ArrayFormula
+
+from .formula_eval import (
+    ERROR_CODES,
+    ExcelError,
+    FormulaEvaluator,
+    UnsupportedFormula,
+    formula_references,
+    parse_formula,
+)
+from .phase_timing import phase
+from .progress import report_progress
+from .sheet_editor import TargetSheet, _cell_ref
+from .xlsx_package import (
+    MAIN_NS,
+    NS,
+    WORKBOOK_PATH,
+    WORKBOOK_RELS_PATH,
+    _normalize_package_path,
+    _parse_cell_ref,
+    _parse_range_ref,
+    _restore_root_namespace_declarations,
+    _serialize_xml,
+    _workbook_part_path,
+)
+
+
+_FORMULA_TAG = f"{{{MAIN_NS}}}f"
+_CELL_TAG = f"{{{MAIN_NS}}}c"
+
+
+class GeneratedValues(NamedTuple):
+    """生成セルのキャッシュ値と、開いたときの全再計算が必要かどうか。"""
+
+    values: dict[tuple[int, int], object]
+    needs_full_recalc: bool
+    reason: str = ""
+
+
+class _ChangedCellIndex:
+    """変更セルを列ごとの行番号リストで持ち、範囲との交差を二分探索で判定する。"""
+
+    def __init__(self, positions):
+        rows_by_col: dict[int, list[int]] = {}
+        for row, col in positions:
+            rows_by_col.setdefault(col, []).append(row)
+        for rows in rows_by_col.values():
+            rows.sort()
+        self.rows_by_col = rows_by_col
+        self.cols = sorted(rows_by_col)
+
+    def intersects(self, min_row: int, min_col: int, max_row: int, max_col: int) -> bool:
+        col_pos = bisect.bisect_left(self.cols, min_col)
+        while col_pos < len(self.cols) and self.cols[col_pos] <= max_col:
+            rows = self.rows_by_col[self.cols[col_pos]]
+            row_pos = bisect.bisect_left(rows, min_row)
+            if row_pos < len(rows) and rows[row_pos] <= max_row:
+                return True
+            col_pos += 1
+        return False
+
+
+def _is_generated_formula(sheet: TargetSheet, position, value) -> bool:
+    """本文が元セルと同じ数式（配列数式の通常化など）は再計算不要として生成セルから除く。"""
+    if not isinstance(value, str) or not value.startswith("="):
+        return False
+    if position in sheet.recalc_positions:
+        return True
+    source = sheet.cells.get(*position)
+    return source is None or source.formula != value
+
+
+def _source_value(sheet: TargetSheet, row: int, col: int):
+    cell = sheet.cells.get(row, col)
+    if cell is None:
+        return None
+    if cell.formula is not None and isinstance(cell.value, str) and cell.value in ERROR_CODES:
+        return ExcelError(cell.value)
+    return cell.value
+
+
+def _evaluate_changes(sheet: TargetSheet):
+    values = {}
+    resolved = {}
+    failed = set()
+    in_progress = set()
+
+    def resolve(row: int, col: int):
+        position = (row, col)
+        if position in resolved:
+            return resolved[position]
+        if position not in sheet.changes:
+            result = _source_value(sheet, row, col)
+        else:
+            value = sheet.changes[position]
+            if isinstance(value, ArrayFormula):
+                raise UnsupportedFormula("配列数式には対応していません。")
+            if _is_generated_formula(sheet, position, value):
+                if position in failed or position in in_progress:
+                    raise UnsupportedFormula("循環参照または評価できないセルを参照しています。")
+                in_progress.add(position)
+                try:
+                    result = evaluator.scalar(parse_formula(value[1:], col), row, col)
+                except (UnsupportedFormula, RecursionError):
+                    failed.add(position)
+                    raise
+                finally:
+                    in_progress.discard(position)
+                values[position] = result
+            elif isinstance(value, str) and value.startswith("="):
+                result = _source_value(sheet, row, col)
+                if result is not None:
+                    values[position] = result
+            else:
+                result = None if value == "" else value
+        resolved[position] = result
+        return result
+
+    evaluator = FormulaEvaluator(resolve, resolved)
+    change_count = len(sheet.changes)
+    for done, position in enumerate(sheet.changes):
+        if done % 256 == 0:
+            report_progress(done, change_count)
+        if position in resolved or position in failed:
+            continue
+        try:
+            resolve(*position)
+        except (UnsupportedFormula, RecursionError):
+            failed.add(position)
+    return values, failed
+
+
+def _target_sheet_dependents_reason(sheet: TargetSheet, changed_index: _ChangedCellIndex, sheet_name: str) -> str:
+    for position, cell in sheet.cells.cells.items():
+        if cell.formula is None:
+            continue
+        if position in sheet.changes and _is_generated_formula(sheet, position, sheet.changes[position]):
+            continue
+        references = formula_references(cell.formula[1:])
+        if references is None:
+            return f"参照先を特定できない数式があります（{_cell_ref(*position)}）"
+        for ref_sheet, min_row, min_col, max_row, max_col in references:
+            if ref_sheet not in (None, sheet_name):
+                continue
+            if changed_index.intersects(min_row, min_col, max_row, max_col):
+                return f"変更セルを参照する既存の数式があります（{_cell_ref(*position)}）"
+    return ""
+
+
+def _worksheet_parts(source_zip: zipfile.ZipFile) -> list[str]:
+    workbook_rels_root = ET.fromstring(source_zip.read(WORKBOOK_RELS_PATH))
+    parts = []
+    for rel in workbook_rels_root.findall("pkg:Relationship", NS):
+        if rel.attrib.get("Type", "").endswith("/worksheet"):
+            parts.append(_workbook_part_path(_normalize_package_path(rel.attrib.get("Target", ""))))
+    return parts
+
+
+def _shared_extent(formula_elem) -> tuple[int, int]:
+    # 共有数式の親の式は ref の範囲へ複写されるため、相対参照が動く幅の分だけ参照範囲を広げる
+    extent = _parse_range_ref(formula_elem.attrib.get("ref", "")) if formula_elem.attrib.get("t") == "shared" else None
+    if extent is None:
+        return 0, 0
+    min_row, min_col, max_row, max_col = extent
+    return max_row - min_row, max_col - min_col
+
+
+def _other_sheets_dependents_reason(
+    source_zip: zipfile.ZipFile,
+    sheet: TargetSheet,
+    changed_index: _ChangedCellIndex,
+    sheet_name: str,
+) -> str:
+    workbook_root = ET.fromstring(source_zip.read(WORKBOOK_PATH))
+    for defined_name in workbook_root.findall("main:definedNames/main:definedName", NS):
+        if defined_name.attrib.get("name", "").startswith("_xlnm."):
+            continue
+        if sheet_name in (defined_name.text or ""):
+            return f"対象シートを参照する名前定義があります（{defined_name.attrib.get('name')}）"
+
+    encoded_name = sheet_name.encode("utf-8")
+    for part_path in _worksheet_parts(source_zip):
+        if part_path == sheet.sheet_path or part_path not in source_zip.NameToInfo:
+            continue
+        part_xml = source_zip.read(part_path)
+        if encoded_name not in part_xml:
+            continue
+        for event, elem in ET.iterparse(io.BytesIO(part_xml), events=("end",)):
+            if elem.tag != _CELL_TAG:
+                continue
+            formula_elem = elem.find(_FORMULA_TAG)
+            formula_text = formula_elem.text if formula_elem is not None else None
+            if formula_text and sheet_name in formula_text:
+                references = formula_references(formula_text)
+                if references is None:
+                    return f"{part_path} に参照先を特定できない数式があります（{elem.attrib.get('r')}）"
+                row_extent, col_extent = _shared_extent(formula_elem)
+                for ref_sheet, min_row, min_col, max_row, max_col in references:
+                    if ref_sheet != sheet_name:
+                        continue
+                    if changed_index.intersects(min_row, min_col, max_row + row_extent, max_col + col_extent):
+                        return f"{part_path} に変更セルを参照する数式があります（{elem.attrib.get('r')}）"
+            elem.clear()
+    return ""
+
+
+@phase("evaluate")
+def evaluate_generated_cells(sheet: TargetSheet, source_zip: zipfile.ZipFile) -> GeneratedValues:
+    """生成した数式のキャッシュ値を計算する。
+
+    すべての生成セルを評価でき、変更セルに依存する既存の数式がブック内に無い場合だけ
+    Excel で開いたときの全再計算を不要と判定する。
+    """
+    values, failed = _evaluate_changes(sheet)
+    if failed:
+        return GeneratedValues(values, True, f"評価できない生成セルがあります（{len(failed)}件）")
+
+    changed_positions = [
+        position
+        for position, value in sheet.changes.items()
+        if not isinstance(value, str) or not value.startswith("=") or _is_generated_formula(sheet, position, value)
+    ]
+    changed_index = _ChangedCellIndex(changed_positions)
+    reason = _target_sheet_dependents_reason(sheet, changed_index, sheet.sheet_name)
+    if not reason:
+        reason = _other_sheets_dependents_reason(source_zip, sheet, changed_index, sheet.sheet_name)
+    return GeneratedValues(values, bool(reason), reason)
+
+
+def _formula_positions(sheet: TargetSheet) -> set[tuple[int, int]]:
+    positions = {position for position, cell in sheet.cells.cells.items() if cell.formula is not None}
+    for position, value in sheet.changes.items():
+        if isinstance(value, ArrayFormula) or (isinstance(value, str) and value.startswith("=")):
+            positions.add(position)
+        else:
+            positions.discard(position)
+    return positions
+
+
+def _sheet_id(workbook_xml: bytes, sheet_name: str) -> str | None:
+    workbook_root = ET.fromstring(workbook_xml)
+    for sheet_elem in workbook_root.findall("main:sheets/main:sheet", NS):
+        if sheet_elem.attrib.get("name") == sheet_name:
+            return sheet_elem.attrib.get("sheetId")
+    return None
+
+
+@phase("calc_chain")
+def rebuild_calc_chain(calc_chain_xml: bytes, workbook_xml: bytes, sheet: TargetSheet) -> bytes | None:
+    """対象シートの変更を反映した calcChain.xml を作る。
+
+    他シートの項目と順序はそのまま残し、対象シートは数式でなくなったセルを除いて新しい数式セルを末尾へ足す。
+    項目が 1 件も残らない場合は None（calcChain を削除する）。
+    """
+    sheet_id = _sheet_id(workbook_xml, sheet.sheet_name)
+    if sheet_id is None:
+        raise ValueError(f"シート '{sheet.sheet_name}' の sheetId を特定できませんでした。")
+
+    formula_positions = _formula_positions(sheet)
+    root = ET.fromstring(calc_chain_xml)
+    kept_entries = []
+    listed_positions = set()
+    current_sheet_id = None
+    pending_level = False
+
+    for entry in list(root):
+        # i を省略した項目は直前の項目と同じシートを指す。並べ替えても崩れないよう明示しておく
+        current_sheet_id = entry.attrib.get("i", current_sheet_id)
+        if current_sheet_id is not None:
+            entry.set("i", current_sheet_id)
+        if current_sheet_id == sheet_id:
+            position = _parse_cell_ref(entry.attrib.get("r", ""))
+            if position is None or position not in formula_positions or position in listed_positions:
+                pending_level = pending_level or entry.attrib.get("l") == "1"
+                continue
+            listed_positions.add(position)
+            value = sheet.changes.get(position)
+            if isinstance(value, str):
+                # 書き換えたセルは通常の数式（または共有数式）として保存するため配列数式の印を外す
+                entry.attrib.pop("a", None)
+        if pending_level:
+            entry.set("l", "1")
+            pending_level = False
+        kept_entries.append(entry)
+
+    for row, col in sorted(formula_positions - listed_positions):
+        entry = ET.Element(_CELL_TAG, {"r": _cell_ref(row, col), "i": sheet_id})
+        if isinstance(sheet.changes.get((row, col)), ArrayFormula):
+            entry.set("a", "1")
+        kept_entries.append(entry)
+
+    if not kept_entries:
+        return None
+    root[:] = kept_entries
+    return _restore_root_namespace_declarations(_serialize_xml(root), calc_chain_xml)
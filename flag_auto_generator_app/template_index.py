@@ -0,0 +1,161 @@
+"""テンプレート（元ブック）の解析結果を内容のハッシュごとに保存し、同じテンプレートの再解析を省く処理。
+
+索引には対象シートのセルモデル（数式・キャッシュ値の二面ビュー、共有数式の展開結果、
+結合セル範囲、シート XML のパス）を保存する。測定 No の行の読み取りや L〜SR の数式・値の判定は
+このモデルを引くだけで済む。書き戻し用の XML ツリーは索引を使う場合も毎回作るが、
+セルごとの読み取りを伴わない一括解析で済むため読み込みが軽くなる。
+
+同じプロセスで使ったテンプレートは、索引とシート XML をセッションの中でも保持する（ファイルの
+更新時刻かサイズが変わったら読み直す）。GUI はファイルを選んだ時点で `warm_template()` を
+バックグラウンドで呼び、次の生成で使う書き戻し用のツリーも 1 つ先に作っておく。
+"""
+import hashlib
+import os
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import NamedTuple
+
+from .app_cache import cache_dir, file_digest, load_pickle, prune_cache, save_pickle
+from .phase_timing import phase
+from .sheet_editor import TargetSheet
+from .xlsx_package import SheetCells, read_sheet_tree
+
+
+# 索引の中身（SheetCells / SheetCell の構造や共有数式の展開方法）を変えたら上げる
+TEMPLATE_INDEX_VERSION = 2
+TEMPLATE_INDEX_MAX_BYTES = 256 * 1024 * 1024
+# セッションに保持するテンプレートの数。書き戻し用の予備のツリーは大きいため、最後に温めた 1 件にだけ持つ
+_SESSION_TEMPLATE_LIMIT = 4
+
+
+class TemplateIndex(NamedTuple):
+    content_hash: str
+    sheet_name: str
+    cells: SheetCells
+
+
+class _SessionTemplate:
+    def __init__(self, stamp: tuple[int, int], index: TemplateIndex, sheet_xml: bytes, spare_root=None):
+        self.stamp = stamp
+        self.index = index
+        self.sheet_xml = sheet_xml
+        self.spare_root = spare_root
+
+
+_session_templates: dict[tuple[str, str], _SessionTemplate] = {}
+# 温めている途中のテンプレートを生成が読む場合は、解析を二重にせず温め終わるのを待つ
+_session_lock = threading.Lock()
+
+
+def _index_path(index_dir: str, content_hash: str, sheet_name: str) -> str:
+    sheet_key = hashlib.sha1(sheet_name.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(index_dir, f"{content_hash}-{sheet_key}.pickle")
+
+
+def compile_template(xlsx_path: str, sheet_name: str, content_hash: str | None = None) -> TemplateIndex:
+    """テンプレートを解析して索引を保存する（キャッシュが無効な場合は解析だけ行う）。"""
+    index, _ = _compile_template(xlsx_path, sheet_name, content_hash or file_digest(xlsx_path))
+    return index
+
+
+def _compile_template(xlsx_path: str, sheet_name: str, content_hash: str) -> tuple[TemplateIndex, TargetSheet]:
+    source_xml, root, cells = read_sheet_tree(xlsx_path, sheet_name)
+    index = TemplateIndex(content_hash, sheet_name, cells)
+    index_dir = cache_dir("template_index")
+    if index_dir is not None:
+        save_pickle(_index_path(index_dir, content_hash, sheet_name), TEMPLATE_INDEX_VERSION, index)
+        prune_cache(index_dir, TEMPLATE_INDEX_MAX_BYTES)
+    return index, TargetSheet(source_xml, root, cells, sheet_name)
+
+
+def load_template_index(xlsx_path: str, sheet_name: str, content_hash: str | None = None) -> TemplateIndex | None:
+    index_dir = cache_dir("template_index")
+    if index_dir is None:
+        return None
+    content_hash = content_hash or file_digest(xlsx_path)
+    index = load_pickle(_index_path(index_dir, content_hash, sheet_name), TEMPLATE_INDEX_VERSION)
+    if not isinstance(index, TemplateIndex) or index.content_hash != content_hash or index.sheet_name != sheet_name:
+        return None
+    return index
+
+
+def _file_stamp(xlsx_path: str) -> tuple[int, int]:
+    stat = os.stat(xlsx_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_session_template(
+    xlsx_path: str,
+    sheet_name: str,
+    stamp: tuple[int, int],
+    keep_tree: bool,
+) -> _SessionTemplate:
+    content_hash = file_digest(xlsx_path)
+    index = load_template_index(xlsx_path, sheet_name, content_hash)
+    if index is not None:
+        try:
+            with zipfile.ZipFile(xlsx_path, "r") as workbook_zip:
+                return _SessionTemplate(stamp, index, workbook_zip.read(index.cells.sheet_path))
+        except KeyError:
+            # ハッシュが一致する限り起きないが、索引のパスが合わない場合は作り直す
+            pass
+    index, sheet = _compile_template(xlsx_path, sheet_name, content_hash)
+    return _SessionTemplate(stamp, index, sheet.source_xml, sheet.root if keep_tree else None)
+
+
+def _session_template(xlsx_path: str, sheet_name: str, keep_tree: bool = False) -> _SessionTemplate:
+    # _session_lock を持って呼ぶ。更新時刻を先に取るため、読み込み中に変わったファイルは次回に読み直される
+    # keep_tree が True なら、索引を作るために解析したツリーを予備のツリーとして残す
+    key = (os.path.abspath(xlsx_path), sheet_name)
+    stamp = _file_stamp(xlsx_path)
+    entry = _session_templates.pop(key, None)
+    if entry is None or entry.stamp != stamp:
+        entry = _load_session_template(xlsx_path, sheet_name, stamp, keep_tree)
+    _session_templates[key] = entry
+    while len(_session_templates) > _SESSION_TEMPLATE_LIMIT:
+        del _session_templates[next(iter(_session_templates))]
+    return entry
+
+
+def warm_template(xlsx_path: str, sheet_name: str):
+    """テンプレートを解析（索引があれば読み込み）してセッションに保持し、書き戻し用のツリーを 1 つ作っておく。
+
+    キャッシュが無効な場合は何もしない。
+    """
+    if cache_dir("template_index") is None:
+        return
+    with _session_lock:
+        entry = _session_template(xlsx_path, sheet_name, keep_tree=True)
+        for other in _session_templates.values():
+            if other is not entry:
+                other.spare_root = None
+        if entry.spare_root is None:
+            entry.spare_root = ET.fromstring(entry.sheet_xml)
+
+
+def load_template_cells(xlsx_path: str, sheet_name: str) -> SheetCells:
+    """書き戻し用のツリーを作らずに、対象シートのセルモデルだけを返す（索引が無ければ作る）。"""
+    if cache_dir("template_index") is None:
+        return compile_template(xlsx_path, sheet_name).cells
+    with _session_lock:
+        return _session_template(xlsx_path, sheet_name).index.cells
+
+
+@phase("template_load")
+def load_template_sheet(xlsx_path: str, sheet_name: str) -> TargetSheet:
+    """対象シートを読み込む。同じ内容のテンプレートの索引があればセルごとの解析を省く。
+
+    索引が無い場合は通常どおり解析し、次回のために索引を保存する。`warm_template()` で作っておいた
+    書き戻し用のツリーがあればそれを使う（ツリーは生成で書き換わるため 1 回限り）。
+    """
+    if cache_dir("template_index") is None:
+        source_xml, root, cells = read_sheet_tree(xlsx_path, sheet_name)
+        return TargetSheet(source_xml, root, cells, sheet_name)
+
+    with _session_lock:
+        entry = _session_template(xlsx_path, sheet_name, keep_tree=True)
+        root, entry.spare_root = entry.spare_root, None
+    if root is None:
+        root = ET.fromstring(entry.sheet_xml)
+    return TargetSheet(entry.sheet_xml, root, entry.index.cells, sheet_name)
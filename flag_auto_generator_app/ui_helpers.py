@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog, ttk
+from tkinter import filedialog, messagebox, ttk
 
 import ttkbootstrap as tb
 from ttkbootstrap.constants import SECONDARY
 
+from .phase_timing import phase_label
+from .progress import Progress
 from .ui_theme import PANEL_BG, TEXT_SOFT, font_ui, place_toplevel_center
 
 
@@ -27,10 +31,132 @@ def pick_save_path(title: str, defaultextension: str, filetypes, parent=None):
     )
 
 
+def ask_retry_when_file_locked(parent):
+    """出力先ファイルが開かれていて保存できないとき、閉じてから再試行するかを尋ねる処理を返す。"""
+
+    def on_file_locked(out_path: str, error: PermissionError) -> bool:
+        return messagebox.askretrycancel(
+            "保存に失敗",
+            "出力先ファイルに書き込めません。\n"
+            "Excelで出力先ファイルを開いている場合は閉じてから「再試行」を押してください。\n\n"
+            f"出力先:\n{out_path}\n\n"
+            f"詳細:\n{error}",
+            parent=parent,
+        )
+
+    return on_file_locked
+
+
+class UiTaskRunner:
+    """画面の裏で行う重い処理（読み込み・生成）を 1 本のワーカースレッドで依頼順に実行する。
+
+    結果は完了キューに積み、Tk のイベントループ側で取り出して on_done / on_error を呼ぶため、
+    コールバックの中では画面を直接操作してよい。同じ key の依頼がまだ始まっていなければ、
+    古い依頼は実行せずに新しい依頼だけを実行する（古い依頼のコールバックは呼ばない）。
+    """
+
+    def __init__(self, widget, poll_interval_ms: int = 50):
+        self._widget = widget
+        self._poll_interval_ms = poll_interval_ms
+        self._tasks = queue.Queue()
+        self._completed = queue.SimpleQueue()
+        self._waiting_by_key = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._work, name="gui-tasks", daemon=True).start()
+        widget.after(poll_interval_ms, self._drain)
+
+    def submit(self, func, on_done=None, on_error=None, *, key=None):
+        """func() をワーカーで実行する。on_error を省くと例外は Tk の既定の例外表示へ回す。"""
+        task = (func, on_done, on_error, key)
+        with self._lock:
+            if key is not None:
+                self._waiting_by_key[key] = task
+        self._tasks.put(task)
+
+    def post(self, callback, *args):
+        """ワーカーから、Tk のスレッドで callback(*args) を呼ぶよう依頼する（結果は待たない）。"""
+        self._completed.put(lambda: callback(*args))
+
+    def in_ui(self, func):
+        """ワーカーから呼ぶと Tk のスレッドで func を実行し、その戻り値を返す関数にする（確認ダイアログ用）。"""
+
+        def call(*args, **kwargs):
+            if threading.current_thread() is threading.main_thread():
+                return func(*args, **kwargs)
+            done = threading.Event()
+            outcome = {}
+
+            def run():
+                try:
+                    outcome["result"] = func(*args, **kwargs)
+                except BaseException as e:
+                    outcome["error"] = e
+                finally:
+                    done.set()
+
+            self._completed.put(run)
+            done.wait()
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["result"]
+
+        return call
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            func, on_done, on_error, key = task
+            with self._lock:
+                if key is not None:
+                    if self._waiting_by_key.get(key) is not task:
+                        # 後から同じ key の依頼が来ているので、こちらは実行しない
+                        continue
+                    del self._waiting_by_key[key]
+            try:
+                result = func()
+            except Exception as e:
+                if on_error is None:
+                    self.post(self._widget.report_callback_exception, type(e), e, e.__traceback__)
+                else:
+                    self.post(on_error, e)
+            else:
+                if on_done is not None:
+                    self.post(on_done, result)
+
+    def _drain(self):
+        try:
+            while True:
+                try:
+                    callback = self._completed.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    callback()
+                except Exception as e:
+                    self._widget.report_callback_exception(type(e), e, e.__traceback__)
+        finally:
+            self._widget.after(self._poll_interval_ms, self._drain)
+
+
+def format_progress_status(progress: Progress, elapsed: float) -> str:
+    """進捗ダイアログに出す「工程名（件数） 残り時間の目安」。"""
+    text = phase_label(progress.phase)
+    if progress.total:
+        text += f"（{progress.done}/{progress.total}）"
+    # 始めのうちは見積もりが大きく揺れるため、1 割進むまでは残り時間を出さない
+    if progress.fraction >= 0.1:
+        remaining = elapsed * (1 - progress.fraction) / progress.fraction
+        text += f"  残り約{max(remaining, 1):.0f}秒"
+    return text
+
+
 class LoadingDialog(tb.Toplevel):
-    """ローディング表示。静かな配色と広めの余白で視認性を保つ。"""
+    """ローディング表示。静かな配色と広めの余白で視認性を保つ。
+
+    on_cancel を渡すと、進み具合のバー（`set_progress()` で更新）と取り消しボタンを出す。
+    """
 
-    def __init__(self, parent, title="処理中...", message="お待ちください..."):
+    def __init__(self, parent, title="処理中...", message="お待ちください...", on_cancel=None):
         super().__init__(parent)
         self.title(title)
         self.transient(parent)
@@ -38,9 +164,10 @@ class LoadingDialog(tb.Toplevel):
         self.configure(bg=PANEL_BG)
 
         window_width = 520
-        window_height = 168
+        window_height = 168 if on_cancel is None else 250
+        self._on_cancel = on_cancel
 
-        self.protocol("WM_DELETE_WINDOW", lambda: None)
+        self.protocol("WM_DELETE_WINDOW", lambda: None if on_cancel is None else self._cancel())
 
         frame = ttk.Frame(self, padding=28)
         frame.pack(fill=tk.BOTH, expand=True)
@@ -57,16 +184,46 @@ class LoadingDialog(tb.Toplevel):
 
         self.progress = ttk.Progressbar(
             frame,
-            mode="indeterminate",
+            mode="indeterminate" if on_cancel is None else "determinate",
             length=440,
+            maximum=100,
         )
         self.progress.pack(anchor=tk.W)
-        self.progress.start(10)
+        if on_cancel is None:
+            self.progress.start(10)
+        else:
+            self.status = tk.StringVar(value="準備しています...")
+            tb.Label(
+                frame,
+                textvariable=self.status,
+                font=font_ui(9),
+                bootstyle=SECONDARY,
+                foreground=TEXT_SOFT,
+            ).pack(anchor=tk.W, pady=(8, 0))
+            self.cancel_button = tb.Button(
+                frame,
+                text="取り消し",
+                command=self._cancel,
+                bootstyle="outline-secondary",
+            )
+            self.cancel_button.pack(anchor=tk.E, pady=(12, 0))
 
         self.update()
         self.update_idletasks()
         place_toplevel_center(self, window_width, window_height)
 
+    def set_progress(self, fraction: float, status: str):
+        self.progress.configure(value=fraction * 100)
+        if str(self.cancel_button.cget("state")) != tk.DISABLED:
+            self.status.set(status)
+
+    def _cancel(self):
+        if str(self.cancel_button.cget("state")) == tk.DISABLED:
+            return
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.status.set("取り消しています...（保存を始めている場合は完了まで待ちます）")
+        self._on_cancel()
+
     def close(self):
         self.progress.stop()
         self.grab_release()
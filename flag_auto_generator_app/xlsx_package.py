@@ -0,0 +1,516 @@
+"""xlsx パッケージ（zip + XML）を openpyxl を介さずに直接読むための処理。"""
+import bisect
+import posixpath
+import re
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import NamedTuple
+
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from .formula_eval import translate_formula
+from .phase_timing import phase
+
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+X14AC_NS = "http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac"
+XR_NS = "http://schemas.microsoft.com/office/spreadsheetml/2014/revision"
+XR2_NS = "http://schemas.microsoft.com/office/spreadsheetml/2015/revision2"
+XR3_NS = "http://schemas.microsoft.com/office/spreadsheetml/2016/revision3"
+X15_NS = "http://schemas.microsoft.com/office/spreadsheetml/2010/11/main"
+X15AC_NS = "http://schemas.microsoft.com/office/spreadsheetml/2010/11/ac"
+XR6_NS = "http://schemas.microsoft.com/office/spreadsheetml/2016/revision6"
+XR10_NS = "http://schemas.microsoft.com/office/spreadsheetml/2016/revision10"
+XCALCF_NS = "http://schemas.microsoft.com/office/spreadsheetml/2018/calcfeatures"
+NS = {
+    "main": MAIN_NS,
+    "rel": REL_NS,
+    "pkg": PKG_REL_NS,
+    "ct": CONTENT_TYPES_NS,
+}
+
+ET.register_namespace("", MAIN_NS)
+ET.register_namespace("r", REL_NS)
+ET.register_namespace("mc", MC_NS)
+ET.register_namespace("x14ac", X14AC_NS)
+ET.register_namespace("xr", XR_NS)
+ET.register_namespace("xr2", XR2_NS)
+ET.register_namespace("xr3", XR3_NS)
+ET.register_namespace("x15", X15_NS)
+ET.register_namespace("x15ac", X15AC_NS)
+ET.register_namespace("xr6", XR6_NS)
+ET.register_namespace("xr10", XR10_NS)
+ET.register_namespace("xcalcf", XCALCF_NS)
+
+CONTENT_TYPES_PATH = "[Content_Types].xml"
+WORKBOOK_PATH = "xl/workbook.xml"
+WORKBOOK_RELS_PATH = "xl/_rels/workbook.xml.rels"
+SHARED_STRINGS_PATH = "xl/sharedStrings.xml"
+CALC_CHAIN_PATH = "xl/calcChain.xml"
+_CELL_TAG = f"{{{MAIN_NS}}}c"
+_ROW_TAG = f"{{{MAIN_NS}}}row"
+_FORMULA_TAG = f"{{{MAIN_NS}}}f"
+_VALUE_TAG = f"{{{MAIN_NS}}}v"
+_INLINE_STRING_TAG = f"{{{MAIN_NS}}}is"
+_TEXT_TAG = f"{{{MAIN_NS}}}t"
+_SHARED_STRING_ITEM_TAG = f"{{{MAIN_NS}}}si"
+_PHONETIC_RUN_TAG = f"{{{MAIN_NS}}}rPh"
+_MERGE_CELL_TAG = f"{{{MAIN_NS}}}mergeCell"
+_CELL_REF_PATTERN = re.compile(r"([A-Z]+)(\d+)")
+# zip ローカルファイルヘッダの固定長部分（APPNOTE 4.3.7）とファイル名長・拡張フィールド長の位置
+_LOCAL_FILE_HEADER_STRUCT = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_FILE_HEADER_NAME_LENGTH_INDEX = 10
+_LOCAL_FILE_HEADER_EXTRA_LENGTH_INDEX = 11
+_LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+_DATA_DESCRIPTOR_FLAG = 0x08
+# 圧縮済みのまま複写するときに書き換える ZipFile の内部属性（公開 API が無い）
+_RAW_COPY_SOURCE_ATTRIBUTES = ("fp",)
+_RAW_COPY_OUTPUT_ATTRIBUTES = ("fp", "start_dir", "filelist", "NameToInfo", "_didModify")
+_RAW_COPY_CHUNK_SIZE = 1024 * 1024
+# 行ごとの索引に展開しない縦長の結合範囲（列全体の結合など）の行数。これ以上は線形に探す
+_MERGED_INDEX_MAX_ROW_SPAN = 1024
+
+
+class SheetCell(NamedTuple):
+    """1 セル分の数式（`=` 付き）とキャッシュ値。"""
+
+    formula: str | None
+    value: object
+    formula_type: str | None = None
+    formula_ref: str | None = None
+    shared_index: str | None = None
+
+
+class MergedCellIndex:
+    """結合セル範囲を行ごとに振り分け、行内は左端の列で二分探索する索引。
+
+    範囲が数千あっても、1 セルがどの結合範囲に入るかをほぼ一定時間で引ける。
+    """
+
+    def __init__(self, merged_ranges: list[tuple[int, int, int, int]]):
+        rows: dict[int, list[tuple[int, int, int]]] = {}
+        self._tall_ranges = []
+        for min_row, min_col, max_row, max_col in merged_ranges:
+            if max_row - min_row >= _MERGED_INDEX_MAX_ROW_SPAN:
+                self._tall_ranges.append((min_row, min_col, max_row, max_col))
+                continue
+            for row in range(min_row, max_row + 1):
+                rows.setdefault(row, []).append((min_col, max_col, min_row))
+        self._rows = {}
+        for row, entries in rows.items():
+            entries.sort()
+            self._rows[row] = ([entry[0] for entry in entries], entries)
+
+    def anchor(self, row: int, col: int) -> tuple[int, int] | None:
+        """(row, col) を含む結合範囲の左上セルを返す。結合されていなければ None。"""
+        bucket = self._rows.get(row)
+        if bucket is not None:
+            min_cols, entries = bucket
+            pos = bisect.bisect_right(min_cols, col) - 1
+            if pos >= 0:
+                min_col, max_col, min_row = entries[pos]
+                if col <= max_col:
+                    return min_row, min_col
+        for min_row, min_col, max_row, max_col in self._tall_ranges:
+            if min_row <= row <= max_row and min_col <= col <= max_col:
+                return min_row, min_col
+        return None
+
+
+class SheetCells:
+    """対象シートの数式ビューと値ビューを 1 回の読み込みで保持する。"""
+
+    def __init__(
+        self,
+        sheet_path: str,
+        cells: dict[tuple[int, int], SheetCell],
+        max_row: int,
+        merged_ranges: list[tuple[int, int, int, int]] | None = None,
+    ):
+        self.sheet_path = sheet_path
+        self.cells = cells
+        self.max_row = max_row
+        self.merged_ranges = merged_ranges or []
+        self._merged_index: MergedCellIndex | None = None
+
+    def get(self, row: int, col: int) -> SheetCell | None:
+        return self.cells.get((row, col))
+
+    def value(self, row: int, col: int):
+        cell = self.cells.get((row, col))
+        return None if cell is None else cell.value
+
+    def formula(self, row: int, col: int) -> str | None:
+        cell = self.cells.get((row, col))
+        return None if cell is None else cell.formula
+
+    def merged_anchor(self, row: int, col: int) -> tuple[int, int] | None:
+        """(row, col) を含む結合範囲の左上セルを返す（索引は初回に作る）。結合されていなければ None。"""
+        if self._merged_index is None:
+            self._merged_index = MergedCellIndex(self.merged_ranges)
+        return self._merged_index.anchor(row, col)
+
+    def next_shared_index(self) -> int:
+        """元シートの共有数式と衝突しない、新しい共有数式の si 番号を返す。"""
+        max_index = -1
+        for cell in self.cells.values():
+            if cell.shared_index is not None and cell.shared_index.isdigit():
+                max_index = max(max_index, int(cell.shared_index))
+        return max_index + 1
+
+
+def _normalize_package_path(target: str) -> str:
+    normalized = (target or "").replace("\\", "/")
+    if normalized.startswith("/"):
+        normalized = normalized[1:]
+    return posixpath.normpath(normalized)
+
+
+def _workbook_part_path(target: str) -> str:
+    if target.startswith("xl/"):
+        return target
+    return f"xl/{target}"
+
+
+def _worksheet_path_in_zip(workbook_zip: zipfile.ZipFile, sheet_name: str) -> str:
+    workbook_root = ET.fromstring(workbook_zip.read(WORKBOOK_PATH))
+    workbook_rels_root = ET.fromstring(workbook_zip.read(WORKBOOK_RELS_PATH))
+
+    rel_id_to_target = {}
+    for rel in workbook_rels_root.findall("pkg:Relationship", NS):
+        rel_id = rel.attrib.get("Id")
+        target = _normalize_package_path(rel.attrib.get("Target", ""))
+        if rel_id:
+            rel_id_to_target[rel_id] = target
+
+    sheet_names = []
+    for sheet in workbook_root.findall("main:sheets/main:sheet", NS):
+        sheet_names.append(sheet.attrib.get("name"))
+        if sheet.attrib.get("name") != sheet_name:
+            continue
+        rel_id = sheet.attrib.get(f"{{{REL_NS}}}id")
+        if not rel_id:
+            break
+        return _workbook_part_path(rel_id_to_target.get(rel_id, ""))
+    else:
+        raise ValueError(
+            f"シート '{sheet_name}' が見つかりません。存在: {sheet_names}"
+        )
+
+    raise ValueError(f"シート '{sheet_name}' の XML パスを特定できませんでした。")
+
+
+def _read_shared_strings(workbook_zip: zipfile.ZipFile) -> list[str]:
+    if SHARED_STRINGS_PATH not in workbook_zip.namelist():
+        return []
+
+    shared_strings = []
+    with workbook_zip.open(SHARED_STRINGS_PATH) as strings_stream:
+        for _, elem in ET.iterparse(strings_stream, events=("end",)):
+            if elem.tag != _SHARED_STRING_ITEM_TAG:
+                continue
+            # ふりがな（rPh）配下の t は表示文字列に含めない
+            for phonetic_run in elem.findall(_PHONETIC_RUN_TAG):
+                elem.remove(phonetic_run)
+            shared_strings.append("".join(text_elem.text or "" for text_elem in elem.iter(_TEXT_TAG)))
+            elem.clear()
+    return shared_strings
+
+
+def _parse_cell_ref(cell_ref: str) -> tuple[int, int] | None:
+    match = _CELL_REF_PATTERN.fullmatch(cell_ref.replace("$", ""))
+    if not match:
+        return None
+    col_letters, row_text = match.groups()
+    return int(row_text), column_index_from_string(col_letters)
+
+
+def _parse_range_ref(range_ref: str) -> tuple[int, int, int, int] | None:
+    start_ref, _, end_ref = range_ref.partition(":")
+    start = _parse_cell_ref(start_ref)
+    end = _parse_cell_ref(end_ref) if end_ref else start
+    if start is None or end is None:
+        return None
+    return (
+        min(start[0], end[0]),
+        min(start[1], end[1]),
+        max(start[0], end[0]),
+        max(start[1], end[1]),
+    )
+
+
+def _convert_cached_value(raw_text: str | None, cell_type: str | None, shared_strings: list[str]):
+    if raw_text is None:
+        return None
+    if cell_type == "s":
+        try:
+            return shared_strings[int(raw_text)]
+        except (ValueError, IndexError):
+            return None
+    if cell_type in ("str", "e"):
+        return raw_text
+    if cell_type == "b":
+        return raw_text.strip() == "1"
+    try:
+        number = float(raw_text)
+    except ValueError:
+        return raw_text
+    if number.is_integer() and not any(marker in raw_text for marker in (".", "e", "E")):
+        return int(number)
+    return number
+
+
+def _read_sheet_cell(cell_elem, shared_strings: list[str]) -> SheetCell:
+    cell_type = cell_elem.attrib.get("t")
+    formula = None
+    formula_type = None
+    value = None
+
+    formula_ref = None
+    shared_index = None
+
+    formula_elem = cell_elem.find(_FORMULA_TAG)
+    if formula_elem is not None:
+        formula_type = formula_elem.attrib.get("t")
+        formula_ref = formula_elem.attrib.get("ref")
+        shared_index = formula_elem.attrib.get("si")
+        # 共有数式の従属セルは本文を持たないため、読み込み後に親セルの式から展開する
+        formula = f"={formula_elem.text or ''}"
+
+    if cell_type == "inlineStr":
+        inline_elem = cell_elem.find(_INLINE_STRING_TAG)
+        if inline_elem is not None:
+            value = "".join(text_elem.text or "" for text_elem in inline_elem.iter(_TEXT_TAG))
+    else:
+        value_elem = cell_elem.find(_VALUE_TAG)
+        if value_elem is not None:
+            value = _convert_cached_value(value_elem.text, cell_type, shared_strings)
+
+    return SheetCell(formula, value, formula_type, formula_ref, shared_index)
+
+
+def _expand_shared_formulas(cells: dict[tuple[int, int], SheetCell], shared_masters: dict, shared_children: list):
+    for position, shared_index in shared_children:
+        master = shared_masters.get(shared_index)
+        cell = cells.get(position)
+        if master is None or cell is None:
+            continue
+        master_position, master_formula = master
+        translated = translate_formula(
+            master_formula,
+            position[0] - master_position[0],
+            position[1] - master_position[1],
+        )
+        if translated is None:
+            origin = f"{get_column_letter(master_position[1])}{master_position[0]}"
+            target = f"{get_column_letter(position[1])}{position[0]}"
+            try:
+                translated = Translator(master_formula, origin=origin).translate_formula(target)
+            except Exception:
+                continue
+        cells[position] = cell._replace(formula=translated)
+
+
+def _collect_row_cells(row_elem, row: int, shared_strings: list[str], cells: dict, shared_masters: dict, shared_children: list):
+    current_col = 0
+    last_cell_ref = None
+    for elem in row_elem:
+        if elem.tag != _CELL_TAG:
+            continue
+        cell_ref = elem.attrib.get("r")
+        if cell_ref is not None and len(elem) == 0 and elem.attrib.get("t") != "inlineStr":
+            # 書式だけの空セル（テンプレートの大半）は位置の解析も省く。r の無いセルが続く場合に備えて参照だけ覚える
+            last_cell_ref = cell_ref
+            continue
+        if last_cell_ref is not None:
+            last_position = _parse_cell_ref(last_cell_ref)
+            if last_position is not None:
+                current_col = last_position[1]
+            last_cell_ref = None
+        position = _parse_cell_ref(cell_ref or "")
+        if position is None:
+            position = (row, current_col + 1)
+        current_col = position[1]
+        cell = _read_sheet_cell(elem, shared_strings)
+        if cell.formula is not None or cell.value is not None:
+            cells[position] = cell
+        if cell.formula_type == "shared":
+            if cell.formula != "=":
+                shared_masters[cell.shared_index] = (position, cell.formula)
+            else:
+                shared_children.append((position, cell.shared_index))
+
+
+def _parse_sheet_root(root, shared_strings: list[str]):
+    # ツリーを一括で作ってから行を辿る。iterparse のイベント処理が無い分、ツリーを残す場合はこちらが速い
+    cells = {}
+    shared_masters = {}
+    shared_children = []
+    max_row = 0
+    current_row = 0
+
+    for row_elem in root.iter(_ROW_TAG):
+        current_row = int(row_elem.attrib.get("r", current_row + 1))
+        max_row = max(max_row, current_row)
+        _collect_row_cells(row_elem, current_row, shared_strings, cells, shared_masters, shared_children)
+
+    merged_ranges = []
+    for elem in root.iter(_MERGE_CELL_TAG):
+        merged_range = _parse_range_ref(elem.attrib.get("ref", ""))
+        if merged_range is not None:
+            merged_ranges.append(merged_range)
+
+    _expand_shared_formulas(cells, shared_masters, shared_children)
+    return cells, max_row, merged_ranges
+
+
+def read_sheet_tree(xlsx_path: str, sheet_name: str):
+    """対象シートを 1 回だけ解析し、書き戻し用の XML ツリーと二面ビューを同時に返す。"""
+    with zipfile.ZipFile(xlsx_path, "r") as workbook_zip:
+        sheet_path = _worksheet_path_in_zip(workbook_zip, sheet_name)
+        shared_strings = _read_shared_strings(workbook_zip)
+        sheet_xml = workbook_zip.read(sheet_path)
+
+    root = ET.fromstring(sheet_xml)
+    cells, max_row, merged_ranges = _parse_sheet_root(root, shared_strings)
+    return sheet_xml, root, SheetCells(sheet_path, cells, max_row, merged_ranges)
+
+
+def _serialize_xml(root) -> bytes:
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def _restore_root_namespace_declarations(serialized_xml: bytes, original_xml: bytes) -> bytes:
+    serialized_text = serialized_xml.decode("utf-8")
+    original_text = original_xml.decode("utf-8", errors="ignore")
+
+    serialized_match = re.search(r"<([A-Za-z0-9_:.-]+)([^>]*)>", serialized_text)
+    original_match = re.search(r"<([A-Za-z0-9_:.-]+)([^>]*)>", original_text)
+    if not serialized_match or not original_match:
+        return serialized_xml
+
+    serialized_root_tag = serialized_match.group(1)
+    serialized_root_attrs = serialized_match.group(2)
+    original_root_attrs = original_match.group(2)
+
+    namespace_decls = re.findall(r'\s(xmlns(?::[A-Za-z0-9_.-]+)?)="([^"]+)"', original_root_attrs)
+    missing_decls = []
+    for attr_name, uri in namespace_decls:
+        decl_pattern = rf'\s{re.escape(attr_name)}="{re.escape(uri)}"'
+        if re.search(decl_pattern, serialized_root_attrs):
+            continue
+        missing_decls.append(f' {attr_name}="{uri}"')
+
+    if not missing_decls:
+        return serialized_xml
+
+    replacement = f"<{serialized_root_tag}{serialized_root_attrs}{''.join(missing_decls)}>"
+    updated_text = (
+        serialized_text[: serialized_match.start()]
+        + replacement
+        + serialized_text[serialized_match.end() :]
+    )
+    return updated_text.encode("utf-8")
+
+
+def _raw_member_data_offset(source_zip: zipfile.ZipFile, info: zipfile.ZipInfo) -> int:
+    source_zip.fp.seek(info.header_offset)
+    header = _LOCAL_FILE_HEADER_STRUCT.unpack(source_zip.fp.read(_LOCAL_FILE_HEADER_STRUCT.size))
+    if header[0] != _LOCAL_FILE_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"{info.filename} のローカルヘッダを読めませんでした。")
+    return (
+        info.header_offset
+        + _LOCAL_FILE_HEADER_STRUCT.size
+        + header[_LOCAL_FILE_HEADER_NAME_LENGTH_INDEX]
+        + header[_LOCAL_FILE_HEADER_EXTRA_LENGTH_INDEX]
+    )
+
+
+def _copy_member_raw(source_zip: zipfile.ZipFile, out_zip: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """圧縮済みのバイト列を展開・再圧縮せずにそのまま出力 zip へ複写する。
+
+    zipfile に公開 API がないため、ローカルヘッダを書いて中央ディレクトリ用の
+    ZipInfo を登録する処理を ZipFile.write と同じ手順で行う。
+    """
+    copied_info = zipfile.ZipInfo(info.filename, info.date_time)
+    copied_info.compress_type = info.compress_type
+    copied_info.compress_size = info.compress_size
+    copied_info.file_size = info.file_size
+    copied_info.CRC = info.CRC
+    copied_info.create_system = info.create_system
+    copied_info.external_attr = info.external_attr
+    copied_info.internal_attr = info.internal_attr
+    copied_info.comment = info.comment
+    # サイズと CRC はローカルヘッダへ直接書くため、データ記述子は付けない
+    copied_info.flag_bits = info.flag_bits & ~_DATA_DESCRIPTOR_FLAG
+
+    data_offset = _raw_member_data_offset(source_zip, info)
+    out_fp = out_zip.fp
+    copied_info.header_offset = out_fp.tell()
+    out_fp.write(copied_info.FileHeader())
+    source_zip.fp.seek(data_offset)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source_zip.fp.read(min(_RAW_COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"{info.filename} の圧縮データが途中で終わっています。")
+        out_fp.write(chunk)
+        remaining -= len(chunk)
+
+    out_zip.filelist.append(copied_info)
+    out_zip.NameToInfo[copied_info.filename] = copied_info
+    out_zip.start_dir = out_fp.tell()
+    out_zip._didModify = True
+
+
+def _copy_member_recompressed(source_zip: zipfile.ZipFile, out_zip: zipfile.ZipFile, info: zipfile.ZipInfo):
+    copied_info = zipfile.ZipInfo(info.filename, info.date_time)
+    copied_info.compress_type = info.compress_type
+    copied_info.external_attr = info.external_attr
+    copied_info.comment = info.comment
+    out_zip.writestr(copied_info, source_zip.read(info))
+
+
+def _supports_raw_copy(source_zip: zipfile.ZipFile, out_zip: zipfile.ZipFile) -> bool:
+    """`_copy_member_raw` が使う zipfile の内部属性があるか。無い Python では展開・再圧縮で複写する。"""
+    return all(hasattr(source_zip, name) for name in _RAW_COPY_SOURCE_ATTRIBUTES) and all(
+        hasattr(out_zip, name) for name in _RAW_COPY_OUTPUT_ATTRIBUTES
+    )
+
+
+@phase("zip_write")
+def write_package_with_replacements(
+    source_zip: zipfile.ZipFile,
+    out_path: str,
+    replaced_parts: dict[str, bytes | None],
+):
+    """変更パーツだけを圧縮し直し、それ以外は元の圧縮データを逐次複写して xlsx を書き出す。
+
+    `replaced_parts` の値が None のパーツは出力から除外する。元パッケージにない名前は末尾に追加する。
+    """
+    with open(out_path, "wb") as out_file:
+        with zipfile.ZipFile(out_file, "w", compression=zipfile.ZIP_DEFLATED) as out_zip:
+            # 書き出しの途中で失敗しないよう、複写の方法は最初に決める
+            copy_member = _copy_member_raw if _supports_raw_copy(source_zip, out_zip) else _copy_member_recompressed
+            for info in source_zip.infolist():
+                if info.filename not in replaced_parts:
+                    copy_member(source_zip, out_zip, info)
+                    continue
+                data = replaced_parts[info.filename]
+                if data is None:
+                    continue
+                replaced_info = zipfile.ZipInfo(info.filename, info.date_time)
+                replaced_info.compress_type = zipfile.ZIP_DEFLATED
+                replaced_info.external_attr = info.external_attr
+                out_zip.writestr(replaced_info, data)
+
+            source_names = set(source_zip.namelist())
+            for name, data in replaced_parts.items():
+                if data is not None and name not in source_names:
+                    out_zip.writestr(name, data)
@@ -0,0 +1,44 @@
+import os
+import pickle
+
+import pytest
+
+from flag_auto_generator_app import app_cache
+
+
+@pytest.fixture(autouse=True)
+def user_folder(tmp_path, monkeypatch):
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path / "local"))
+    monkeypatch.setattr(app_cache, "_signing_key", None)
+    return tmp_path / "local"
+
+
+class _Planted:
+    def __reduce__(self):
+        return (os.mkdir, (os.environ["PLANTED_MARKER"],))
+
+
+def test_pickle_round_trip(tmp_path, user_folder):
+    path = str(tmp_path / "cache" / "index.pickle")
+    app_cache.save_pickle(path, 2, {"cells": [1, 2, 3]})
+    assert app_cache.load_pickle(path, 2) == {"cells": [1, 2, 3]}
+    assert app_cache.load_pickle(path, 3) is None
+    assert (user_folder / "flag_auto_generator" / "cache.key").stat().st_size == 32
+
+
+def test_planted_pickle_is_not_loaded(tmp_path, monkeypatch):
+    marker = tmp_path / "executed"
+    monkeypatch.setenv("PLANTED_MARKER", str(marker))
+    path = tmp_path / "cache" / "index.pickle"
+    path.parent.mkdir()
+    path.write_bytes(pickle.dumps((2, _Planted())))
+    assert app_cache.load_pickle(str(path), 2) is None
+    assert not marker.exists()
+
+
+def test_pickle_signed_with_another_key_is_not_loaded(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared" / "index.pickle")
+    app_cache.save_pickle(path, 2, "他の利用者の索引")
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path / "other-user"))
+    monkeypatch.setattr(app_cache, "_signing_key", None)
+    assert app_cache.load_pickle(path, 2) is None
@@ -0,0 +1,125 @@
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pytest
+from openpyxl.worksheet.formula import ArrayFormula
+
+from flag_auto_generator_app.excel_ops import _save_preserving_package_parts
+from flag_auto_generator_app.sheet_editor import TargetSheet
+from flag_auto_generator_app.sheet_recalc import rebuild_calc_chain
+from flag_auto_generator_app.xlsx_package import (
+    CALC_CHAIN_PATH,
+    CONTENT_TYPES_PATH,
+    MAIN_NS,
+    WORKBOOK_RELS_PATH,
+    SheetCell,
+    SheetCells,
+    _parse_cell_ref,
+)
+
+from xlsx_builder import build_xlsx, load_sheet, rows_xml
+
+
+SHEET_NAME = "工程内検査シート"
+# 対象シートの sheetId は 3（sheetId は並び順と一致しないことがある）
+WORKBOOK_XML = (
+    f'<workbook xmlns="{MAIN_NS}"><sheets><sheet name="その他" sheetId="1"/>'
+    f'<sheet name="{SHEET_NAME}" sheetId="3"/></sheets></workbook>'
+).encode("utf-8")
+
+
+def _calc_chain(entries: str) -> bytes:
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<calcChain xmlns="{MAIN_NS}">{entries}</calcChain>'.encode("utf-8")
+
+
+def _sheet(formula_refs, changes=None) -> TargetSheet:
+    cells = SheetCells(
+        "xl/worksheets/sheet2.xml",
+        {_parse_cell_ref(ref): SheetCell("=1", 1) for ref in formula_refs},
+        max_row=20,
+    )
+    sheet = TargetSheet(None, None, cells, SHEET_NAME)
+    for ref, value in (changes or {}).items():
+        sheet.set_value(*_parse_cell_ref(ref), value)
+    return sheet
+
+
+def _entries(calc_chain_xml: bytes) -> list[dict]:
+    return [dict(entry.attrib) for entry in ET.fromstring(calc_chain_xml)]
+
+
+def test_entry_without_sheet_id_inherits_the_previous_one():
+    chain = _calc_chain('<c r="A1" i="1"/><c r="B1"/><c r="A1" i="3"/><c r="B2"/>')
+    result = rebuild_calc_chain(chain, WORKBOOK_XML, _sheet(["A1", "B2"]))
+    # B1 は sheetId 1 の項目なので、対象シートに B1 の数式が無くても残す
+    assert _entries(result) == [
+        {"r": "A1", "i": "1"},
+        {"r": "B1", "i": "1"},
+        {"r": "A1", "i": "3"},
+        {"r": "B2", "i": "3"},
+    ]
+
+
+def test_new_level_flag_moves_to_the_next_kept_entry():
+    chain = _calc_chain('<c r="A1" i="3" l="1"/><c r="A2" i="3"/><c r="A3" i="3"/>')
+    result = rebuild_calc_chain(chain, WORKBOOK_XML, _sheet(["A1", "A2", "A3"], {"A1": "値"}))
+    assert _entries(result) == [{"r": "A2", "i": "3", "l": "1"}, {"r": "A3", "i": "3"}]
+
+
+def test_duplicate_entries_are_removed():
+    chain = _calc_chain('<c r="A1" i="3"/><c r="A1" i="3"/><c r="A1" i="1"/>')
+    result = rebuild_calc_chain(chain, WORKBOOK_XML, _sheet(["A1"]))
+    assert _entries(result) == [{"r": "A1", "i": "3"}, {"r": "A1", "i": "1"}]
+
+
+def test_array_flag_is_cleared_for_cells_rewritten_as_plain_formulas():
+    chain = _calc_chain('<c r="B11" i="3" a="1"/><c r="B12" i="3" a="1"/>')
+    sheet = _sheet(["B11", "B12"], {"B11": "=SUM(A1:A3)", "C1": ArrayFormula("C1", "=SUM(A1:A3*2)"), "D1": "=A1"})
+    result = rebuild_calc_chain(chain, WORKBOOK_XML, sheet)
+    # 書き換えていない B12 は配列数式のまま。新しい数式セルは行・列順に末尾へ足す
+    assert _entries(result) == [
+        {"r": "B11", "i": "3"},
+        {"r": "B12", "i": "3", "a": "1"},
+        {"r": "C1", "i": "3", "a": "1"},
+        {"r": "D1", "i": "3"},
+    ]
+
+
+def test_returns_none_when_no_entry_is_left():
+    chain = _calc_chain('<c r="A1" i="3"/><c r="A2"/>')
+    assert rebuild_calc_chain(chain, WORKBOOK_XML, _sheet(["A1", "A2"], {"A1": 1, "A2": ""})) is None
+
+
+def test_unknown_sheet_is_an_error():
+    sheet = _sheet(["A1"])
+    sheet.sheet_name = "無いシート"
+    with pytest.raises(ValueError):
+        rebuild_calc_chain(_calc_chain('<c r="A1" i="3"/>'), WORKBOOK_XML, sheet)
+
+
+def _save(tmp_path, calc_chain: str, changes: dict):
+    source_path = build_xlsx(
+        tmp_path / "source.xlsx",
+        {SHEET_NAME: rows_xml({"A1": "=1+1", "A2": 5})},
+        calc_chain=calc_chain,
+    )
+    sheet = load_sheet(source_path, SHEET_NAME)
+    for ref, value in changes.items():
+        sheet.set_value(*_parse_cell_ref(ref), value)
+    out_path = _save_preserving_package_parts(source_path, str(tmp_path / "out.xlsx"), sheet)
+    return zipfile.ZipFile(out_path)
+
+
+def test_saving_drops_the_calc_chain_part_and_its_references_when_empty(tmp_path):
+    with _save(tmp_path, '<c r="A1" i="1"/>', {"A1": "値"}) as out_zip:
+        assert CALC_CHAIN_PATH not in out_zip.namelist()
+        assert b"calcChain" not in out_zip.read(CONTENT_TYPES_PATH)
+        assert b"calcChain" not in out_zip.read(WORKBOOK_RELS_PATH)
+        assert out_zip.testzip() is None
+
+
+def test_saving_rewrites_the_calc_chain_and_keeps_its_references(tmp_path):
+    with _save(tmp_path, '<c r="A1" i="1"/>', {"B2": "=A2*2"}) as out_zip:
+        assert _entries(out_zip.read(CALC_CHAIN_PATH)) == [{"r": "A1", "i": "1"}, {"r": "B2", "i": "1"}]
+        assert f"/{CALC_CHAIN_PATH}".encode() in out_zip.read(CONTENT_TYPES_PATH)
+        assert b"calcChain" in out_zip.read(WORKBOOK_RELS_PATH)
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+from openpyxl.worksheet.formula import ArrayFormula
+
+from flag_auto_generator_app.app_cache import CACHE_DIR_ENV
+from flag_auto_generator_app.excel_ops import (
+    MeasurementNotRequiredError,
+    _normalize_single_cell_array_formulas_in_column,
+    build_request_formulas,
+    generate_inspection_sheet,
+)
+from flag_auto_generator_app.progress import CancelToken, GenerationCancelled
+from flag_auto_generator_app.sheet_editor import TargetSheet
+from flag_auto_generator_app.xlsx_package import SheetCells, read_sheet_tree
+
+from xlsx_builder import build_xlsx, rows_xml
+
+
+SHEET_NAME = "工程内検査シート"
+CFG = {
+    "sheet_name": SHEET_NAME,
+    "measure_row_min": 11,
+    "measure_row_max": 16,
+    "not_required_row": 17,
+    "tool_start_row": 20,
+    "auto_data_start_row": 26,
+    "tools": ["ノギス"],
+    "tool_to_measure_nos": {"ノギス": [1]},
+}
+
+
+def test_single_cell_array_formulas_become_plain_formulas():
+    sheet = TargetSheet(None, None, SheetCells("xl/worksheets/sheet1.xml", {}, 20), "工程内検査シート")
+    sheet.set_value(11, 2, ArrayFormula("B11", "=SUM(C11:D11)"))
+    sheet.set_value(12, 2, ArrayFormula("$B$12", "SUM(C12:D12)"))
+    sheet.set_value(13, 2, ArrayFormula("B13:B14", "=C13:C14"))
+    sheet.set_value(15, 2, ArrayFormula("B16", "=C15"))
+    sheet.set_value(18, 2, ArrayFormula("B18", "=C18"))
+
+    rewritten = _normalize_single_cell_array_formulas_in_column(sheet, "B", row_start=11, row_end=17)
+
+    assert rewritten == {(11, 2), (12, 2)}
+    assert sheet.value(11, 2) == "=SUM(C11:D11)"
+    assert sheet.value(12, 2) == "=SUM(C12:D12)"
+    # 複数セルの配列数式・ref が別セルのもの・範囲外の行はそのまま
+    assert isinstance(sheet.value(13, 2), ArrayFormula)
+    assert isinstance(sheet.value(15, 2), ArrayFormula)
+    assert isinstance(sheet.value(18, 2), ArrayFormula)
+
+
+@pytest.fixture
+def template_path(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "cache"))
+    rows = rows_xml({"A11": 1, "A14": 2, "B11": "外径", "B14": "全長"})
+    return build_xlsx(tmp_path / "template.xlsx", {SHEET_NAME: rows})
+
+
+def _cell_contents(path) -> dict:
+    cells = read_sheet_tree(str(path), SHEET_NAME)[2].cells
+    return {position: (cell.formula, cell.value) for position, cell in cells.items()}
+
+
+def test_not_required_is_written_with_the_request_formulas(tmp_path, template_path):
+    saved_path = generate_inspection_sheet(template_path, str(tmp_path / "out.xlsx"), CFG, not_required_nos=[2])
+    contents = _cell_contents(saved_path)
+    assert contents[(17, 5)] == (None, "測定不要")
+    assert "L17" in contents[(14, 12)][0]
+    assert contents[(11, 12)][0] == '=IF(OR(L$20<>""),"依頼","")'
+
+
+def test_failed_not_required_keeps_only_the_request_formulas(tmp_path, template_path):
+    out_path = str(tmp_path / "out.xlsx")
+    with pytest.raises(MeasurementNotRequiredError) as excinfo:
+        generate_inspection_sheet(template_path, out_path, CFG, not_required_nos=[99])
+
+    assert excinfo.value.saved_path == out_path
+    assert isinstance(excinfo.value.__cause__, ValueError)
+    request_only = build_request_formulas(template_path, str(tmp_path / "request_only.xlsx"), CFG)
+    assert _cell_contents(out_path) == _cell_contents(request_only)
+    assert sorted(os.listdir(tmp_path)) == ["cache", "out.xlsx", "request_only.xlsx", "template.xlsx"]
+
+
+def _cancel_at(phase_name: str):
+    token = CancelToken()
+
+    def on_progress(progress):
+        if progress.phase == phase_name:
+            token.cancel()
+
+    return token, on_progress
+
+
+# formula_grid で取り消すと測定不要の書き込みの入口で、merge で取り消すと ZIP の書き出しの入口で止まる
+@pytest.mark.parametrize("phase_name", ["formula_grid", "merge"])
+def test_cancel_leaves_no_output(tmp_path, template_path, phase_name):
+    out_path = tmp_path / "out.xlsx"
+    out_path.write_bytes(b"previous output")
+    token, on_progress = _cancel_at(phase_name)
+    with pytest.raises(GenerationCancelled):
+        generate_inspection_sheet(
+            template_path, str(out_path), CFG, not_required_nos=[2], on_progress=on_progress, cancel_token=token
+        )
+    assert out_path.read_bytes() == b"previous output"
+    assert sorted(os.listdir(tmp_path)) == ["cache", "out.xlsx", "template.xlsx"]
+
+
+def test_cancel_after_writing_started_is_ignored(tmp_path, template_path):
+    token, on_progress = _cancel_at("zip_write")
+    saved_path = generate_inspection_sheet(
+        template_path,
+        str(tmp_path / "out.xlsx"),
+        CFG,
+        not_required_nos=[2],
+        on_progress=on_progress,
+        cancel_token=token,
+    )
+    assert _cell_contents(saved_path)[(17, 5)] == (None, "測定不要")
@@ -0,0 +1,201 @@
+import pytest
+
+from flag_auto_generator_app.formula_eval import (
+    DIV0_ERROR,
+    NUM_ERROR,
+    VALUE_ERROR,
+    ExcelError,
+    FormulaEvaluator,
+    UnsupportedFormula,
+    formula_references,
+    formula_references_at,
+    parse_formula,
+)
+from flag_auto_generator_app.xlsx_package import _parse_cell_ref
+
+
+NA_ERROR = ExcelError("#N/A")
+
+
+def evaluate(formula: str, cells: dict | None = None, at: str = "Z100"):
+    """cells（{"A1": 値}）を参照先として、at のセルにある formula を評価する。"""
+    values = {_parse_cell_ref(ref): value for ref, value in (cells or {}).items()}
+    row, col = _parse_cell_ref(at)
+    evaluator = FormulaEvaluator(lambda r, c: values.get((r, c)))
+    return evaluator.scalar(parse_formula(formula.lstrip("="), col), row, col)
+
+
+@pytest.mark.parametrize(
+    "formula, cells, expected",
+    [
+        ('IF(A1>1,"大","小")', {"A1": 2}, "大"),
+        ('IF(A1>1,"大","小")', {}, "小"),
+        ("IF(A1,1)", {"A1": 0}, False),
+        ('IF("x",1,2)', {}, VALUE_ERROR),
+        ('IF(A1="","",A1&"本")', {"A1": 3}, "3本"),
+        ('OR(A1="",B1>0)', {"A1": "a", "B1": 0}, False),
+        ('OR(A1="",B1>0)', {"A1": "a", "B1": 1}, True),
+        ("OR(A1:A3)", {"A1": "文字", "A3": 1}, True),
+        ("OR(A1:A3)", {"A1": "文字"}, VALUE_ERROR),
+        ("AND(TRUE,A1:A3)", {"A1": 1, "A2": "文字"}, True),
+        ("AND(A1,B1)", {"A1": 1, "B1": 0}, False),
+        ("NOT(A1)", {"A1": 0}, True),
+        ("NOT(A1)", {}, True),
+        ('IFERROR(1/0,"x")', {}, "x"),
+        ('IFERROR(A1,"x")', {"A1": NA_ERROR}, "x"),
+        ("IFERROR(A1,0)", {"A1": 5}, 5),
+        ("MOD(7,3)", {}, 1),
+        ("MOD(-7,3)", {}, 2),
+        ("MOD(7,-3)", {}, -2),
+        ("MOD(1,0)", {}, DIV0_ERROR),
+        ("ROW()", {}, 100),
+        ("ROW(L11)", {}, 11),
+        ('LEN(TRIM("  a  b "))', {}, 3),
+    ],
+)
+def test_functions(formula, cells, expected):
+    result = evaluate(formula, cells)
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+def test_sumproduct_counts_every_third_non_blank_row():
+    # 先頭集計式と同じ形。11・14・17 行目のうち空でない行を数える（0 は空ではない）
+    formula = 'SUMPRODUCT(--(L11:L19<>""),--(MOD(ROW(L11:L19)-ROW(L11),3)=0))'
+    cells = {"L11": "a", "L12": "b", "L14": "", "L17": 0, "L18": "c"}
+    assert evaluate(formula, cells, at="L1") == 2
+
+
+def test_sumproduct_multiplies_ranges_and_treats_text_as_zero():
+    cells = {"A1": 1, "A2": 2, "A3": "文字", "B1": 3, "B2": 4, "B3": 5}
+    assert evaluate("SUMPRODUCT(A1:A3,B1:B3)", cells) == 11
+    assert evaluate("SUMPRODUCT(A1:A3,B1:B2)", cells) == VALUE_ERROR
+
+
+def test_relative_references_follow_the_formula_column():
+    cells = {"L11": 1, "M11": 2}
+    assert evaluate("L11*10", cells, at="L10") == 10
+    # 同じ形の式は構文木を共有するため、列を変えて評価しても参照先がずれることを確かめる
+    assert evaluate("M11*10", cells, at="M10") == 20
+    assert evaluate("$L11*10", cells, at="M10") == 10
+
+
+@pytest.mark.parametrize(
+    "formula, cells, expected",
+    [
+        ('A1=""', {}, True),
+        ("A1=0", {}, True),
+        ("A1=FALSE", {}, True),
+        ('A1<>""', {}, False),
+        ('A1=""', {"A1": ""}, True),
+        ("A1=0", {"A1": ""}, False),
+        ('A1=""', {"A1": 0}, False),
+        ('A1&""=""', {}, True),
+        ('A1="ABC"', {"A1": "abc"}, True),
+        ('A1>"0"', {"A1": 5}, False),
+    ],
+)
+def test_comparisons_with_blanks(formula, cells, expected):
+    assert evaluate(formula, cells) is expected
+
+
+@pytest.mark.parametrize(
+    "formula",
+    [
+        "A1+1",
+        'A1&"x"',
+        "IF(A1,1,2)",
+        "LEN(A1)",
+        'A1=""',
+        "OR(A1,TRUE)",
+        "NOT(A1)",
+        "MOD(A1,3)",
+        "SUMPRODUCT(--(A1:A2<>\"\"))",
+        '-A1',
+    ],
+)
+def test_errors_propagate(formula):
+    assert evaluate(formula, {"A1": NA_ERROR, "A2": 1}) == NA_ERROR
+
+
+def test_division_by_zero_is_an_error_value():
+    assert evaluate("A1/A2", {"A1": 1}) == DIV0_ERROR
+    assert evaluate('"x"+1') == VALUE_ERROR
+
+
+@pytest.mark.parametrize(
+    "formula, expected",
+    [
+        ("2^3", 8),
+        ("4^0.5", 2),
+        ("(-8)^(1/3)", NUM_ERROR),
+        ("(-2)^3", -8),
+        ("0^-1", DIV0_ERROR),
+        ("0^0", NUM_ERROR),
+        ("10^400", NUM_ERROR),
+    ],
+)
+def test_power_follows_excel(formula, expected):
+    assert evaluate(formula) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (" 12 ", 13),
+        ("1.5", 2.5),
+        ("-1e2", -99.0),
+        (".5", 1.5),
+        ("inf", VALUE_ERROR),
+        ("-Infinity", VALUE_ERROR),
+        ("nan", VALUE_ERROR),
+        ("1_000", VALUE_ERROR),
+        ("1e999", VALUE_ERROR),
+        ("", VALUE_ERROR),
+    ],
+)
+def test_numeric_text_follows_excel(text, expected):
+    assert evaluate("A1+1", {"A1": text}) == expected
+
+
+@pytest.mark.parametrize(
+    "formula",
+    [
+        "VLOOKUP(A1,B1:C3,2,FALSE)",
+        "SUM(A1:A3)",
+        "名前付き範囲+1",
+        "IF(A1,,1)",
+        "A1:A3",
+    ],
+)
+def test_unsupported_formulas_raise(formula):
+    with pytest.raises(UnsupportedFormula):
+        evaluate(formula, {"A1": 1})
+
+
+def test_formula_references_with_sheet_prefix_and_absolute_refs():
+    references = formula_references("'他 シート'!$A$1:B3+Sheet2!C5+$D$7+E:E+'It''s'!F$2")
+    assert references == [
+        ("他 シート", 1, 1, 3, 2),
+        ("Sheet2", 5, 3, 5, 3),
+        (None, 7, 4, 7, 4),
+        (None, 1, 5, 1048576, 5),
+        ("It's", 2, 6, 2, 6),
+    ]
+
+
+def test_formula_references_that_cannot_be_resolved():
+    assert formula_references("OFFSET(A1,1,1)") is None
+    assert formula_references("名前付き範囲*2") is None
+    assert formula_references('INDIRECT(A1&"!B2")') is None
+    assert formula_references("INDIRECT(\"'検査'!B2\")") == [("検査", 1, 1, 1048576, 16384)]
+
+
+def test_formula_references_at_shifts_only_relative_columns():
+    formula = 'IF(L$12<>"",$B11&L11,"")'
+    assert formula_references_at(formula, 12) == formula_references(formula)
+    assert formula_references_at('IF(N$12<>"",$B11&N11,"")', 14) == [
+        (None, 12, 14, 12, 14),
+        (None, 11, 2, 11, 2),
+        (None, 11, 14, 11, 14),
+    ]
@@ -0,0 +1,179 @@
+import copy
+import json
+import shutil
+
+import pytest
+from openpyxl.worksheet.formula import ArrayFormula
+
+from benchmarks.synthetic_template import SHEET_NAME, TemplateSpec, build_synthetic_template, synthetic_cfg
+from flag_auto_generator_app import incremental
+from flag_auto_generator_app.app_cache import CACHE_DIR_ENV
+from flag_auto_generator_app.incremental import (
+    _diff_changes,
+    _record_path,
+    _stale_generated_formulas,
+    generate_with_record,
+    regenerate_incrementally,
+)
+from flag_auto_generator_app.xlsx_package import SheetCell, SheetCells, _parse_cell_ref, read_sheet_tree
+
+
+# 測定 No の入れ替えが起きる最小限の規模
+SPEC = TemplateSpec(measure_count=8, tool_count=2, auto_data_count=2, not_required_count=1)
+
+
+@pytest.fixture(autouse=True)
+def cache_root(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "cache"))
+
+
+@pytest.fixture(scope="module")
+def template_path(tmp_path_factory):
+    return build_synthetic_template(str(tmp_path_factory.mktemp("template") / "template.xlsx"), SPEC)
+
+
+@pytest.fixture
+def source_path(tmp_path, template_path):
+    # 元ブックを書き換えるテストがあるため、テストごとに複写する
+    return shutil.copyfile(template_path, tmp_path / "source.xlsx")
+
+
+def _moved_measure_cfg() -> dict:
+    """工具1 の測定 No を 1 件入れ替えた cfg。"""
+    cfg = copy.deepcopy(synthetic_cfg(SPEC))
+    measure_nos = cfg["tool_to_measure_nos"]["工具1"]
+    moved_no = next(no for no in range(1, SPEC.measure_count + 1) if no not in measure_nos)
+    cfg["tool_to_measure_nos"]["工具1"] = [no for no in measure_nos if no != measure_nos[-1]] + [moved_no]
+    return cfg
+
+
+def _generate_previous(source_path, out_path) -> str:
+    return generate_with_record(str(source_path), str(out_path), synthetic_cfg(SPEC), [], incremental=False).saved_path
+
+
+def _cell_contents(path) -> dict:
+    cells = read_sheet_tree(str(path), SHEET_NAME)[2].cells
+    return {position: (cell.formula, cell.value) for position, cell in cells.items()}
+
+
+def test_changed_measure_no_gives_the_same_output_as_a_full_run(tmp_path, source_path):
+    out_path = tmp_path / "out.xlsx"
+    _generate_previous(source_path, out_path)
+    cfg = _moved_measure_cfg()
+
+    outcome = generate_with_record(str(source_path), str(out_path), cfg, [])
+    assert outcome.patched_cells
+    full = generate_with_record(str(source_path), str(tmp_path / "full.xlsx"), cfg, [], incremental=False)
+    assert full.patched_cells is None
+    assert _cell_contents(outcome.saved_path) == _cell_contents(full.saved_path)
+
+    # 記録も更新されるため、同じ設定での再生成は書き換えなしで終わる
+    assert generate_with_record(str(source_path), str(out_path), cfg, []).patched_cells == 0
+
+
+def _edit_record(out_path, **fields):
+    record_path = _record_path(str(out_path))
+    with open(record_path, encoding="utf-8") as f:
+        record = json.load(f)
+    record.update(fields)
+    with open(record_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+
+
+def _append_byte(path):
+    with open(path, "ab") as f:
+        f.write(b"\0")
+
+
+def _invalidations(source_path, out_path, monkeypatch):
+    return {
+        "record-version": lambda: _edit_record(out_path, record_version=0),
+        "tool-version": lambda: _edit_record(out_path, tool_version="0000.00.00"),
+        "running-tool-version": lambda: monkeypatch.setattr(incremental, "__version__", "9999.99.99"),
+        "output-hash": lambda: _append_byte(out_path),
+        "source-hash": lambda: _append_byte(source_path),
+        "sheet": lambda: _edit_record(out_path, cfg={**synthetic_cfg(SPEC), "sheet_name": "別のシート"}),
+    }
+
+
+@pytest.mark.parametrize(
+    "invalidation",
+    ["record-version", "tool-version", "running-tool-version", "output-hash", "source-hash", "sheet"],
+)
+def test_refuses_when_the_previous_output_cannot_be_trusted(tmp_path, source_path, monkeypatch, invalidation):
+    out_path = tmp_path / "out.xlsx"
+    _generate_previous(source_path, out_path)
+    _invalidations(source_path, out_path, monkeypatch)[invalidation]()
+    assert regenerate_incrementally(str(source_path), str(out_path), _moved_measure_cfg(), []) is None
+
+
+def test_refuses_without_a_record_or_previous_output(tmp_path, source_path):
+    out_path = tmp_path / "out.xlsx"
+    assert regenerate_incrementally(str(source_path), str(out_path), _moved_measure_cfg(), []) is None
+    _generate_previous(source_path, out_path)
+    out_path.unlink()
+    assert regenerate_incrementally(str(source_path), str(out_path), _moved_measure_cfg(), []) is None
+
+
+def test_accepts_an_untouched_previous_output(tmp_path, source_path):
+    out_path = tmp_path / "out.xlsx"
+    _generate_previous(source_path, out_path)
+    assert regenerate_incrementally(str(source_path), str(out_path), _moved_measure_cfg(), []).patched_cells
+
+
+def _template(cells: dict) -> SheetCells:
+    template_cells = _at_positions({ref: SheetCell(None, value) for ref, value in cells.items()})
+    return SheetCells("xl/worksheets/sheet1.xml", template_cells, 20)
+
+
+def _at_positions(values: dict) -> dict:
+    return {_parse_cell_ref(ref): value for ref, value in values.items()}
+
+
+def _positions(*refs):
+    return {_parse_cell_ref(ref) for ref in refs}
+
+
+def test_diff_keeps_only_cells_whose_value_changes():
+    cells = _template({"A1": "元", "B1": "元"})
+    old = _at_positions({"A1": "旧", "C1": "=1"})
+    new = _at_positions({"A1": "元", "B1": "元", "C1": "=1", "D1": 5})
+    # A1 は旧設定でだけ書き換えていたのでテンプレートの値に戻す。B1・C1 は前回と同じ
+    assert _diff_changes(cells, SHEET_NAME, old, new) == _at_positions({"A1": "元", "D1": 5})
+
+
+@pytest.mark.parametrize(
+    "old, new",
+    [
+        pytest.param({"A1": ArrayFormula("A1", "=SUM(B1:B3)")}, {"A1": "=SUM(B1:B3)"}, id="from-array"),
+        pytest.param({"A1": "=SUM(B1:B3)"}, {"A1": ArrayFormula("A1", "=SUM(B1:B3)")}, id="to-array"),
+        pytest.param({}, {"A1": ArrayFormula("A1", "=SUM(B1:B3)"), "C1": 1}, id="new-array"),
+    ],
+)
+def test_diff_falls_back_when_an_array_formula_is_involved(old, new):
+    cells = _template({"A1": "=SUM(B1:B3)"})
+    assert _diff_changes(cells, SHEET_NAME, _at_positions(old), _at_positions(new)) is None
+
+
+def test_stale_formulas_include_indirect_dependents():
+    new_changes = _at_positions({
+        "A1": 10,
+        "B1": "=A1*2",
+        "C1": "=SUM(B1:B3)+1",
+        "D1": "=C1",
+        "E1": "=Z9",
+        "F1": "=集計!A1",
+        "G1": f"='{SHEET_NAME}'!D1",
+        "H1": "=OFFSET(Z9,1,1)",
+        "I1": "固定の値",
+    })
+    patch = _at_positions({"A1": 10})
+    stale = _stale_generated_formulas(SHEET_NAME, new_changes, patch)
+    # 他シートの同じ番地（F1）や無関係な参照（E1）は対象外。参照先を特定できない式（H1）は含める
+    assert stale == _positions("B1", "C1", "D1", "G1", "H1")
+
+
+def test_patched_formulas_are_not_reported_as_stale():
+    new_changes = _at_positions({"A1": "=B1", "B1": "=A2"})
+    patch = _at_positions({"A1": "=B1", "A2": 1})
+    assert _stale_generated_formulas(SHEET_NAME, new_changes, patch) == _positions("B1")
@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+from flag_auto_generator_app.jobs import BatchJob, load_job_file
+
+
+CFG = {"sheet_name": "工程内検査シート", "tools": ["前挽き"], "tool_to_measure_nos": {"前挽き": [1, 2]}}
+
+
+def _write_job_file(tmp_path, data, name="jobs/jobs.json") -> str:
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def test_paths_are_resolved_against_the_job_file_folder(tmp_path):
+    absolute_out = str(tmp_path / "absolute" / "out.xlsx")
+    path = _write_job_file(tmp_path, {"source": "templates/原紙.xlsx", "out": "../out/a.xlsx", "cfg": CFG})
+    [job] = load_job_file(path)
+    assert job.source == os.path.normpath(str(tmp_path / "jobs" / "templates" / "原紙.xlsx"))
+    assert job.out == os.path.normpath(str(tmp_path / "out" / "a.xlsx"))
+
+    path = _write_job_file(tmp_path, [{"source": "a.xlsx", "out": absolute_out, "cfg": CFG}])
+    assert load_job_file(path)[0].out == os.path.normpath(absolute_out)
+
+
+def test_jobs_inherit_and_override_the_common_settings(tmp_path):
+    other_cfg = {**CFG, "tools": ["仕上げ"], "tool_to_measure_nos": {"仕上げ": "3, 4、5"}}
+    path = _write_job_file(
+        tmp_path,
+        {
+            "cfg": CFG,
+            "not_required_nos": "7,8",
+            "mode": "not_required",
+            "jobs": [
+                {"source": "a.xlsx", "out": "a_out.xlsx"},
+                {"source": "b.xlsx", "out": "b_out.xlsx", "cfg": other_cfg, "not_required_nos": [9], "name": "b"},
+                {"source": "c.xlsx", "out": "c_out.xlsx", "mode": "generate", "not_required_nos": []},
+            ],
+        },
+    )
+    first, second, third = load_job_file(path)
+    base_dir = str(tmp_path / "jobs")
+    a_source, a_out = os.path.join(base_dir, "a.xlsx"), os.path.join(base_dir, "a_out.xlsx")
+    assert first == BatchJob(a_source, a_out, CFG, [7, 8], "not_required", "jobs.json#1")
+    assert second.cfg == {**other_cfg, "tool_to_measure_nos": {"仕上げ": [3, 4, 5]}}
+    assert (second.not_required_nos, second.mode, second.name) == ([9], "not_required", "b")
+    # 空で書いたジョブは共通設定の測定不要 No を使わない
+    assert (third.not_required_nos, third.mode) == ([], "generate")
+
+
+@pytest.mark.parametrize(
+    "not_required_nos",
+    [[1, "2"], [True], [1.5], {"1": 1}, "1,x", 3],
+)
+def test_bad_not_required_nos_are_rejected(tmp_path, not_required_nos):
+    entry = {"source": "a.xlsx", "out": "b.xlsx", "cfg": CFG, "not_required_nos": not_required_nos}
+    path = _write_job_file(tmp_path, entry)
+    with pytest.raises(ValueError):
+        load_job_file(path)
+
+
+@pytest.mark.parametrize(
+    "entry, message",
+    [
+        ({"cfg": {**CFG, "tool_to_measure_nos": {"前挽き": [1, "x"]}}}, "tool_to_measure_nos[前挽き]"),
+        ({"cfg": {**CFG, "tool_to_measure_nos": [1, 2]}}, "tool_to_measure_nos"),
+        ({"cfg": {**CFG, "tools": []}}, "工具"),
+        ({"cfg": {"sheet_name": "工程内検査シート"}}, "tools, tool_to_measure_nos"),
+        ({"cfg": CFG, "mode": "not_required"}, "not_required_nos"),
+        ({"cfg": CFG, "mode": "preview"}, "mode"),
+        ({"cfg": CFG, "out": " "}, "out"),
+    ],
+)
+def test_invalid_jobs_name_the_job_and_field(tmp_path, entry, message):
+    path = _write_job_file(tmp_path, [{"source": "a.xlsx", "out": "b.xlsx", **entry}])
+    with pytest.raises(ValueError) as excinfo:
+        load_job_file(path)
+    assert str(excinfo.value).startswith("jobs.json#1: ")
+    assert message in str(excinfo.value)
+
+
+@pytest.mark.parametrize("data", [[], {"jobs": []}, {"jobs": {"source": "a.xlsx"}}, "a.xlsx"])
+def test_job_file_without_jobs_is_rejected(tmp_path, data):
+    with pytest.raises(ValueError):
+        load_job_file(_write_job_file(tmp_path, data))
+
+
+def test_broken_json_reports_the_line(tmp_path):
+    path = tmp_path / "jobs.json"
+    path.write_text('{\n"source": "a.xlsx",\n}', encoding="utf-8")
+    with pytest.raises(ValueError, match="3行目"):
+        load_job_file(str(path))
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from flag_auto_generator_app import preview_reader
+from flag_auto_generator_app.preview_reader import SheetPreview, read_sheet_preview
+
+from xlsx_builder import build_xlsx, rows_xml
+
+
+SHEET_NAME = "工程内検査シート"
+COLUMNS = ("A", "B", "G", "K")
+HEADER_CELLS = {"A10": "№", "B10": "測定項目", "G10": "寸法", "K10": "中央値"}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(preview_reader, "_preview_cache", {})
+
+
+def _build(tmp_path, cells: dict, name="template.xlsx") -> str:
+    return build_xlsx(tmp_path / name, {SHEET_NAME: rows_xml({**HEADER_CELLS, **cells})})
+
+
+def test_reads_every_third_row_until_column_a_is_blank(tmp_path):
+    path = _build(
+        tmp_path,
+        {
+            "A1": "表題",
+            "A11": 1, "B11": "外径", "G11": 12.5, "K11": "±0.1",
+            "A12": "無視", "B13": "無視",
+            "A14": 2, "B14": "全長",
+            "A17": "3",
+            # A 列が空の行で終わる（B 列に値があっても読まない）
+            "B20": "備考",
+            "A23": 4,
+        },
+    )
+    assert read_sheet_preview(path, SHEET_NAME, COLUMNS) == SheetPreview(
+        ["№", "測定項目", "寸法", "中央値"],
+        [["1", "外径", "12.5", "±0.1"], ["2", "全長", "", ""], ["3", "", "", ""]],
+    )
+
+
+def test_whitespace_in_column_a_counts_as_blank(tmp_path):
+    path = _build(tmp_path, {"A11": 1, "A14": "  ", "A17": 3})
+    assert read_sheet_preview(path, SHEET_NAME, COLUMNS).rows == [["1", "", "", ""]]
+
+
+def test_missing_row_element_ends_the_preview(tmp_path):
+    # 14 行目の <row> が無い
+    path = _build(tmp_path, {"A11": 1, "A16": "x", "A17": 3})
+    assert read_sheet_preview(path, SHEET_NAME, COLUMNS).rows == [["1", "", "", ""]]
+
+
+def test_missing_header_row_gives_empty_headings(tmp_path):
+    path = build_xlsx(tmp_path / "template.xlsx", {SHEET_NAME: rows_xml({"A11": 1})})
+    assert read_sheet_preview(path, SHEET_NAME, ("A", "B")) == SheetPreview(["", ""], [["1", ""]])
+
+
+def test_cache_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    reads = []
+    real_read_preview = preview_reader._read_preview
+    monkeypatch.setattr(
+        preview_reader,
+        "_read_preview",
+        lambda *args: reads.append(args) or real_read_preview(*args),
+    )
+    path = _build(tmp_path, {"A11": 1})
+    first = read_sheet_preview(path, SHEET_NAME, COLUMNS)
+    assert read_sheet_preview(path, SHEET_NAME, COLUMNS) is first
+    assert len(reads) == 1
+    # 列が違えば別に読む
+    read_sheet_preview(path, SHEET_NAME, ("A",))
+    assert len(reads) == 2
+
+    stat = os.stat(path)
+    # 更新時刻を戻してもサイズが変われば読み直す
+    _build(tmp_path, {"A11": 1, "A14": 2})
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert len(read_sheet_preview(path, SHEET_NAME, COLUMNS).rows) == 2
+    assert len(reads) == 3
+
+    # サイズが同じでも更新時刻が変われば読み直す
+    size = os.stat(path).st_size
+    _build(tmp_path, {"A11": 9, "A14": 8})
+    assert os.stat(path).st_size == size
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert read_sheet_preview(path, SHEET_NAME, COLUMNS).rows[0][0] == "9"
+    assert len(reads) == 4
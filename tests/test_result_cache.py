@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from flag_auto_generator_app import result_cache
+from flag_auto_generator_app.app_cache import CACHE_DIR_ENV, prune_cache
+from flag_auto_generator_app.excel_ops import FORCE_EXCEL_RECALC_ENV
+from flag_auto_generator_app.result_cache import restore_cached_result, result_key, store_result
+
+
+CFG = {"tools": ["ノギス", "マイクロメータ"], "tool_to_measure_nos": {"ノギス": [1, 2], "マイクロメータ": [3]}}
+
+
+@pytest.fixture(autouse=True)
+def cache_root(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / "cache"))
+    monkeypatch.delenv(FORCE_EXCEL_RECALC_ENV, raising=False)
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.xlsx"
+    path.write_bytes(b"source workbook")
+    return str(path)
+
+
+def _key(source, cfg=CFG, not_required_nos=(4,), mode="generate"):
+    return result_key(source, cfg, list(not_required_nos), mode)
+
+
+def test_key_is_stable_for_the_same_inputs(source):
+    reordered = {key: CFG[key] for key in reversed(list(CFG))}
+    assert _key(source) == _key(source) == _key(source, cfg=reordered)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        pytest.param(lambda source: _key(source, cfg={**CFG, "tools": ["ノギス"]}), id="cfg"),
+        pytest.param(lambda source: _key(source, cfg={**CFG, "tools": list(reversed(CFG["tools"]))}), id="tool-order"),
+        pytest.param(lambda source: _key(source, not_required_nos=(4, 5)), id="not-required-nos"),
+        pytest.param(lambda source: _key(source, mode="summary"), id="mode"),
+    ],
+)
+def test_key_changes_with_each_input(source, change):
+    assert change(source) != _key(source)
+
+
+def test_key_changes_with_source_bytes(source):
+    before = _key(source)
+    with open(source, "ab") as f:
+        f.write(b"!")
+    assert _key(source) != before
+
+
+def test_key_changes_with_tool_version(source, monkeypatch):
+    before = _key(source)
+    monkeypatch.setattr(result_cache, "__version__", "0000.00.00")
+    assert _key(source) != before
+
+
+def test_key_changes_with_excel_recalc(source, monkeypatch):
+    before = _key(source)
+    monkeypatch.setenv(FORCE_EXCEL_RECALC_ENV, "1")
+    assert _key(source) != before
+
+
+def test_hit_restores_identical_bytes(tmp_path, source):
+    generated = tmp_path / "generated.xlsx"
+    generated.write_bytes(os.urandom(4096))
+    key = _key(source)
+    assert restore_cached_result(key, str(tmp_path / "out.xlsx")) is None
+
+    store_result(key, str(generated))
+    saved_path = restore_cached_result(key, str(tmp_path / "out" / "out.xlsx"))
+    assert saved_path == str(tmp_path / "out" / "out.xlsx")
+    assert open(saved_path, "rb").read() == generated.read_bytes()
+    assert restore_cached_result(_key(source, mode="summary"), str(tmp_path / "other.xlsx")) is None
+
+
+def test_disabled_cache_stores_nothing(tmp_path, source, cache_root, monkeypatch):
+    monkeypatch.setenv("FLAG_AUTO_GENERATOR_DISABLE_CACHE", "1")
+    generated = tmp_path / "generated.xlsx"
+    generated.write_bytes(b"x")
+    store_result(_key(source), str(generated))
+    assert restore_cached_result(_key(source), str(tmp_path / "out.xlsx")) is None
+    assert not cache_root.exists()
+
+
+def _write(path, size, mtime):
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_prune_evicts_oldest_entries_first(tmp_path):
+    for name, mtime in (("newest", 3000), ("oldest", 1000), ("middle", 2000)):
+        _write(tmp_path / name, 100, mtime)
+    # 書き込み中の一時ファイルは数えず、消さない
+    _write(tmp_path / ".tmp_writing", 1000, 0)
+    prune_cache(str(tmp_path), 200)
+    assert sorted(os.listdir(tmp_path)) == [".tmp_writing", "middle", "newest"]
+    prune_cache(str(tmp_path), 100)
+    assert sorted(os.listdir(tmp_path)) == [".tmp_writing", "newest"]
+
+
+def test_store_keeps_recently_restored_results(tmp_path, source, cache_root, monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_BYTES", 250)
+    generated = tmp_path / "generated.xlsx"
+    generated.write_bytes(b"x" * 100)
+    keys = [_key(source, mode=f"mode-{i}") for i in range(3)]
+    store_result(keys[0], str(generated))
+    store_result(keys[1], str(generated))
+    results_dir = cache_root / "results"
+    os.utime(results_dir / f"{keys[0]}.xlsx", (1000, 1000))
+    os.utime(results_dir / f"{keys[1]}.xlsx", (2000, 2000))
+    # 復元したものは更新日時が進むため、古い keys[1] が先に消える
+    restore_cached_result(keys[0], str(tmp_path / "out.xlsx"))
+    store_result(keys[2], str(generated))
+    assert sorted(os.listdir(results_dir)) == sorted(f"{key}.xlsx" for key in (keys[0], keys[2]))
@@ -0,0 +1,196 @@
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import date
+
+import pytest
+from openpyxl.worksheet.formula import ArrayFormula
+
+from flag_auto_generator_app.formula_eval import ExcelError, translate_formula
+from flag_auto_generator_app.sheet_editor import _build_cell_element, _merge_sheet_cells, _plan_row_shared_formulas
+from flag_auto_generator_app.xlsx_package import NS, _parse_cell_ref, read_sheet_tree, write_package_with_replacements
+
+from xlsx_builder import build_xlsx, load_sheet
+
+
+SHEET_NAME = "工程内検査シート"
+
+
+def _children(cell) -> dict[str, ET.Element]:
+    return {child.tag.split("}")[1]: child for child in cell}
+
+
+@pytest.mark.parametrize("value, text", [(3, "3"), (2.5, "2.5"), (-1e-07, "-1e-07")])
+def test_number_is_written_as_value(value, text):
+    cell = _build_cell_element("B2", value, "4")
+    assert cell.attrib == {"r": "B2", "s": "4"}
+    assert _children(cell)["v"].text == text
+
+
+def test_bool_is_written_as_boolean():
+    cell = _build_cell_element("B2", True, None)
+    assert cell.get("t") == "b"
+    assert _children(cell)["v"].text == "1"
+
+
+def test_text_is_written_as_inline_string_and_keeps_spaces():
+    cell = _build_cell_element("C3", " 測定不要", None)
+    assert cell.get("t") == "inlineStr"
+    text_elem = cell.find("main:is/main:t", NS)
+    assert text_elem.text == " 測定不要"
+    assert text_elem.get("{http://www.w3.org/XML/1998/namespace}space") == "preserve"
+
+
+@pytest.mark.parametrize("value", ["", None])
+def test_empty_value_keeps_only_the_style(value):
+    cell = _build_cell_element("D4", value, "7")
+    assert cell.attrib == {"r": "D4", "s": "7"}
+    assert len(cell) == 0
+
+
+def test_formula_is_written_without_equals_and_with_cached_value():
+    cell = _build_cell_element("E5", '=IF(A1="","",1)', None, cached_value="")
+    children = _children(cell)
+    assert children["f"].text == 'IF(A1="","",1)'
+    assert children["f"].attrib == {}
+    assert cell.get("t") == "str"
+    assert children["v"].text == ""
+
+
+def test_formula_cached_error_and_integer_float():
+    error_cell = _build_cell_element("E5", "=1/0", None, cached_value=ExcelError("#DIV/0!"))
+    assert error_cell.get("t") == "e"
+    assert _children(error_cell)["v"].text == "#DIV/0!"
+    number_cell = _build_cell_element("E6", "=2*3", None, cached_value=6.0)
+    assert "t" not in number_cell.attrib
+    assert _children(number_cell)["v"].text == "6"
+
+
+def test_shared_formula_master_and_child():
+    master = _build_cell_element("L10", "=L11+1", None, ("3", "L10:N10"))
+    assert _children(master)["f"].attrib == {"t": "shared", "ref": "L10:N10", "si": "3"}
+    assert _children(master)["f"].text == "L11+1"
+    child = _build_cell_element("M10", "=M11+1", None, ("3", None))
+    assert _children(child)["f"].attrib == {"t": "shared", "si": "3"}
+    assert _children(child)["f"].text is None
+
+
+def test_array_formula_is_written_as_array_formula():
+    cell = _build_cell_element("B11", ArrayFormula("B11", "=SUM(A1:A3*2)"), None)
+    formula_elem = _children(cell)["f"]
+    assert formula_elem.attrib == {"t": "array", "ref": "B11"}
+    assert formula_elem.text == "SUM(A1:A3*2)"
+
+
+@pytest.mark.parametrize("value", [date(2026, 4, 1), object(), [1, 2]])
+def test_unsupported_value_raises_type_error(value):
+    with pytest.raises(TypeError):
+        _build_cell_element("A1", value, None)
+
+
+# 元シートの共有数式: 20 行目（si=0）・30 行目（si=5）・40 行目（si=2）
+EXISTING_SHARED_ROWS = (
+    '<row r="20"><c r="L20"><f t="shared" ref="L20:N20" si="0">L21*2</f></c>'
+    '<c r="M20"><f t="shared" si="0"/></c><c r="N20"><f t="shared" si="0"/></c></row>'
+    '<row r="30"><c r="L30"><f t="shared" ref="L30:M30" si="5">$A30+L31</f></c>'
+    '<c r="M30"><f t="shared" si="5"/></c></row>'
+    '<row r="40"><c r="L40"><f t="shared" ref="L40:N40" si="2">L41*3</f></c>'
+    '<c r="M40"><f t="shared" si="2"/></c><c r="N40"><f t="shared" si="2"/></c></row>'
+)
+
+
+def _merge_and_read_back(tmp_path, changes: dict, rows: str = EXISTING_SHARED_ROWS):
+    source_path = build_xlsx(tmp_path / "source.xlsx", {SHEET_NAME: rows})
+    sheet = load_sheet(source_path, SHEET_NAME)
+    for ref, value in changes.items():
+        sheet.set_value(*_parse_cell_ref(ref), value)
+    out_path = tmp_path / "out.xlsx"
+    with zipfile.ZipFile(source_path) as source_zip:
+        write_package_with_replacements(source_zip, str(out_path), {sheet.sheet_path: _merge_sheet_cells(sheet)})
+    return read_sheet_tree(str(out_path), SHEET_NAME)[2]
+
+
+def _request_formula(col_letter: str) -> str:
+    return f'=IF({col_letter}$12<>"",{col_letter}11&"/"&$B10&{col_letter}$1,"")'
+
+
+def test_column_copied_runs_are_written_as_shared_formulas(tmp_path):
+    changes = {f"{col}10": _request_formula(col) for col in "LMNOP"}
+    changes.update({"Q10": "=SUM(Q11:Q13)", "R10": "=SUM(R11:R13)", "T10": "=SUM(T11:T13)", "U10": "=COUNTA(U:U)"})
+    cells = _merge_and_read_back(tmp_path, changes)
+
+    for ref, formula in changes.items():
+        assert cells.formula(*_parse_cell_ref(ref)) == formula, ref
+
+    request_master = cells.get(10, 12)
+    assert (request_master.formula_type, request_master.formula_ref) == ("shared", "L10:P10")
+    assert {cells.get(10, col).shared_index for col in range(12, 17)} == {request_master.shared_index}
+    sum_master = cells.get(*_parse_cell_ref("Q10"))
+    assert (sum_master.formula_type, sum_master.formula_ref) == ("shared", "Q10:R10")
+    assert sum_master.shared_index != request_master.shared_index
+    # 1 セルだけの並びと、列全体参照を含む式は通常の数式のまま
+    assert cells.get(*_parse_cell_ref("T10")).formula_type is None
+    assert cells.get(*_parse_cell_ref("U10")).formula_type is None
+    # 新しい si は元シートの最大値（5）の次から振る
+    assert sorted(int(index) for index in (request_master.shared_index, sum_master.shared_index)) == [6, 7]
+
+
+def test_children_of_an_overwritten_master_are_expanded(tmp_path):
+    cells = _merge_and_read_back(tmp_path, {"L20": "上書き"})
+
+    assert cells.get(20, 12).formula is None
+    assert cells.value(20, 12) == "上書き"
+    for ref, formula in (("M20", "=M21*2"), ("N20", "=N21*2")):
+        cell = cells.get(*_parse_cell_ref(ref))
+        assert (cell.formula, cell.formula_type) == (formula, None)
+    # 上書きしていない共有数式はそのまま
+    assert cells.get(30, 13).formula == "=$A30+M31"
+    assert cells.get(30, 13).formula_type == "shared"
+
+
+def test_overwriting_a_child_keeps_the_rest_of_the_group(tmp_path):
+    cells = _merge_and_read_back(tmp_path, {"M40": 5})
+
+    assert cells.value(40, 13) == 5
+    assert cells.get(40, 13).formula is None
+    assert cells.get(40, 12).formula == "=L41*3"
+    assert cells.get(40, 14).formula == "=N41*3"
+    assert cells.get(40, 14).formula_type == "shared"
+
+
+def test_plan_groups_only_contiguous_runs_with_the_same_key():
+    row_changes = [
+        (12, "=L11+1"),
+        (13, "=M11+1"),
+        (14, "固定"),
+        (15, "=O11+1"),
+        (16, "=P11+1"),
+        (18, "=R11+1"),
+        (19, "=S11+1"),
+        (20, "=$A11+1"),
+    ]
+    specs, next_index = _plan_row_shared_formulas(10, row_changes, 3)
+    assert specs == {
+        12: ("3", "L10:M10"),
+        13: ("3", None),
+        15: ("4", "O10:P10"),
+        16: ("4", None),
+        18: ("5", "R10:S10"),
+        19: ("5", None),
+    }
+    assert next_index == 6
+
+
+@pytest.mark.parametrize(
+    "formula, row_offset, col_offset, expected",
+    [
+        ("L21*2", 0, 2, "N21*2"),
+        ("$A30+L31", 1, 1, "$A31+M32"),
+        ("SUM(L$11:L119)", 3, 1, "SUM(M$11:M122)"),
+        ("'L1 シート'!L1&\"L1\"", 0, 1, "'L1 シート'!M1&\"L1\""),
+        ("LOG10(A1)", 0, 1, "LOG10(B1)"),
+        ("SUM(1:3)", 0, 1, None),
+        ("A1", 0, -1, None),
+    ],
+)
+def test_translate_formula(formula, row_offset, col_offset, expected):
+    assert translate_formula(formula, row_offset, col_offset) == expected
@@ -0,0 +1,92 @@
+import zipfile
+
+from flag_auto_generator_app.sheet_recalc import evaluate_generated_cells
+from flag_auto_generator_app.xlsx_package import _parse_cell_ref
+
+from xlsx_builder import build_xlsx, load_sheet, rows_xml
+
+
+SHEET_NAME = "工程内検査シート"
+TARGET_CELLS = {"A1": 1, "A2": 2, "C5": "=A2*3"}
+
+
+def _evaluate(tmp_path, changes: dict, *, target_cells=TARGET_CELLS, other_cells=None, defined_names=None):
+    sheets = {SHEET_NAME: rows_xml(target_cells)}
+    if other_cells is not None:
+        sheets["集計"] = other_cells if isinstance(other_cells, str) else rows_xml(other_cells)
+    path = build_xlsx(tmp_path / "book.xlsx", sheets, defined_names=defined_names)
+    sheet = load_sheet(path, SHEET_NAME)
+    for ref, value in changes.items():
+        sheet.set_value(*_parse_cell_ref(ref), value)
+    with zipfile.ZipFile(path) as source_zip:
+        return evaluate_generated_cells(sheet, source_zip)
+
+
+def test_no_recalc_when_nothing_depends_on_the_changed_cells(tmp_path):
+    generated = _evaluate(
+        tmp_path,
+        {"B1": "=A1+1", "B2": '=IF(B1>1,"済","")', "D1": "固定"},
+        other_cells={"A1": "=SUM(1,2)", "A2": f"='{SHEET_NAME}'!A2*2"},
+        defined_names={"印刷範囲": "集計!$A$1:$B$2", "_xlnm.Print_Area": f"'{SHEET_NAME}'!$A$1:$Z$99"},
+    )
+    assert generated.needs_full_recalc is False
+    assert generated.values == {(1, 2): 2, (2, 2): "済"}
+
+
+def test_recalc_when_another_sheet_references_a_changed_cell(tmp_path):
+    generated = _evaluate(tmp_path, {"B1": "=A1+1"}, other_cells={"A1": f"='{SHEET_NAME}'!B1*2"})
+    assert generated.needs_full_recalc is True
+    assert "xl/worksheets/sheet2.xml" in generated.reason
+
+
+def test_recalc_when_a_shared_formula_on_another_sheet_reaches_a_changed_cell(tmp_path):
+    # 親セルの式は A1 しか参照しないが、ref の範囲（A1:A3）へ複写されると A3 まで参照する
+    other_rows = (
+        f'<row r="1"><c r="A1"><f t="shared" ref="A1:A3" si="0">\'{SHEET_NAME}\'!B1</f></c></row>'
+        '<row r="2"><c r="A2"><f t="shared" si="0"/></c></row>'
+        '<row r="3"><c r="A3"><f t="shared" si="0"/></c></row>'
+    )
+    generated = _evaluate(tmp_path, {"B3": "=A1+1"}, other_cells=other_rows)
+    assert generated.needs_full_recalc is True
+
+
+def test_recalc_when_a_defined_name_refers_to_the_target_sheet(tmp_path):
+    generated = _evaluate(tmp_path, {"B1": "=A1+1"}, defined_names={"測定範囲": f"'{SHEET_NAME}'!$B$1:$B$9"})
+    assert generated.needs_full_recalc is True
+    assert "測定範囲" in generated.reason
+
+
+def test_recalc_when_an_existing_formula_references_a_changed_cell(tmp_path):
+    generated = _evaluate(tmp_path, {"A2": 5})
+    assert generated.needs_full_recalc is True
+    assert "C5" in generated.reason
+
+
+def test_recalc_when_an_existing_formula_cannot_be_resolved(tmp_path):
+    target_cells = dict(TARGET_CELLS, C6="=OFFSET(A1,1,0)")
+    generated = _evaluate(tmp_path, {"B1": "=A1+1"}, target_cells=target_cells)
+    assert generated.needs_full_recalc is True
+    assert "C6" in generated.reason
+
+
+def test_recalc_when_another_sheet_has_an_unresolvable_formula_on_the_target(tmp_path):
+    generated = _evaluate(
+        tmp_path,
+        {"B1": "=A1+1"},
+        other_cells={"A1": f"=OFFSET('{SHEET_NAME}'!A1,0,0)"},
+    )
+    assert generated.needs_full_recalc is True
+
+
+def test_recalc_when_a_generated_formula_cannot_be_evaluated(tmp_path):
+    generated = _evaluate(tmp_path, {"B1": "=A1+1", "B2": "=VLOOKUP(A1,A1:A2,1,FALSE)", "B3": "=B2+1"})
+    assert generated.needs_full_recalc is True
+    # 評価できた生成セルの値は書き込む。評価できないセルを参照するセルには値を付けない
+    assert generated.values == {(1, 2): 2}
+
+
+def test_unchanged_formula_body_is_not_treated_as_generated(tmp_path):
+    # 元と同じ本文の式を書き直しただけなら、既存の数式として扱う（参照しても再計算は要らない）
+    generated = _evaluate(tmp_path, {"C5": "=A2*3", "B1": "=A1+1"})
+    assert generated.needs_full_recalc is False
+    assert (5, 3) not in generated.values
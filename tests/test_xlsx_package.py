@@ -0,0 +1,157 @@
+import io
+import random
+import zipfile
+import zlib
+
+import pytest
+
+from flag_auto_generator_app import xlsx_package
+from flag_auto_generator_app.xlsx_package import (
+    _MERGED_INDEX_MAX_ROW_SPAN,
+    MergedCellIndex,
+    SheetCells,
+    write_package_with_replacements,
+)
+
+
+class _UnseekableWriter(io.RawIOBase):
+    # 書き込み先がシークできないと、zipfile はデータ記述子（フラグ 0x08）付きでメンバーを書く
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+MEMBERS = {
+    "[Content_Types].xml": (b"<Types/>", zipfile.ZIP_DEFLATED),
+    "xl/media/image1.png": (bytes(range(256)) * 64, zipfile.ZIP_STORED),
+    "xl/worksheets/sheet1.xml": (b"<worksheet>" + b"<row/>" * 5000 + b"</worksheet>", zipfile.ZIP_DEFLATED),
+    "xl/calcChain.xml": (b"<calcChain/>", zipfile.ZIP_DEFLATED),
+    "xl/empty.bin": (b"", zipfile.ZIP_DEFLATED),
+}
+
+
+def _write_source(path, *, data_descriptor: bool):
+    target = _UnseekableWriter() if data_descriptor else open(path, "wb")
+    with zipfile.ZipFile(target, "w") as source_zip:
+        for name, (data, compress_type) in MEMBERS.items():
+            source_zip.writestr(name, data, compress_type=compress_type)
+    if data_descriptor:
+        path.write_bytes(target.buffer.getvalue())
+    else:
+        target.close()
+
+
+def _round_trip(tmp_path, *, data_descriptor: bool = False):
+    source_path = tmp_path / "source.xlsx"
+    out_path = tmp_path / "out.xlsx"
+    _write_source(source_path, data_descriptor=data_descriptor)
+    replaced_parts = {
+        "xl/worksheets/sheet1.xml": b"<worksheet>changed</worksheet>",
+        "xl/calcChain.xml": None,
+        "xl/added.xml": b"<added/>",
+    }
+    with zipfile.ZipFile(source_path) as source_zip:
+        write_package_with_replacements(source_zip, str(out_path), replaced_parts)
+    return source_path, out_path
+
+
+def _assert_package(source_path, out_path):
+    expected = {name: data for name, (data, _) in MEMBERS.items()}
+    expected["xl/worksheets/sheet1.xml"] = b"<worksheet>changed</worksheet>"
+    del expected["xl/calcChain.xml"]
+    expected["xl/added.xml"] = b"<added/>"
+    with zipfile.ZipFile(out_path) as out_zip:
+        assert out_zip.testzip() is None
+        assert out_zip.namelist() == list(expected)
+        for info in out_zip.infolist():
+            data = out_zip.read(info)
+            assert data == expected[info.filename]
+            assert info.CRC == zlib.crc32(data)
+            assert info.file_size == len(data)
+        with zipfile.ZipFile(source_path) as source_zip:
+            assert out_zip.getinfo("xl/media/image1.png").compress_type == zipfile.ZIP_STORED
+            assert (
+                out_zip.getinfo("xl/empty.bin").date_time == source_zip.getinfo("xl/empty.bin").date_time
+            )
+
+
+@pytest.mark.parametrize("data_descriptor", [False, True])
+def test_round_trip_copies_untouched_members_raw(tmp_path, data_descriptor):
+    source_path, out_path = _round_trip(tmp_path, data_descriptor=data_descriptor)
+    _assert_package(source_path, out_path)
+    with zipfile.ZipFile(out_path) as out_zip, zipfile.ZipFile(source_path) as source_zip:
+        # 圧縮済みのまま複写したメンバーは、圧縮後のサイズも元と同じになる
+        for name in ("[Content_Types].xml", "xl/media/image1.png"):
+            assert out_zip.getinfo(name).compress_size == source_zip.getinfo(name).compress_size
+            assert not out_zip.getinfo(name).flag_bits & 0x08
+
+
+def test_round_trip_falls_back_when_zipfile_internals_are_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        xlsx_package,
+        "_RAW_COPY_OUTPUT_ATTRIBUTES",
+        xlsx_package._RAW_COPY_OUTPUT_ATTRIBUTES + ("_attribute_removed_in_a_future_python",),
+    )
+
+    def fail_raw_copy(*args):
+        raise AssertionError("内部属性が無い場合に圧縮済みのまま複写しようとした")
+
+    monkeypatch.setattr(xlsx_package, "_copy_member_raw", fail_raw_copy)
+    source_path, out_path = _round_trip(tmp_path)
+    _assert_package(source_path, out_path)
+
+
+def _merged_ranges(seed: int) -> list[tuple[int, int, int, int]]:
+    """重ならない結合範囲。行ごとの索引に入るものと、行数が上限以上で線形に探すものの両方を含める。"""
+    span = _MERGED_INDEX_MAX_ROW_SPAN
+    ranges = [
+        (1, 1, span, 1),  # 行数 span - 1 の差: 索引に入る最大
+        (1, 2, span + 1, 2),  # 行数の差がちょうど上限: 線形に探す
+        (1, 3, 1048576, 3),  # 列全体の結合
+        (5000, 4, 5000 + span * 3, 6),
+    ]
+    rng = random.Random(seed)
+    while len(ranges) < 300:
+        min_row, min_col = rng.randint(1, 6000), rng.randint(7, 60)
+        candidate = (min_row, min_col, min_row + rng.choice((0, 1, 2, 5, 40)), min_col + rng.choice((0, 1, 3)))
+        if candidate[:2] == candidate[2:]:
+            continue
+        if all(
+            candidate[2] < other[0] or other[2] < candidate[0] or candidate[3] < other[1] or other[3] < candidate[1]
+            for other in ranges
+        ):
+            ranges.append(candidate)
+    return ranges
+
+
+def _brute_force_anchor(ranges, row: int, col: int):
+    for min_row, min_col, max_row, max_col in ranges:
+        if min_row <= row <= max_row and min_col <= col <= max_col:
+            return min_row, min_col
+    return None
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_merged_anchor_matches_a_range_scan(seed):
+    ranges = _merged_ranges(seed)
+    index = MergedCellIndex(ranges)
+    assert sorted(index._tall_ranges) == sorted(ranges[1:4])
+    sheet_cells = SheetCells("xl/worksheets/sheet1.xml", {}, 6000, ranges)
+    probes = set()
+    for min_row, min_col, max_row, max_col in ranges:
+        # 各範囲の四隅とその外側、縦長の範囲は中ほども調べる
+        for row in (min_row - 1, min_row, (min_row + max_row) // 2, max_row, max_row + 1):
+            for col in (min_col - 1, min_col, max_col, max_col + 1):
+                probes.add((row, col))
+    rng = random.Random(seed)
+    probes.update((rng.randint(1, 20000), rng.randint(1, 70)) for _ in range(5000))
+
+    for row, col in probes:
+        expected = _brute_force_anchor(ranges, row, col)
+        assert index.anchor(row, col) == expected, (row, col)
+        assert sheet_cells.merged_anchor(row, col) == expected, (row, col)
@@ -0,0 +1,94 @@
+"""テスト用の小さな xlsx パッケージを XML から組み立てる。"""
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from flag_auto_generator_app.sheet_editor import TargetSheet
+from flag_auto_generator_app.xlsx_package import CALC_CHAIN_PATH, MAIN_NS, REL_NS, _parse_cell_ref, read_sheet_tree
+
+
+_OFFICE_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+_SHEET_CT = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+_CALC_CHAIN_CT = "application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml"
+
+
+def cell_xml(ref: str, value) -> str:
+    """値 1 つ分の `<c>`。`=` で始まる文字列は数式、それ以外の文字列はインライン文字列にする。"""
+    if isinstance(value, str) and value.startswith("="):
+        return f"<c r={quoteattr(ref)}><f>{escape(value[1:])}</f></c>"
+    if isinstance(value, bool):
+        return f'<c r={quoteattr(ref)} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f"<c r={quoteattr(ref)}><v>{value!r}</v></c>"
+    return f'<c r={quoteattr(ref)} t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+
+
+def rows_xml(cells: dict) -> str:
+    """{"A1": 値, ...} から sheetData の中身（行順・列順）を作る。"""
+    rows = {}
+    for ref, value in cells.items():
+        row, col = _parse_cell_ref(ref)
+        rows.setdefault(row, []).append((col, cell_xml(ref, value)))
+    return "".join(
+        f'<row r="{row}">{"".join(xml for _, xml in sorted(rows[row]))}</row>' for row in sorted(rows)
+    )
+
+
+def build_xlsx(
+    path,
+    sheets: dict[str, str],
+    *,
+    defined_names: dict[str, str] | None = None,
+    calc_chain: str | None = None,
+    calc_pr: str = '<calcPr calcId="191029"/>',
+):
+    """シート名→sheetData の中身（`<row>` の XML）から xlsx を書き出す。sheetId は 1 から順に振る。"""
+    sheet_entries = []
+    rel_entries = []
+    overrides = ['<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>']
+    parts = {}
+    for number, (name, rows) in enumerate(sheets.items(), start=1):
+        sheet_entries.append(f'<sheet name={quoteattr(name)} sheetId="{number}" r:id="rId{number}"/>')
+        rel_entries.append(
+            f'<Relationship Id="rId{number}" Type="{_OFFICE_REL_NS}/worksheet" Target="worksheets/sheet{number}.xml"/>'
+        )
+        overrides.append(f'<Override PartName="/xl/worksheets/sheet{number}.xml" ContentType="{_SHEET_CT}"/>')
+        parts[f"xl/worksheets/sheet{number}.xml"] = (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheetData>{rows}</sheetData></worksheet>'
+        )
+    if calc_chain is not None:
+        rel_entries.append(
+            f'<Relationship Id="rId{len(sheets) + 1}" Type="{_OFFICE_REL_NS}/calcChain" Target="calcChain.xml"/>'
+        )
+        overrides.append(f'<Override PartName="/{CALC_CHAIN_PATH}" ContentType="{_CALC_CHAIN_CT}"/>')
+        parts[CALC_CHAIN_PATH] = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<calcChain xmlns="{MAIN_NS}">{calc_chain}</calcChain>'
+    names = "".join(
+        f"<definedName name={quoteattr(name)}>{escape(text)}</definedName>" for name, text in (defined_names or {}).items()
+    )
+    parts["xl/workbook.xml"] = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheets>{"".join(sheet_entries)}</sheets>'
+        f'{f"<definedNames>{names}</definedNames>" if names else ""}{calc_pr}</workbook>'
+    )
+    parts["xl/_rels/workbook.xml.rels"] = f'<Relationships xmlns="{_PKG_REL_NS}">{"".join(rel_entries)}</Relationships>'
+    parts["_rels/.rels"] = (
+        f'<Relationships xmlns="{_PKG_REL_NS}"><Relationship Id="rId1" '
+        f'Type="{_OFFICE_REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+    )
+    parts["[Content_Types].xml"] = (
+        f'<Types xmlns="{_CT_NS}"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        f'<Default Extension="xml" ContentType="application/xml"/>{"".join(overrides)}</Types>'
+    )
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as out_zip:
+        for name in ("[Content_Types].xml", "_rels/.rels", "xl/workbook.xml", "xl/_rels/workbook.xml.rels"):
+            out_zip.writestr(name, parts.pop(name))
+        for name, data in parts.items():
+            out_zip.writestr(name, data)
+    return str(path)
+
+
+def load_sheet(path, sheet_name: str) -> TargetSheet:
+    source_xml, root, cells = read_sheet_tree(str(path), sheet_name)
+    return TargetSheet(source_xml, root, cells, sheet_name)